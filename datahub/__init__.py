@@ -1,4 +1,5 @@
 import os
+import numpy
 from ._version import __version__
 
 def version():
@@ -30,6 +31,31 @@ class Enum():
     def __str__(self):
         return f"{self.id}:{self.desc}"
 
+class Enums():
+    #Batch of enum values, as parallel arrays of ids and descriptions
+    def __init__(self, ids, descs):
+        self.ids = ids
+        self.descs = descs
+        self.dtype = "enum"
+
+    @property
+    def shape(self):
+        return [len(self.ids)]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, numpy.integer)):
+            return Enum(self.ids[index], self.descs[index])
+        if isinstance(index, slice):
+            return Enums(self.ids[index], self.descs[index])
+        return Enums(self.ids[index], [self.descs[i] for i in index])
+
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield Enum(self.ids[i], self.descs[i])
+
 #Bitshuffle (and bsread) need  OMP_NUM_THREADS = 1, otherwise the CPU usage is huge.
 #In case bitshuffle was compiled with OMP, it can be disabled with:
 #os.environ.setdefault("OMP_NUM_THREADS", "1")
@@ -38,6 +64,8 @@ from datahub.utils.timing import *
 from datahub.utils.net import *
 from datahub.utils.compression import *
 from datahub.utils.range import QueryRange
+from datahub.utils.cache import RetrievalCache
+from datahub.utils.checkpoint import Checkpoint
 from datahub.source import Source
 from datahub.sources.retrieval import Retrieval
 from datahub.sources.bsread import Bsread, BsreadStream
@@ -50,7 +78,7 @@ from datahub.sources.dispatcher import Dispatcher
 from datahub.sources.daqbuf import Daqbuf
 from datahub.sources.stddaq import Stddaq
 from datahub.sources.redis import Redis, RedisStream
-from datahub.consumer import Consumer
+from datahub.consumer import Consumer, QueuePolicy
 from datahub.consumers.h5 import HDF5Writer
 from datahub.consumers.txt import TextWriter
 from datahub.consumers.stdout import Stdout
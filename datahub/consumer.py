@@ -1,13 +1,33 @@
+import logging
+import collections
+import threading
+import time
+import numpy
 from datahub.utils.timing import convert_timestamp
 from datahub import str_to_bool
 
+_logger = logging.getLogger(__name__)
+
+class QueuePolicy:
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    COALESCE = "coalesce"
+
 class Consumer:
     instances = set()
 
-    def __init__(self, timetype=None, append=False, **kwargs):
+    def __init__(self, timetype=None, append=False, queue_policy=None, queue_size=1000, **kwargs):
+        """
+        queue_policy (str, optional): if defined, events are processed in a dedicated thread, fed by a bounded queue.
+                                      Behaviour on full queue: "block", "drop_oldest", "drop_newest" or "coalesce"
+                                      (keeps only the latest pending record of each channel).
+        queue_size (int, optional): size of the event queue.
+        """
         Consumer.instances.add(self)
         self.time_type = timetype
         self.append = str_to_bool(append)
+        self.queue = ConsumerQueue(self, queue_policy, int(queue_size)) if queue_policy else None
 
     def on_start(self, source):
         pass
@@ -18,9 +38,23 @@ class Consumer:
     def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
         pass
 
+    def on_channel_records(self, source, name, timestamps, pulse_ids, values, **kwargs):
+        #Batch of records: arguments are sequences of equal size. By default forwarded record by record.
+        if isinstance(timestamps, numpy.ndarray):
+            timestamps = timestamps.tolist()
+        if isinstance(pulse_ids, numpy.ndarray):
+            pulse_ids = pulse_ids.tolist()
+        for i in range(len(values)):
+            self.on_channel_record(source, name, timestamps[i], None if pulse_ids is None else pulse_ids[i], values[i],
+                                   **{key: arg[i] for key, arg in kwargs.items()})
+
     def on_channel_completed(self, source, name):
         pass
 
+    def on_checkpoint(self, source, ack):
+        #Called when the source saves its progress: ack is to be called once the data received is stored
+        ack()
+
     def on_stop(self, source, exception):
         pass
 
@@ -36,7 +70,19 @@ class Consumer:
     def convert_time(self, timestamp, time_type):
         return convert_timestamp(timestamp, time_type, self.time_type)
 
+    def get_listener(self):
+        #Object registered in the sources: the event queue, if enabled
+        queue = getattr(self, "queue", None)
+        return self if queue is None else queue
+
+    def get_queue_stats(self):
+        queue = getattr(self, "queue", None)
+        return None if queue is None else queue.get_stats()
+
     def close(self):
+        queue = getattr(self, "queue", None)
+        if queue is not None:
+            queue.stop()
         self.on_close()
         if self in Consumer.instances:
             Consumer.instances.remove(self)
@@ -51,3 +97,172 @@ class Consumer:
     def cleanup():
         for consumer in list(Consumer.instances):
             consumer.close()
+
+
+class ConsumerQueue:
+    """
+    Forwards source events to a consumer through a bounded queue, processed by a worker thread.
+    Only record events are subject to the queue policy: control events are never dropped.
+    """
+    RECORD_EVENTS = "on_channel_record", "on_channel_records"
+
+    def __init__(self, consumer, policy=QueuePolicy.BLOCK, size=1000):
+        if policy not in (QueuePolicy.BLOCK, QueuePolicy.DROP_OLDEST, QueuePolicy.DROP_NEWEST, QueuePolicy.COALESCE):
+            raise ValueError(f"Invalid queue policy: {policy}")
+        self.consumer = consumer
+        self.policy = policy
+        self.size = max(size, 1)
+        self.events = collections.deque()
+        self.pending = {}  # Coalesced record events, by (source, channel)
+        self.records = 0
+        self.condition = threading.Condition()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.latency_max = 0.0
+        self.latency_sum = 0.0
+        self.process_time_sum = 0.0
+        self.running = True
+        self.busy = False
+        self.thread = threading.Thread(target=self._run, name=f"{type(consumer).__name__} queue", daemon=True)
+        self.thread.start()
+
+    @property
+    def time_type(self):
+        return self.consumer.time_type
+
+    def on_start(self, source):
+        self._put("on_start", (source,))
+
+    def on_channel_header(self, source, name, typ, byteOrder, shape, channel_compression, metadata):
+        self._put("on_channel_header", (source, name, typ, byteOrder, shape, channel_compression, metadata))
+
+    def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
+        if source.has_reused_values():
+            #The source overwrites the buffer before the queued record is processed
+            value = numpy.copy(value)
+        self._put("on_channel_record", (source, name, timestamp, pulse_id, value), kwargs)
+
+    def on_channel_records(self, source, name, timestamps, pulse_ids, values, **kwargs):
+        if source.has_reused_values():
+            values = numpy.copy(values) if isinstance(values, numpy.ndarray) else [numpy.copy(value) for value in values]
+        self._put("on_channel_records", (source, name, timestamps, pulse_ids, values), kwargs)
+
+    def on_channel_completed(self, source, name):
+        self._put("on_channel_completed", (source, name))
+
+    def on_checkpoint(self, source, ack):
+        self._put("on_checkpoint", (source, ack))
+
+    def on_stop(self, source, exception):
+        self._put("on_stop", (source, exception))
+
+    def close(self):
+        self.consumer.close()
+
+    def _put(self, kind, args, kwargs={}):
+        record = kind in ConsumerQueue.RECORD_EVENTS
+        with self.condition:
+            if not self.running:
+                return
+            if record:
+                self.received += 1
+                if self.policy == QueuePolicy.COALESCE:
+                    event = self.pending.get(args[:2])
+                    if event is not None:
+                        event[0], event[1], event[2] = kind, args, kwargs
+                        self.dropped += 1
+                        return
+                if self.records >= self.size:
+                    if self.policy == QueuePolicy.BLOCK:
+                        while self.running and self.records >= self.size:
+                            self.condition.wait()
+                    elif self.policy == QueuePolicy.DROP_NEWEST:
+                        self.dropped += 1
+                        return
+                    else:
+                        self._drop_oldest()
+                event = [kind, args, kwargs, time.time()]
+                self.records += 1
+                if self.policy == QueuePolicy.COALESCE:
+                    self.pending[args[:2]] = event
+            else:
+                #Records received before a control event are not coalesced with the following ones
+                self.pending.clear()
+                event = [kind, args, kwargs, time.time()]
+            self.events.append(event)
+            self.max_depth = max(self.max_depth, len(self.events))
+            self.condition.notify_all()
+
+    def _drop_oldest(self):
+        for i, event in enumerate(self.events):
+            if event[0] in ConsumerQueue.RECORD_EVENTS:
+                del self.events[i]
+                if self.pending.get(event[1][:2]) is event:
+                    del self.pending[event[1][:2]]
+                self.records -= 1
+                self.dropped += 1
+                return
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.events:
+                    self.condition.wait()
+                if not self.events:
+                    return
+                event = self.events.popleft()
+                kind, args, kwargs, queued = event
+                if kind in ConsumerQueue.RECORD_EVENTS:
+                    self.records -= 1
+                    if self.pending.get(args[:2]) is event:
+                        del self.pending[args[:2]]
+                self.busy = True
+                self.condition.notify_all()
+            start = time.time()
+            try:
+                getattr(self.consumer, kind)(*args, **kwargs)
+            except Exception as e:
+                _logger.exception("Error processing %s on listener %s: %s" % (kind, str(self.consumer), str(e)))
+            end = time.time()
+            with self.condition:
+                self.busy = False
+                if kind in ConsumerQueue.RECORD_EVENTS:
+                    self.processed += 1
+                    #Latency: from the reception of the record to the end of its processing
+                    self.latency_max = max(self.latency_max, end - queued)
+                    self.latency_sum += end - queued
+                    self.process_time_sum += end - start
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        #Waits until all queued events are processed
+        end = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.events or self.busy:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def stop(self):
+        if self.thread.is_alive() and self.thread != threading.current_thread():
+            self.flush()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread != threading.current_thread():
+            self.thread.join()
+
+    def get_depth(self):
+        return len(self.events)
+
+    def get_stats(self):
+        with self.condition:
+            processed = max(self.processed, 1)
+            return {"policy": self.policy, "size": self.size, "depth": len(self.events), "max_depth": self.max_depth,
+                    "received": self.received, "processed": self.processed, "dropped": self.dropped,
+                    "latency_max": self.latency_max, "latency_mean": self.latency_sum / processed,
+                    "process_time_mean": self.process_time_sum / processed}
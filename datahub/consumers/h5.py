@@ -3,14 +3,36 @@ import h5py
 import numpy
 import datetime
 import threading
+import collections
+import zlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datahub.utils.timing import convert_timestamp
-from datahub import Consumer, Compression, bitshuffle_compression_lz4, decompress, str_to_bool
+from datahub import Consumer, QueuePolicy, Enums, Compression, bitshuffle_compression_lz4, decompress, str_to_bool
 
 _logger = logging.getLogger(__name__)
 
 class HDF5Writer(Consumer):
 
-    def __init__(self, filename: str, default_compression=Compression.GZIP, auto_decompress=False, path=None, metadata_compression=Compression.GZIP, **kwargs):
+    def __init__(self, filename: str, default_compression=Compression.GZIP, auto_decompress=False, path=None, metadata_compression=Compression.GZIP, asynchronous=False, compression_workers=0, chunk_size=None, chunks=None, swmr=False, flush_interval=1.0, flush_records=None, **kwargs):
+        """
+        asynchronous (bool, optional): if True, records are written by a dedicated thread, which owns the file, fed by
+                                       a bounded queue (of queue_size records). Sources then keep receiving while
+                                       chunks are compressed and written. Equivalent to queue_policy="block".
+        compression_workers (int, optional): if greater than 0, gzip-compressed values are compressed by a pool of
+                                             threads, and the compressed chunks written directly to the file.
+        chunk_size (int, optional): target size of the dataset chunks in bytes. Default is 1 MiB.
+        chunks (dict, optional): chunk shape of the values of given channels, overriding chunk_size, e.g.
+                                 {"CAMERA:FPICTURE": (1, 256, 256)} stores images in tiles of 256x256.
+        swmr (bool, optional): if True, the file is written in single-writer/multiple-reader mode, and can be read
+                               while being written. SWMR mode is enabled on the first flush: channels starting after
+                               it, or changing format, cannot be added to the file and their records are ignored
+                               (a warning is logged once per channel). Attributes set on stop are written on close.
+        flush_interval (float, optional): in SWMR mode, maximum time in seconds between flushes of the datasets.
+        flush_records (int, optional): in SWMR mode, maximum number of records between flushes of the datasets.
+        """
+        if str_to_bool(str(asynchronous)) and not kwargs.get("queue_policy", None):
+            kwargs["queue_policy"] = QueuePolicy.BLOCK
         Consumer.__init__(self, **kwargs)
         self.nbytes_read = 0
         self.filename = filename
@@ -27,23 +49,75 @@ class HDF5Writer(Consumer):
                 path = "/" + path
             self.path = path
         self.datasets = {}
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()
+        self.compression_workers = int(compression_workers)
+        self.executor = None
+        self.chunk_size = int(chunk_size) if chunk_size else None
+        self.chunks = {channel: tuple(int(n) for n in shape) for channel, shape in (chunks or {}).items()}
+        self.swmr = str_to_bool(str(swmr))
+        self.flush_interval = float(flush_interval) if flush_interval else None
+        self.flush_records = int(flush_records) if flush_records else None
+        self.swmr_enabled = False
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+        self.deferred_attrs = []
+        self.headers = {}
+        self.rejected = set()
 
     def on_start(self, source):
         with self.lock:
             if self.file is None:
                 try:
-                    self.file = h5py.File(self.filename, "a" if self.append else "w")
+                    self.file = self.open_file("a" if self.append else "w")
                     now_date = datetime.datetime.now(datetime.timezone.utc)
                     self.file.attrs["creation"] = now_date.isoformat()
                 except Exception as ex:
                     _logger.exception("Error creating file: %s " % str(self.filename))
 
 
+    def open_file(self, mode):
+        if self.swmr:
+            return h5py.File(self.filename, mode, libver="latest")
+        return h5py.File(self.filename, mode)
+
     def on_stop(self, source, exception):
         if self.file is not None:
             if self.get_path(source) in self.file :
-                self.file[self.get_path(source)].attrs["status"] = source.get_run_status()
+                self.set_attr(self.get_path(source), "status", source.get_run_status())
+            self.write_stream_stats(source)
+
+    def set_attr(self, group, key, value):
+        #Attributes cannot be added in SWMR mode: they are written when the file is closed
+        if self.swmr_enabled:
+            self.deferred_attrs.append((group, key, value))
+        else:
+            self.file[group].attrs[key] = value
+
+    def write_stream_stats(self, source):
+        #Stream health is stored as attributes of the source group, or of the channel group for channel streams
+        for name, stats in source.get_stream_stats().items():
+            group = self.get_path(source) if name is None else f"{self.get_path(source)}/{name}"
+            if group not in self.file:
+                continue
+            for key, value in stats.items():
+                if value is not None:
+                    self.set_attr(group, f"stream_{key}", value)
+
+    def get_write_stats(self):
+        #Queue depth and write latency, in asynchronous mode
+        return self.get_queue_stats()
+
+    def get_executor(self):
+        if self.compression_workers > 0 and self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.compression_workers, thread_name_prefix="HDF5 compression")
+        return self.executor
+
+    def get_chunks(self, name, shape):
+        #Chunk shape of the channel values, if overridden. A shape without the record dimension is a tile of a record.
+        chunks = self.chunks.get(name, None)
+        if chunks is not None and len(chunks) == len(shape or ()):
+            chunks = (1,) + chunks
+        return chunks
 
     def get_path(self, source):
         if self.path and not source.path:
@@ -63,6 +137,32 @@ class HDF5Writer(Consumer):
                 break
         return name
 
+    def get_resumed_group(self, source, name, typ, shape):
+        #Resumed queries appended to a file extend the existing datasets of the channels, if of the same format
+        if not (self.append and source.is_resuming()):
+            return None
+        group = f"{self.get_path(source)}/{name}"
+        if group in self.file and self.file[group].attrs.get("type", None) == str(typ) and \
+                self.file[group].attrs.get("shape", None) == str(shape):
+            if self.time_type == "str":
+                #String timestamps cannot be compared to the checkpoint to discard the records received again
+                _logger.warning("Cannot resume channel %s with string timestamps: records are written to a new group" % name)
+                return None
+            return name
+        return None
+
+    def truncate_datasets(self, source, name):
+        #Discards the records stored after the checkpoint, as they are received again
+        ts_ds, id_ds, val_ds = self.datasets[source][name]
+        last = source.get_checkpoint_last(name)
+        if last is None:
+            size = 0
+        else:
+            size = int(numpy.searchsorted(ts_ds.dataset[:ts_ds.nwritten], convert_timestamp(last, self.time_type, "nano"), side="right"))
+        for dataset in [ts_ds, id_ds] + list(val_ds if type(val_ds) is tuple else (val_ds,)):
+            if dataset is not None:
+                dataset.truncate(size)
+
     def get_time_fmt(self):
         if self.time_type == "str":
             return "str"
@@ -74,15 +174,31 @@ class HDF5Writer(Consumer):
     def on_channel_header(self, source, name, typ, byteOrder, shape, channel_compression, metadata):
         if self.file is None:
             self.on_start(source)
+        header = (str(typ), tuple(shape or ()), channel_compression)
+        if self.swmr_enabled:
+            if self.headers.get((source, name), None) == header:
+                #Unchanged format (e.g. header resent after dropped messages): keeps writing the same datasets
+                return
+            if (source, name) not in self.rejected:
+                _logger.warning("Cannot add channel %s to file in SWMR mode: records are ignored" % name)
+                if name in self.datasets.get(source, {}):
+                    self.close_datasets(source, name)
+                self.rejected.add((source, name))
+            return
+        self.headers[(source, name)] = header
+        #Delays enabling SWMR mode, so that channels starting together are added to the file
+        self.last_flush = time.monotonic()
 
-        prefix, channel = self.get_path(source), self.get_group(source, name)
+        resumed = self.get_resumed_group(source, name, typ, shape)
+        resume = resumed is not None
+        prefix, channel = self.get_path(source), resumed if resume else self.get_group(source, name)
         has_id = metadata.get("has_id", True)
         enum = typ == "enum"
         dtype = numpy.int64 if enum else typ
         time_fmt = self.get_time_fmt()
-        ts_ds = Dataset(prefix, channel, "timestamp", self.file, dtype=time_fmt, dataset_compression=self.metadata_compression)
+        ts_ds = Dataset(prefix, channel, "timestamp", self.file, dtype=time_fmt, dataset_compression=self.metadata_compression, chunk_bytes=self.chunk_size, overallocate=not self.swmr, resume=resume)
         ts_ds.enum = enum
-        id_ds = Dataset(prefix, channel, "id", self.file, dtype=numpy.int64, dataset_compression=self.metadata_compression) if has_id else None
+        id_ds = Dataset(prefix, channel, "id", self.file, dtype=numpy.int64, dataset_compression=self.metadata_compression, chunk_bytes=self.chunk_size, overallocate=not self.swmr, resume=resume) if has_id else None
         data_ds_name = "value"
         dataset_compression = self.default_compression
         if channel_compression and (not self.auto_decompress):
@@ -90,19 +206,21 @@ class HDF5Writer(Consumer):
                 raise RuntimeError(f"Compression not supported on scalars")
             if channel_compression != Compression.BITSHUFFLE_LZ4:
                 raise RuntimeError(f"Compression not supported: " + channel_compression)
-            val_ds = DirectChunkWriteDataset(prefix, channel, data_ds_name, self.file,shape, dtype, channel_compression, dataset_compression=Compression.BITSHUFFLE_LZ4)
+            val_ds = DirectChunkWriteDataset(prefix, channel, data_ds_name, self.file,shape, dtype, channel_compression, dataset_compression=Compression.BITSHUFFLE_LZ4, overallocate=not self.swmr, resume=resume)
             dataset_compression = Compression.BITSHUFFLE_LZ4
         else:
-            val_ds = Dataset(prefix, channel, data_ds_name, self.file, shape, dtype, channel_compression, dataset_compression=self.default_compression)
+            executor = self.get_executor()
+            chunks = self.get_chunks(name, shape)
+            val_ds = Dataset(prefix, channel, data_ds_name, self.file, shape, dtype, channel_compression, chunks=chunks, dataset_compression=self.default_compression, executor=executor, compression_workers=self.compression_workers, chunk_bytes=self.chunk_size, overallocate=not self.swmr, resume=resume)
             if metadata.get("bins", None):
-                min_ds = Dataset(prefix, channel, "min", self.file, shape, typ, channel_compression, dataset_compression=self.default_compression)
-                max_ds = Dataset(prefix, channel, "max", self.file, shape, typ, channel_compression, dataset_compression=self.default_compression)
-                cnt_ds = Dataset(prefix, channel, "count", self.file, dtype=numpy.int64, dataset_compression=self.metadata_compression)
-                start_ds = Dataset(prefix, channel, "start", self.file, dtype=time_fmt, dataset_compression=self.metadata_compression)
-                end_ds = Dataset(prefix, channel, "end", self.file, dtype=time_fmt, dataset_compression=self.metadata_compression)
+                min_ds = Dataset(prefix, channel, "min", self.file, shape, typ, channel_compression, chunks=chunks, dataset_compression=self.default_compression, executor=executor, compression_workers=self.compression_workers, chunk_bytes=self.chunk_size, overallocate=not self.swmr, resume=resume)
+                max_ds = Dataset(prefix, channel, "max", self.file, shape, typ, channel_compression, chunks=chunks, dataset_compression=self.default_compression, executor=executor, compression_workers=self.compression_workers, chunk_bytes=self.chunk_size, overallocate=not self.swmr, resume=resume)
+                cnt_ds = Dataset(prefix, channel, "count", self.file, dtype=numpy.int64, dataset_compression=self.metadata_compression, chunk_bytes=self.chunk_size, overallocate=not self.swmr, resume=resume)
+                start_ds = Dataset(prefix, channel, "start", self.file, dtype=time_fmt, dataset_compression=self.metadata_compression, chunk_bytes=self.chunk_size, overallocate=not self.swmr, resume=resume)
+                end_ds = Dataset(prefix, channel, "end", self.file, dtype=time_fmt, dataset_compression=self.metadata_compression, chunk_bytes=self.chunk_size, overallocate=not self.swmr, resume=resume)
                 val_ds = val_ds, min_ds, max_ds, cnt_ds, start_ds, end_ds
             elif enum:
-                val_dstr = Dataset(prefix, channel, data_ds_name + "_string", self.file, shape, "str",channel_compression, dataset_compression=self.default_compression)
+                val_dstr = Dataset(prefix, channel, data_ds_name + "_string", self.file, shape, "str",channel_compression, dataset_compression=self.default_compression, chunk_bytes=self.chunk_size, overallocate=not self.swmr, resume=resume)
                 val_ds = val_ds, val_dstr
 
         if not self.datasets.get(source, None):
@@ -116,6 +234,8 @@ class HDF5Writer(Consumer):
                 for key in source.query.keys():
                     self.file[f"{prefix}"].attrs[key] = str(source.query[key])
         self.datasets[source][name] = [ts_ds, id_ds, val_ds]
+        if resume:
+            self.truncate_datasets(source, name)
         self.file[f"{prefix}/{channel}"].attrs["name"] = str(name)
         self.file[f"{prefix}/{channel}"].attrs["type"] = str(typ)
         self.file[f"{prefix}/{channel}"].attrs["byteOrder"] = str(byteOrder)
@@ -125,6 +245,12 @@ class HDF5Writer(Consumer):
             self.file[f"{prefix}/{channel}"].attrs[key] = metadata[key]
 
     def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
+        if (source, name) in self.rejected:
+            return
+        with self.lock:
+            self.write_record(source, name, timestamp, pulse_id, value, **kwargs)
+
+    def write_record(self, source, name, timestamp, pulse_id, value, **kwargs):
         [ts_ds, id_ds, val_ds] = self.datasets[source][name]
         if ts_ds:
             ts_ds.append(timestamp)
@@ -143,9 +269,65 @@ class HDF5Writer(Consumer):
             val_dstr.append(value.desc)
             value = value.id
         val_ds.append(value)
+        self.check_flush()
+
+    def on_channel_records(self, source, name, timestamps, pulse_ids, values, **kwargs):
+        if (source, name) in self.rejected:
+            return
+        [ts_ds, id_ds, val_ds] = self.datasets[source][name]
+        if kwargs or (ts_ds.enum and not isinstance(values, Enums)) or (type(val_ds) is tuple and not ts_ds.enum):
+            return Consumer.on_channel_records(self, source, name, timestamps, pulse_ids, values, **kwargs)
+        with self.lock:
+            self.write_records(source, name, timestamps, pulse_ids, values)
+
+    def write_records(self, source, name, timestamps, pulse_ids, values):
+        [ts_ds, id_ds, val_ds] = self.datasets[source][name]
+        ts_ds.extend(timestamps)
+        if id_ds:
+            id_ds.extend(pulse_ids)
+        if ts_ds.enum:
+            val_ds, val_dstr = val_ds
+            val_dstr.extend(values.descs)
+            values = values.ids
+        val_ds.extend(values)
+        self.check_flush(len(values))
+
+    def check_flush(self, records=1):
+        if not self.swmr:
+            return
+        self.unflushed += records
+        if (self.flush_records and (self.unflushed >= self.flush_records)) or \
+                (self.flush_interval and (time.monotonic() - self.last_flush >= self.flush_interval)):
+            self.flush()
+
+    def flush_datasets(self, source=None):
+        for datasets in (list(self.datasets.values()) if source is None else [self.datasets.get(source, {})]):
+            for dataset in [d for ds in list(datasets.values()) for d in ds]:
+                for d in (dataset if type(dataset) is tuple else (dataset,)):
+                    if d is not None:
+                        d.sync()
+
+    def on_checkpoint(self, source, ack):
+        #The progress of the source is saved after its buffered records are written to the file
+        with self.lock:
+            if self.file is not None:
+                self.flush_datasets(source)
+                self.file.flush()
+        ack()
+
+    def flush(self):
+        #Writes the buffered records to the file, making them visible to SWMR readers
+        self.flush_datasets()
+        if self.swmr and not self.swmr_enabled:
+            self.file.swmr_mode = True
+            self.swmr_enabled = True
+        self.file.flush()
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
 
     def on_channel_completed(self, source, name):
-        self.close_datasets(source, name)
+        with self.lock:
+            self.close_datasets(source, name)
 
     def close_datasets(self, source=None, name=None):
         if source is None:
@@ -171,8 +353,19 @@ class HDF5Writer(Consumer):
 
     def on_close(self):
         self.close_datasets()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
         try:
             if self.file:
+                if self.swmr_enabled:
+                    #Reopens the file out of SWMR mode to write the deferred attributes
+                    self.file.close()
+                    self.file = self.open_file("a")
+                    self.swmr_enabled = False
+                    for group, key, value in self.deferred_attrs:
+                        self.file[group].attrs[key] = value
+                    self.deferred_attrs = []
                 now_date = datetime.datetime.now(datetime.timezone.utc)
                 self.file.attrs["conclusion"] = now_date.isoformat()
                 self.file.close()
@@ -183,9 +376,37 @@ class HDF5Writer(Consumer):
 
 
 
+def compress_chunk(buf, shuffle, level):
+    #Applies the HDF5 shuffle and deflate filters to a chunk buffer, releasing the GIL
+    data = buf.view(numpy.uint8).reshape(-1, buf.dtype.itemsize).T if shuffle else buf.view(numpy.uint8)
+    return zlib.compress(numpy.ascontiguousarray(data), level)
+
+
 class Dataset:
+    """
+    Appends records to an HDF5 dataset. The dataset grows geometrically (by GROWTH_FACTOR, limited to GROWTH_MAX_STEP
+    records if defined) and is trimmed to the number of records on close. While open, the number of valid records
+    is stored in the attribute "valid_length". If overallocate is False (for SWMR readers, which rely on the dataset
+    shape), the dataset is resized to the number of records on every flush.
+    """
     STRING_TYPE = h5py.string_dtype()
-    def __init__(self, prefix, channel, field, h5file, shape=None, dtype=None, channel_compression=None, chunks=None, dataset_compression=Compression.GZIP, compression_opts=None, shuffle=True):
+    DEFAULT_GZIP_LEVEL = 4
+    CHUNK_BYTES = 1024 * 1024
+    INITIAL_BUFFER = 64
+    GROWTH_FACTOR = 2.0
+    GROWTH_MAX_STEP = None
+    def __init__(self, prefix, channel, field, h5file, shape=None, dtype=None, channel_compression=None, chunks=None, dataset_compression=Compression.GZIP, compression_opts=None, shuffle=True, executor=None, compression_workers=1, chunk_bytes=None, overallocate=True, resume=False):
+        """
+        chunks (tuple, optional): chunk shape, with the number of records as first dimension. The other dimensions
+                                  can be smaller than the record shape, tiling large images. If None, chunks hold
+                                  whole records, with the number of records given by chunk_bytes.
+        executor (Executor, optional): if defined, full chunks are compressed in the executor and written with
+                                       write_direct_chunk. Only used with gzip compression.
+        compression_workers (int, optional): number of threads of the executor, bounding the chunks pending.
+        chunk_bytes (int, optional): target chunk size in bytes. Default is CHUNK_BYTES.
+        overallocate (bool, optional): if False, the dataset is not grown beyond the records written.
+        resume (bool, optional): if True and the dataset exists, records are appended to it.
+        """
         self.channel_compression = channel_compression
         self.dataset_compression = dataset_compression
         self.compression_opts=compression_opts
@@ -206,32 +427,32 @@ class Dataset:
             self.dtype = numpy.dtype(dtype)
 
         if chunks is None:
-            if len(shape) == 0:
-                if self.is_string():
-                    chunks = (1 * 1024,)
-                else:
-                    chunks = (8 * 1024,)
-            elif len(shape) == 1:
-                if self.is_string():
-                    n = 1 * 1024 // shape[0]
-                else:
-                    n = 16 * 1024 // shape[0]
-                if n < 2:
-                    n = 2
-                chunks = (n,) + shape
-            elif len(shape) == 2:
-                n = 32 * 1024 // shape[0] // shape[1]
-                if n < 2:
-                    n = 2
-                chunks = (n,) + shape
-            else:
-                raise RuntimeError(f"unsupported shape {shape}")
+            chunks = self.get_chunks(shape, chunk_bytes if chunk_bytes else Dataset.CHUNK_BYTES)
 
         self.chunks = None if (chunks is None) else tuple(chunks)
-        self.dataset = self.h5file.create_dataset(f"{prefix}/{channel}/{field}", (0,) + self. shape, maxshape=(None,) + self.shape, dtype=self.dtype , chunks=self.chunks, shuffle=shuffle, compression=self.dataset_compression , compression_opts=self.compression_opts)
-        self.buf = numpy.zeros(shape=self.chunks, dtype=self.dtype)
+        path = f"{prefix}/{channel}/{field}"
+        resume = resume and (path in self.h5file)
+        if resume:
+            self.dataset = self.h5file[path]
+            self.chunks = self.dataset.chunks
+        else:
+            self.dataset = self.h5file.create_dataset(path, (0,) + self. shape, maxshape=(None,) + self.shape, dtype=self.dtype , chunks=self.chunks, shuffle=shuffle, compression=self.dataset_compression , compression_opts=self.compression_opts)
+        #The buffer holds the records of a chunk: it is allocated small and grows up to the chunk size
+        self.rows = self.chunks[0]
+        self.buf = numpy.zeros(shape=(min(self.rows, Dataset.INITIAL_BUFFER),) + self.shape, dtype=self.dtype)
         self.nbuf = 0
         self.nwritten = 0
+        self.shuffle = shuffle
+        self.capacity = 0
+        self.overallocate = overallocate
+        if resume:
+            self.capacity = len(self.dataset)
+            self.nwritten = int(self.dataset.attrs.get("valid_length", self.capacity))
+        parallel = (executor is not None) and (self.dataset_compression == Compression.GZIP) and not self.is_string() \
+                   and (self.chunks[1:] == self.shape)
+        self.executor = executor if parallel else None
+        self.pending = collections.deque()
+        self.max_pending = 2 * max(int(compression_workers), 1)
 
     def append(self, v):
         if self.channel_compression:
@@ -240,20 +461,120 @@ class Dataset:
             if self.shape:
                 if v is not None:
                     v = numpy.reshape(numpy.frombuffer(v, dtype=self.dtype), self.shape)
-        if self.nbuf >= len(self.buf):
-            self.flush()
+        if self.nbuf >= min(len(self.buf), self.get_limit()):
+            self.grow_buffer()
         self.buf[self.nbuf] = v
         self.nbuf += 1
 
+    def get_limit(self):
+        #Records up to the end of the current chunk: flushes after partial ones (e.g. on checkpoints) realign
+        return self.rows - (self.nwritten % self.rows)
+
+    def get_chunks(self, shape, chunk_bytes):
+        if len(shape) > 2:
+            raise RuntimeError(f"unsupported shape {shape}")
+        if self.is_string():
+            n = 1 * 1024 // (shape[0] if shape else 1)
+            return (max(n, 2 if shape else 1),) + shape
+        n = chunk_bytes // (self.dtype.itemsize * int(numpy.prod(shape)))
+        return (max(n, 1),) + shape
+
+    def grow_buffer(self):
+        #Flushes the buffer if it reached the end of the chunk, otherwise doubles it
+        if self.nbuf >= self.get_limit() or len(self.buf) >= self.rows:
+            self.flush()
+            return
+        buf = numpy.zeros(shape=(min(2 * len(self.buf), self.rows),) + self.shape, dtype=self.dtype)
+        buf[:self.nbuf] = self.buf[:self.nbuf]
+        self.buf = buf
+
+    def extend(self, values):
+        if self.channel_compression:
+            for v in values:
+                self.append(v)
+            return
+        if not self.is_string():
+            values = numpy.asarray(values, dtype=self.dtype).reshape((-1,) + self.shape)
+        size, index = len(values), 0
+        while index < size:
+            if self.nbuf >= min(len(self.buf), self.get_limit()):
+                self.grow_buffer()
+            n = min(size - index, min(len(self.buf), self.get_limit()) - self.nbuf)
+            self.buf[self.nbuf:self.nbuf + n] = values[index:index + n]
+            self.nbuf += n
+            index += n
+
     def flush(self):
+        if self.executor is not None and self.nbuf == self.rows and (self.nwritten % self.rows == 0):
+            return self.flush_parallel()
+        self.write_pending()
         nn = self.nwritten + self.nbuf
-        self.dataset.resize((nn,) + self.shape)
+        self.reserve(nn)
         self.dataset[self.nwritten:nn] = self.buf[:self.nbuf]
         self.nwritten = nn
         self.nbuf = 0
+        self.set_valid_length()
+
+    def reserve(self, size):
+        #Grows the dataset to hold size records, returning True if resized
+        if size <= self.capacity:
+            return False
+        if not self.overallocate:
+            self.capacity = size
+            self.dataset.resize((self.capacity,) + self.shape)
+            return True
+        step = self.capacity * (Dataset.GROWTH_FACTOR - 1)
+        if Dataset.GROWTH_MAX_STEP:
+            step = min(step, Dataset.GROWTH_MAX_STEP)
+        capacity = max(size, int(self.capacity + step))
+        chunk = self.chunks[0] if self.chunks else 1
+        self.capacity = -(-capacity // chunk) * chunk
+        self.dataset.resize((self.capacity,) + self.shape)
+        return True
+
+    def set_valid_length(self):
+        if self.overallocate:
+            self.dataset.attrs["valid_length"] = self.nwritten
+
+    def truncate(self, size):
+        self.write_pending()
+        self.nwritten = min(self.nwritten, size)
+        self.trim()
+
+    def trim(self):
+        if self.capacity != self.nwritten:
+            self.dataset.resize((self.nwritten,) + self.shape)
+            self.capacity = self.nwritten
+        self.set_valid_length()
+
+    def flush_parallel(self):
+        #The full buffer is handed to the executor and replaced by a new one
+        level = Dataset.DEFAULT_GZIP_LEVEL if self.compression_opts is None else self.compression_opts
+        future = self.executor.submit(compress_chunk, self.buf, self.shuffle, level)
+        self.pending.append((self.nwritten, future))
+        self.nwritten += self.nbuf
+        self.buf = numpy.empty(shape=(self.rows,) + self.shape, dtype=self.dtype)
+        self.nbuf = 0
+        while len(self.pending) > self.max_pending:
+            self.write_chunk(*self.pending.popleft())
+
+    def write_chunk(self, index, future):
+        self.reserve(self.nwritten)
+        self.dataset.id.write_direct_chunk((index,) + (0,) * len(self.shape), future.result())
+
+    def write_pending(self):
+        while self.pending:
+            self.write_chunk(*self.pending.popleft())
+
+    def sync(self):
+        #Writes the buffered and pending records, and flushes the dataset to the file
+        self.flush()
+        self.write_pending()
+        self.dataset.flush()
 
     def close(self):
         self.flush()
+        self.trim()
 
     def is_string(self):
         return self.dtype == Dataset.STRING_TYPE
@@ -268,17 +589,19 @@ class StringDataset(Dataset):
 
 class DirectChunkWriteDataset(Dataset):
 
-    def __init__(self, prefix, channel, field, h5file, shape, dtype, channel_compression, dataset_compression):
+    def __init__(self, prefix, channel, field, h5file, shape, dtype, channel_compression, dataset_compression, overallocate=True, resume=False):
         shape = tuple(shape)
         chunks = (1,) + shape
         block_size = 0
         compression_opts = (block_size, bitshuffle_compression_lz4)
         shuffle = False
-        Dataset.__init__(self, prefix, channel, field, h5file, shape, dtype, channel_compression, chunks, dataset_compression, compression_opts, shuffle)
+        Dataset.__init__(self, prefix, channel, field, h5file, shape, dtype, channel_compression, chunks, dataset_compression, compression_opts, shuffle, overallocate=overallocate, resume=resume)
 
     def append(self, buf):
         nr = self.nwritten + 1
-        self.dataset.resize((nr,)+self.shape)
+        if self.reserve(nr):
+            #Updated when the dataset grows and on flush, not on every frame
+            self.set_valid_length()
         #k = struct.unpack(">qi", buf[:12])
         #uncompressed_size = k[0]
         #block_size = k[1]
@@ -288,5 +611,5 @@ class DirectChunkWriteDataset(Dataset):
         self.nwritten += 1
 
     def flush(self):
-        pass
+        self.set_valid_length()
 
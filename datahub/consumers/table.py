@@ -1,4 +1,5 @@
 import logging
+import numpy
 from datahub import Consumer
 
 _logger = logging.getLogger(__name__)
@@ -36,6 +37,18 @@ class Table(Consumer):
                 arg_name = f"{name} {col}"
                 self.data[arg_name].append({Table.TIMESTAMP: timestamp, Table.PULSE_ID: pulse_id, arg_name: kwargs[col]})
 
+    def on_channel_records(self, source, name, timestamps, pulse_ids, values, **kwargs):
+        if kwargs.get("bins", None) is not None:
+            return Consumer.on_channel_records(self, source, name, timestamps, pulse_ids, values, **kwargs)
+        if isinstance(timestamps, numpy.ndarray):
+            timestamps = timestamps.tolist()
+        if pulse_ids is None:
+            pulse_ids = [None] * len(values)
+        elif isinstance(pulse_ids, numpy.ndarray):
+            pulse_ids = pulse_ids.tolist()
+        self.data[name].extend({Table.TIMESTAMP: timestamp, Table.PULSE_ID: pulse_id, name: value}
+                               for timestamp, pulse_id, value in zip(timestamps, pulse_ids, values))
+
     def on_channel_completed(self, source, name):
         pass
 
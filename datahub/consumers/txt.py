@@ -36,19 +36,34 @@ class TextWriter(Consumer):
             path = self.get_path(source, name)
             self.files[source][name] = open(path, "a" if self.append else "w")
 
+    def format_record(self, timestamp, pulse_id, value):
+        trailer = ""
+        if type(value) == bytes:
+            value = f"bytes({len(value)})"
+        elif isinstance(value, numpy.ndarray) and (len(value.shape) == 1):
+            #value = numpy.array_str(value, max_line_width=numpy.inf)
+            value = ' '.join(map(str, value))
+            trailer = " " #Marker for array
+        else:
+            value = str(value)
+        return f"{str(timestamp)}\t{str(pulse_id)}\t{value}{trailer}\n"
+
     def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
         file = self.files[source].get(name, None)
         if file:
-            trailer = ""
-            if type(value) == bytes:
-                value = f"bytes({len(value)})"
-            elif isinstance(value, numpy.ndarray) and (len(value.shape) == 1):
-                #value = numpy.array_str(value, max_line_width=numpy.inf)
-                value = ' '.join(map(str, value))
-                trailer = " " #Marker for array
-            else:
-                value = str(value)
-            file.write(f"{str(timestamp)}\t{str(pulse_id)}\t{value}{trailer}\n")
+            file.write(self.format_record(timestamp, pulse_id, value))
+
+    def on_channel_records(self, source, name, timestamps, pulse_ids, values, **kwargs):
+        file = self.files[source].get(name, None)
+        if file:
+            if isinstance(timestamps, numpy.ndarray):
+                timestamps = timestamps.tolist()
+            if pulse_ids is None:
+                pulse_ids = [None] * len(values)
+            elif isinstance(pulse_ids, numpy.ndarray):
+                pulse_ids = pulse_ids.tolist()
+            file.write("".join(self.format_record(timestamp, pulse_id, value)
+                               for timestamp, pulse_id, value in zip(timestamps, pulse_ids, values)))
 
     def on_channel_completed(self, source, name):
         try:
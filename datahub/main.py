@@ -43,6 +43,7 @@ def run_json(task):
         icase = task.get("icase", None)
         prefix = task.get("prefix", None)
         append = task.get("append", None)
+        checkpoint = task.get("checkpoint", None)
         query_id = task.get("id", None)
         query_time = task.get("time", None)
         time_type = task.get("timetype", None)
@@ -50,6 +51,7 @@ def run_json(task):
         backend = task.get("backend", None)
         url = task.get("url", None)
         align = task.get("align", None)
+        chunk_size = task.get("chunksize", None)
         if compression == "lz4":
             compression = Compression.BITSHUFFLE_LZ4
         elif compression.lower() in ["null", "none"]:
@@ -65,7 +67,7 @@ def run_json(task):
 
         consumers = []
         if hdf5 is not None:
-            consumers.append(HDF5Writer(hdf5, default_compression=compression, timetype=time_type,  append=append))
+            consumers.append(HDF5Writer(hdf5, default_compression=compression, timetype=time_type,  append=append, chunk_size=chunk_size))
         if txt is not None:
             consumers.append(TextWriter(txt, timetype=time_type, append=append))
         if prnt is not None:
@@ -188,6 +190,10 @@ def run_json(task):
         def add_source(cfg, src):
             nonlocal channels
             src.query = get_query(cfg)
+            if src.query is not None and hdf5 is not None and checkpoint and src.RESUMABLE:
+                #Progress is recorded so that an interrupted query can be continued with --append
+                src.query.setdefault("checkpoint", f"{hdf5}.{len(sources)}.checkpoint")
+                src.query.setdefault("resume", bool(append))
             sources.append(src)
 
         #Create source removing constructor parameters from the query dictionary
@@ -363,10 +369,12 @@ def parse_args():
     parser.add_argument("-dm", "--modulo", help="Downsampling modulo of the samples", required=False)
     parser.add_argument("-tt", "--timetype", help="Timestamp type: nano/int (default), sec/float or str", required=False)
     parser.add_argument("-cp", "--compression", help="Compression: gzip (default), szip, lzf, lz4 or none", required=False)
+    parser.add_argument("-cs", "--chunksize", help="Target size of HDF5 chunks in bytes (default 1048576)", required=False)
     parser.add_argument("-dc", "--decompress", action='store_true', help="Auto-decompress compressed images", required=False)
     parser.add_argument("-px", "--prefix", action='store_true', help="Add source ID to channel names", required=False)
     parser.add_argument("-pt", "--path", help="Path to data in the file", required=False)
     parser.add_argument("-ap", "--append", action='store_true', help="Append data to existing files", required=False)
+    parser.add_argument("-ck", "--checkpoint", action='store_true', help="Record the progress of HDF5 exports, to be resumed with --append", required=False)
     parser.add_argument("-sr", "--search", help="Search channel names given a pattern (instead of fetching data)", required=False , nargs="*")
     parser.add_argument("-ic", "--icase", action='store_true', help="Case-insensitive search", required=False)
     parser.add_argument("-v", "--verbose", action='store_true', help="Display complete search results, not just channels names", required=False)
@@ -462,6 +470,8 @@ def main():
                 task["decompress"] = bool(args.decompress)
             if args.compression:
                 task["compression"] = args.compression
+            if args.chunksize:
+                task["chunksize"] = int(args.chunksize)
             if args.interval:
                 task["interval"] = args.interval
             if args.bins:
@@ -484,6 +494,8 @@ def main():
                 task["prefix"] = args.prefix
             if args.append is not None:
                 task["append"] = args.append
+            if args.checkpoint is not None:
+                task["checkpoint"] = args.checkpoint
             if args.channels is not None:
                 task["channels"] = args.channels
             if args.backend is not None:
@@ -1,8 +1,9 @@
 from datahub import *
-from threading import Thread, current_thread
+from threading import Thread, current_thread, Lock
 import time
 from datahub.utils.reflection import get_meta
 import datahub.utils.timing as timing
+from datahub.utils.health import StreamHealth
 
 _logger = logging.getLogger(__name__)
 
@@ -10,6 +11,8 @@ class Source():
     query_index = {}
     instances = set()
     TIMESTAMP_ARGS = "start", "end"
+    RESUMABLE = False #True if the source can resume queries from a checkpoint
+    RANGE_ARGS = "range", "start", "end", "start_id", "end_id", "start_tm", "end_tm"
 
     def __init__(self, url=None, backend=None, query_path=None, search_path=None, auto_decompress=False,
                  known_backends=[], name=None,
@@ -52,6 +55,8 @@ class Source():
         self.run_stop_timestamp = None
         self.run_exception = None
         self.streaming = False
+        self.checkpoint = None
+        self.stream_health = {}
         Source.instances.add(self)
 
     def is_streaming(self):
@@ -60,6 +65,10 @@ class Source():
     def is_retrieval(self):
         return not self.streaming
 
+    def has_reused_values(self):
+        #True if record values are buffers overwritten by the following records: listeners keeping them must copy
+        return False
+
     def get_backends(self):
         return self.known_backends
 
@@ -129,6 +138,7 @@ class Source():
         return value
 
     def on_channel_record(self, name, timestamp, pulse_id, value, **kwargs):
+        channel, last = name, timestamp
         if self.prefix:
             name = self.prefix + name
         if self.downsample:
@@ -168,6 +178,82 @@ class Source():
             except Exception as e:
                 _logger.exception("Error appending record on listener %s: %s" % (str(listener), str((name, timestamp, pulse_id, value))))
 
+        #Progress is recorded after the record is dispatched, so that a save never covers undelivered data
+        if self.checkpoint is not None:
+            self.checkpoint.update(channel, last)
+
+    def on_channel_records(self, name, timestamps, pulse_ids, values, **kwargs):
+        #Batch version of on_channel_record: timestamps, pulse_ids, values and kwargs entries are sequences of equal size
+        size = len(values)
+        if size == 0:
+            return
+        channel, last = name, None if timestamps is None else timestamps[-1]
+        if self.auto_decompress:
+            channel_name = (self.prefix + name) if self.prefix else name
+            if self.channel_info[channel_name][3]:
+                for i in range(size):
+                    self.on_channel_record(name, None if timestamps is None else timestamps[i],
+                                           None if pulse_ids is None else pulse_ids[i], values[i],
+                                           **{key: arg[i] for key, arg in kwargs.items()})
+                return
+        if self.prefix:
+            name = self.prefix + name
+        if self.downsample:
+            selected = self.get_downsample_selection(name, size)
+            if selected is not None:
+                if len(selected) == 0:
+                    return
+                timestamps = Source.take(timestamps, selected)
+                pulse_ids = Source.take(pulse_ids, selected)
+                values = Source.take(values, selected)
+                kwargs = {key: Source.take(arg, selected) for key, arg in kwargs.items()}
+
+        if timestamps is None:
+            timestamps = numpy.full(len(values), create_timestamp(time.time()), dtype=numpy.int64)
+
+        for listener in self.listeners:
+            try:
+                ts = convert_timestamps(timestamps, listener.time_type, "nano")
+                if kwargs:
+                    args = kwargs.copy()
+                    for field in Source.TIMESTAMP_ARGS:
+                        if field in args:
+                            args[field] = convert_timestamps(args[field], listener.time_type, "nano")
+                else:
+                    args = kwargs
+                listener.on_channel_records(self, name, ts, pulse_ids, values, **args)
+            except Exception as e:
+                _logger.exception("Error appending records on listener %s: %s" % (str(listener), str((name, len(values)))))
+
+        if self.checkpoint is not None:
+            self.checkpoint.update(channel, last)
+
+    def get_downsample_selection(self, name, size):
+        #Returns the indexes of a batch of records kept by downsampling, or None if all are kept
+        now = time.time()
+        last_timestamp, last_index = self.last_rec_info[name]
+        self.last_rec_info[name][1] = last_index + size
+        if self.modulo:
+            selected = numpy.flatnonzero((numpy.arange(last_index, last_index + size) % self.modulo) == 0)
+        else:
+            selected = None
+        if self.interval:
+            #All records of a batch are received at the same time: at most one can be kept
+            if (now - last_timestamp) < self.interval:
+                return []
+            selected = [0] if selected is None else selected[:1]
+        if selected is not None and len(selected) > 0:
+            self.last_rec_info[name][0] = now
+        return selected
+
+    @staticmethod
+    def take(seq, indexes):
+        if seq is None:
+            return None
+        if isinstance(seq, (numpy.ndarray, Enums)):
+            return seq[indexes]
+        return [seq[i] for i in indexes]
+
     def on_channel_completed(self, name):
         if self.prefix:
             name = self.prefix + name
@@ -242,6 +328,14 @@ class Source():
         self.downsample = self.interval or self.modulo
         self.create_query_id()
 
+        checkpoint = self.query.get("checkpoint", None)
+        if checkpoint and self.RESUMABLE:
+            self.checkpoint = Checkpoint(checkpoint, self.get_checkpoint_signature(), str_to_bool(str(self.query.get("resume", False))),
+                                         request_save=self.save_checkpoint)
+            self.set_checkpoint_range()
+        else:
+            self.checkpoint = None
+
         prefix = self.query.get("prefix", None)
         if prefix:
             has_prefix = str_to_bool(str(prefix))
@@ -262,6 +356,72 @@ class Source():
             self.processing_thread = None
             self.do_run(query)
 
+    def get_checkpoint_signature(self):
+        #Range arguments as given, so that relative ranges match when the query is repeated
+        signature = {"type": self.type, "url": self.url, "backend": self.backend, "channels": self.query.get("channels", None),
+                     "bins": self.query.get("bins", None), "last": self.query.get("last", None)}
+        for key in Source.RANGE_ARGS:
+            signature[key] = self.query.get(key, None)
+        return signature
+
+    def set_checkpoint_range(self):
+        #Relative ranges are resolved when the query is first run: a resumed query covers the same absolute window
+        checkpoint = self.checkpoint
+        if checkpoint.resumed and checkpoint.range:
+            query = {key: value for key, value in self.query.items() if key not in Source.RANGE_ARGS}
+            for key, value in zip(("start", "end"), checkpoint.range):
+                if type(value) == int:
+                    key = key + "_id"
+                elif type(value) == float:
+                    key = key + "_tm"
+                query[key] = value
+            self.range = QueryRange(query, self)
+        else:
+            checkpoint.range = [self.get_resolved_limit(True), self.get_resolved_limit(False)]
+
+    def get_resolved_limit(self, start):
+        #Absolute limit of the query range: id, date string or time in seconds
+        typ = self.range.get_start_type() if start else self.range.get_end_type()
+        if typ == "id":
+            return int(self.range.get_start_id() if start else self.range.get_end_id())
+        if typ == "date":
+            return str(self.range.get_start_str() if start else self.range.get_end_str())
+        return float(self.range.get_start_sec() if start else self.range.get_end_sec())
+
+    def save_checkpoint(self):
+        #The progress is saved when all listeners have stored the data delivered so far
+        checkpoint = self.checkpoint
+        if checkpoint is None:
+            return
+        snapshot = checkpoint.get_snapshot()
+        listeners = [listener for listener in self.listeners if hasattr(listener, "on_checkpoint")]
+        remaining, lock = [len(listeners)], Lock()
+        def ack():
+            with lock:
+                remaining[0] -= 1
+                done = remaining[0] == 0
+            if done:
+                checkpoint.save(snapshot)
+        if not listeners:
+            checkpoint.save(snapshot)
+        for listener in listeners:
+            try:
+                listener.on_checkpoint(self, ack)
+            except Exception as e:
+                _logger.exception("Error storing data on listener %s: %s" % (str(listener), str(e)))
+
+    def is_resuming(self):
+        #True if the query is resumed from a checkpoint
+        return self.checkpoint is not None and self.checkpoint.resumed
+
+    def get_checkpoint_last(self, name):
+        #Timestamp of the last event of the channel stored in the checkpoint
+        if self.checkpoint is None:
+            return None
+        if self.prefix and name.startswith(self.prefix):
+            name = name[len(self.prefix):]
+        return self.checkpoint.get_last(name)
+
     def create_query_id(self):
         self.query_index = Source.query_index.get(self.type, -1) + 1
         Source.query_index[self.type]=self.query_index
@@ -290,6 +450,7 @@ class Source():
     def do_run(self, query):
         self.running = True
         self.run_start_timestamp = time.time()
+        self.stream_health = {}
         self.on_start()
         try:
             self.run_exception = None
@@ -298,6 +459,12 @@ class Source():
             self.run_exception = e
             raise
         finally:
+            if self.checkpoint is not None:
+                #Checkpoint is kept only if the query has not completed
+                if (self.run_exception is None) and not self.is_aborted() and not self.is_run_timeout():
+                    self.checkpoint.remove()
+                else:
+                    self.save_checkpoint()
             self.running = False
             self.run_stop_timestamp = time.time()
             self.on_stop(self.run_exception)
@@ -324,6 +491,18 @@ class Source():
         return "Completed"
 
 
+    def get_stream_health(self, name=None):
+        #Health tracker of the stream, or of a channel stream if name is given
+        health = self.stream_health.get(name, None)
+        if health is None:
+            health = self.stream_health[name] = StreamHealth()
+        return health
+
+    def get_stream_stats(self):
+        #Pulse id gaps, duplicates, drops and latency histogram of streaming sources, indexed by channel (None for the
+        #whole stream)
+        return {name: health.get_stats() for name, health in list(self.stream_health.items())}
+
     def get_timeout(self):
         return self.query.get("timeout", None)
 
@@ -347,6 +526,8 @@ class Source():
         return self.range.has_ended(id=id) or self.aborted or self.is_run_timeout()
 
     def add_listener(self, listener):
+        if hasattr(listener, "get_listener"):
+            listener = listener.get_listener()
         self.listeners.append(listener)
 
     def remove_listeners(self):
@@ -388,6 +569,59 @@ class Source():
 
         self.on_channel_record(channel_name, timestamp, id, value, **kwargs)
 
+    def adjust_types(self, values):
+        #Batch version of adjust_type: returns None if values cannot be represented as an homogeneous array
+        if isinstance(values, Enums):
+            return values
+        if isinstance(values, numpy.ndarray):
+            array = values
+        else:
+            try:
+                array = numpy.asarray(values)
+            except:
+                return None
+        if array.dtype.kind in "OUSV":
+            return None
+        return array
+
+    def receive_channel_batch(self, channel_name, values, timestamps, ids, check_changes=False, check_types=False, metadata={}, **kwargs):
+        #Batch version of receive_channel: channel header is checked once for the whole batch
+        size = len(values)
+        if size == 0:
+            return
+        array = self.adjust_types(values)
+        if array is None and not all(isinstance(value, str) for value in values):
+            return self.receive_channel_unrolled(channel_name, values, timestamps, ids, check_changes, check_types, metadata, **kwargs)
+        try:
+            if timestamps is not None:
+                timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+            if ids is not None:
+                ids = numpy.asarray(ids, dtype=numpy.int64)
+        except:
+            #Missing timestamps or ids in the batch
+            return self.receive_channel_unrolled(channel_name, values, timestamps, ids, check_changes, check_types, metadata, **kwargs)
+
+        existing = channel_name in self.channel_formats
+        if not existing or check_changes:
+            fmt = typ, shape = ("str", None) if array is None else (array.dtype, array.shape[1:])
+            if fmt != self.channel_formats.get(channel_name, None):
+                metadata = {} if metadata is None else dict(metadata)
+                metadata["has_id"] = ids is not None
+                if existing:
+                    self.on_channel_completed(channel_name)
+                    _logger.warning("Channel %s changed type from %s to %s." % (str(channel_name), str(self.channel_formats.get(channel_name)), str(fmt)))
+                    del self.channel_formats[channel_name]
+                self.on_channel_header(channel_name, typ, Endianness.LITTLE, shape, None, metadata)
+                self.channel_formats[channel_name] = fmt
+
+        self.on_channel_records(channel_name, timestamps, ids, values if array is None else array, **kwargs)
+
+    def receive_channel_unrolled(self, channel_name, values, timestamps, ids, check_changes=False, check_types=False, metadata={}, **kwargs):
+        for i in range(len(values)):
+            self.receive_channel(channel_name, values[i], None if timestamps is None else timestamps[i],
+                                 None if ids is None else ids[i], check_changes=check_changes and (i == 0),
+                                 check_types=check_types, metadata=metadata, **{key: arg[i] for key, arg in kwargs.items()})
+
     def close_channels(self):
         for channel_name in self.channel_formats.keys():
             self.on_channel_completed(channel_name)
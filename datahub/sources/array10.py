@@ -4,27 +4,208 @@ except:
     zmq = None
 
 from datahub import *
+import re
+import heapq
+import threading
 
 _logger = logging.getLogger(__name__)
 
+class FramePool():
+    """
+    Round-robin pool of preallocated frame buffers: received frames are copied into the pool instead of allocating
+    a new array per frame. A buffer is overwritten after other size frames are received.
+    """
+    def __init__(self, size):
+        self.size = int(size)
+        self.buffers = []
+        self.index = 0
+
+    def get(self, shape, dtype):
+        if self.buffers and (self.buffers[0].shape != shape or self.buffers[0].dtype != dtype):
+            self.buffers = []
+            self.index = 0
+        if len(self.buffers) < self.size:
+            self.buffers.append(numpy.empty(shape, dtype=dtype))
+        #Index of the least recently returned buffer
+        buffer = self.buffers[self.index]
+        self.index = (self.index + 1) % self.size
+        return buffer
+
+    def copy(self, array):
+        buffer = self.get(array.shape, array.dtype)
+        numpy.copyto(buffer, array)
+        return buffer
+
+
+class FrameDecoder():
+    """
+    Decodes Array10 messages (JSON header and raw payload). The array is a view on the payload, and the header is
+    only parsed if different from the previous one, apart from the frame number.
+    """
+    FRAME_FIELD = re.compile(rb'"frame"\s*:\s*(-?\d+)')
+
+    def __init__(self, reshape=True):
+        self.reshape = reshape
+        self.header = None
+        self.shape = None
+        self.dtype = None
+        self.source = None
+        self.frame = None
+
+    def decode(self, header, data):
+        match = FrameDecoder.FRAME_FIELD.search(header)
+        key = header if match is None else header[:match.start()] + header[match.end():]
+        if key != self.header:
+            info = json.loads(header)
+            self.shape = info.get("shape")
+            self.dtype = numpy.dtype(info.get("type", "int8"))
+            self.source = info.get("source", "")
+            self.frame = info.get("frame", None)
+            self.header = key
+        frame = self.frame if match is None else int(match.group(1))
+        array = numpy.frombuffer(data, dtype=self.dtype)
+        if self.reshape:
+            array = array.reshape(self.shape)
+        return frame, array
+
+
+class FrameMerger():
+    """
+    Merges the frames received by several workers, dispatching them ordered by frame id. A frame is dispatched
+    when it is the next expected one, or when it has waited for timeout seconds, or if more than size frames are
+    pending. Frames without id are dispatched in reception order.
+    """
+    def __init__(self, size=100, timeout=0.1):
+        self.size = max(int(size), 1)
+        self.timeout = float(timeout)
+        self.heap = []
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.next_id = None
+        self.late = 0
+        self.high_water = 0
+        self.error = None
+
+    def put(self, frame, item):
+        with self.condition:
+            key = float("-inf") if frame is None else frame
+            heapq.heappush(self.heap, (key, self.sequence, time.monotonic(), frame, item))
+            self.sequence += 1
+            self.high_water = max(self.high_water, len(self.heap))
+            self.condition.notify()
+
+    def set_error(self, error):
+        with self.condition:
+            self.error = error
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        #Returns the next (frame, item), or None if no frame is ready within timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.error is not None:
+                    raise self.error
+                now = time.monotonic()
+                wait = None if deadline is None else deadline - now
+                if self.heap:
+                    _, _, received, frame, item = self.heap[0]
+                    age = now - received
+                    if (frame is None) or (self.next_id is not None and frame <= self.next_id) or \
+                            (len(self.heap) > self.size) or (age >= self.timeout):
+                        heapq.heappop(self.heap)
+                        if frame is not None:
+                            if self.next_id is not None and frame < self.next_id:
+                                self.late += 1
+                            self.next_id = max(frame + 1, self.next_id if self.next_id is not None else frame + 1)
+                        return frame, item
+                    wait = (self.timeout - age) if wait is None else min(wait, self.timeout - age)
+                if wait is not None and wait <= 0:
+                    return None
+                self.condition.wait(wait)
+
+    def get_stats(self):
+        with self.condition:
+            return {"pending": len(self.heap), "high_water": self.high_water, "late": self.late}
+
+
+class Array10Worker(threading.Thread):
+    """
+    Receives Array10 messages in a dedicated socket and thread, feeding a FrameMerger.
+    """
+    def __init__(self, index, ctx, urls, mode, reshape, merger):
+        threading.Thread.__init__(self, name=f"Array10 worker {index}", daemon=True)
+        self.ctx = ctx
+        self.urls = urls
+        self.mode = mode
+        self.decoder = FrameDecoder(reshape)
+        self.merger = merger
+        self.stopping = False
+        self.frames = 0
+        self.bytes = 0
+        self.start_time = None
+
+    def run(self):
+        socket = self.ctx.socket(self.mode)
+        try:
+            for url in self.urls:
+                socket.connect(url)
+            if self.mode == zmq.SUB:
+                socket.subscribe("")
+            self.start_time = time.time()
+            while not self.stopping:
+                if not socket.poll(100):
+                    continue
+                header = socket.recv(copy=False)
+                data = socket.recv(copy=False)
+                frame, array = self.decoder.decode(header.bytes, data.buffer)
+                self.frames += 1
+                self.bytes += array.nbytes
+                self.merger.put(frame, (array, self.decoder.source, self.decoder.shape))
+        except Exception as e:
+            if not self.stopping:
+                _logger.warning("Error processing Array10: %s" % (str(e),))
+                self.merger.set_error(e)
+        finally:
+            socket.close(linger=0)
+
+    def stop(self):
+        self.stopping = True
+
+    def get_stats(self):
+        elapsed = (time.time() - self.start_time) if self.start_time else 0.0
+        return {"name": self.name, "urls": self.urls, "frames": self.frames, "bytes": self.bytes,
+                "frame_rate": (self.frames / elapsed) if elapsed > 0 else 0.0,
+                "byte_rate": (self.bytes / elapsed) if elapsed > 0 else 0.0}
+
+
 class Array10(Source):
     """
     Retrieves data from an Array10 stream.
     """
     DEFAULT_URL = os.environ.get("ARRAY10_DEFAULT_URL", None)
-    def __init__(self, url=DEFAULT_URL, mode="SUB", reshape=True, name=None, **kwargs):
+    def __init__(self, url=DEFAULT_URL, mode="SUB", reshape=True, name=None, pool_size=0, workers=1,
+                 reorder_size=100, reorder_timeout=0.1, **kwargs):
         """
-        url (str, optional): Stream URL. Default value can be set by the env var ARRAY10_DEFAULT_URL.
+        url (str, optional): Stream URL, or list of URLs (or comma-separated). Default value can be set by the env var ARRAY10_DEFAULT_URL.
         mode (str, optional): "SUB" or "PULL"
         path (str, optional): hint for the source location in storage or displaying.
         reshape (bool, optional): if True (Default) reshapes receiving array into 2d arrays.
         name (str, optional): channel name of the receiving data - if None, uses stream's "source" field.
+        pool_size (int, optional): if greater than 0, frames are copied into a pool of this number of preallocated
+                                   buffers, overwritten after pool_size further frames (consumers with event queues
+                                   receive copies). Otherwise (default) arrays are views on the received messages
+                                   (read-only).
+        workers (int, optional): number of PULL sockets receiving in parallel threads, each connected to all URLs.
+                                 In SUB mode there is one receiving thread per URL.
+        reorder_size (int, optional): maximum number of frames waiting to be reordered, if receiving in parallel.
+        reorder_timeout (float, optional): maximum time in seconds a frame waits to be reordered.
         """
         if zmq is None:
             raise Exception("pyzmq library not available")
-        if not url.startswith("tcp://"):
-            url = "tcp://" + url
-        Source.__init__(self, url=url, name=name, **kwargs)
+        urls = url if isinstance(url, (list, tuple)) else url.split(",")
+        self.urls = [u if u.startswith("tcp://") else "tcp://" + u for u in [u.strip() for u in urls]]
+        Source.__init__(self, url=",".join(self.urls), name=name, **kwargs)
         self.context = 0
         self.mode = mode
         self.ctx = None
@@ -34,18 +215,38 @@ class Array10(Source):
         self.reshape = str_to_bool(str(reshape))
         self.generate_id = False
         self.streaming = True
+        self.pool_size = int(pool_size)
+        self.pool = None
+        self.decoder = None
+        self.workers = int(workers)
+        self.reorder_size = int(reorder_size)
+        self.reorder_timeout = float(reorder_timeout)
+        self.merger = None
+        self.worker_threads = []
 
     def run(self, query):
         self.generate_id = self.range.is_by_id()
+        pool_size = int(query.get("pool_size", self.pool_size))
+        self.pool = FramePool(pool_size) if pool_size > 0 else None
+        self.decoder = FrameDecoder(self.reshape)
+        workers = int(query.get("workers", self.workers))
+        health = self.get_stream_health()
         try:
-            self.connect()
+            if (workers > 1) or (len(self.urls) > 1):
+                self.start_workers(workers, int(query.get("reorder_size", self.reorder_size)),
+                                   float(query.get("reorder_timeout", self.reorder_timeout)))
+            else:
+                self.connect()
             pulse_id = -1
             init = True
             while not self.has_stream_finished(id=pulse_id+1):
-                data = self.receive()
+                data = self.receive() if self.merger is None else self.receive_merged()
                 if not data:
+                    if self.merger is not None:
+                        continue
                     raise Exception("Received None message.")
                 pulse_id, array = data
+                health.add(pulse_id)
                 if init:
                     init = False
                     self.range.set_init_id(pulse_id)
@@ -72,7 +273,32 @@ class Array10(Source):
             self.receiver.subscribe("")
         self.message_count = 0
 
+    def start_workers(self, workers, reorder_size, reorder_timeout):
+        self.ctx = zmq.Context()
+        self.merger = FrameMerger(reorder_size, reorder_timeout)
+        if self.mode == "PULL":
+            #Each PULL socket is connected to all endpoints: messages are distributed among them
+            sockets = [(zmq.PULL, self.urls)] * max(workers, 1)
+        else:
+            #SUB sockets receive all messages: one per endpoint
+            sockets = [(zmq.SUB, [url]) for url in self.urls]
+        self.worker_threads = [Array10Worker(i, self.ctx, urls, mode, self.reshape, self.merger)
+                               for i, (mode, urls) in enumerate(sockets)]
+        for worker in self.worker_threads:
+            worker.start()
+
+    def stop_workers(self):
+        for worker in self.worker_threads:
+            worker.stop()
+        for worker in self.worker_threads:
+            worker.join()
+        self.merger = None
+
     def disconnect(self):
+        try:
+            self.stop_workers()
+        except:
+            pass
         try:
             self.receiver.close()
         except:
@@ -84,25 +310,47 @@ class Array10(Source):
         finally:
             self.ctx = None
 
+    def get_worker_stats(self):
+        #Frames, bytes and rates received by each worker, if receiving in parallel
+        return [worker.get_stats() for worker in self.worker_threads]
+
+    def get_merger_stats(self):
+        merger = self.merger
+        return None if merger is None else merger.get_stats()
+
     def receive(self):
         try:
-            header = self.receiver.recv()
-            header = json.loads(''.join(chr(i) for i in header))
-            self.shape = header.get("shape")
-            self.dtype = header.get("type", "int8")
-            self.source = header.get("source", "")
-            self.frame = header.get("frame", None)
-            data = self.receiver.recv()
+            header = self.receiver.recv(copy=False)
+            data = self.receiver.recv(copy=False)
             if data is not None:
-                array = numpy.frombuffer(data, dtype=self.dtype)
-                if self.reshape:
-                    array = array.reshape(self.shape)
-                self.generated_pid = self.generated_pid + 1
-                pid = self.frame
-                if pid is None and self.generate_id:
-                    pid = self.generated_pid
-                self.pid = pid
-                return self.pid, array
+                #The array is a view on the message buffer, which is kept alive by the array
+                frame, array = self.decoder.decode(header.bytes, data.buffer)
+                self.shape, self.dtype, self.source = self.decoder.shape, self.decoder.dtype, self.decoder.source
+                return self.get_pulse_id(frame), self.get_array(array)
         except Exception as e:
             _logger.warning("Error processing Array10: %s" % (str(e),))
             raise
+
+    def receive_merged(self):
+        #Returns None if no frame is available before the timeout, so that the stream end can be checked
+        data = self.merger.get(0.1)
+        if data is not None:
+            frame, (array, self.source, self.shape) = data
+            return self.get_pulse_id(frame), self.get_array(array)
+
+    def get_pulse_id(self, frame):
+        self.generated_pid = self.generated_pid + 1
+        pid = frame
+        if pid is None and self.generate_id:
+            pid = self.generated_pid
+        self.frame = frame
+        self.pid = pid
+        return pid
+
+    def has_reused_values(self):
+        return self.pool is not None
+
+    def get_array(self, array):
+        if self.pool is not None:
+            array = self.pool.copy(array)
+        return array
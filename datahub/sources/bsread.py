@@ -4,7 +4,9 @@ except:
     bsread = None
 
 from datahub import *
-from datahub.utils.checker import check_msg
+from datahub.utils.checker import get_filter
+from datahub.utils.pipeline import MessagePipeline
+from datahub.utils.data import MessageBuffer
 import collections
 import threading
 
@@ -17,10 +19,15 @@ class Bsread(Source):
     DEFAULT_DISPATCHER_URL = None if (bsread is None) else bsread.DEFAULT_DISPATCHER_URL
     DEFAULT_URL = os.environ.get("BSREAD_DEFAULT_URL", DEFAULT_DISPATCHER_URL)
 
-    def __init__(self, url=DEFAULT_URL, mode="SUB", **kwargs):
+    def __init__(self, url=DEFAULT_URL, mode="SUB", ring_size=0, workers=1, **kwargs):
         """
         url (str, optional): Stream URL. Default value can be set by the env var BSREAD_DEFAULT_URL.
         mode (str, optional): "SUB" or "PULL"
+        ring_size (int, optional): if greater than 0, messages are received in a dedicated thread into a ring buffer
+                                   of this size, and processed by separate threads. If the processing cannot keep up,
+                                   the oldest messages are dropped in SUB mode, and the reception waits in PULL mode.
+                                   If 0 (default), messages are processed in the receiving thread.
+        workers (int, optional): number of threads building and filtering the messages, if ring_size > 0.
         """
         Source.__init__(self, url=url, **kwargs)
         if bsread is None:
@@ -28,12 +35,17 @@ class Bsread(Source):
         self.mode = mode
         self.context = 0
         self.streaming = True
+        self.ring_size = int(ring_size)
+        self.workers = int(workers)
+        self.pipeline = None
+        self.format_changed = False
 
     def run(self, query):
         mode = bsread.PULL if self.mode == "PULL" else bsread.SUB
         receive_timeout = query.get("receive_timeout", 3000)
         channels = query.get("channels", None)
         filter = query.get("filter", None)
+        ring_size = int(query.get("ring_size", self.ring_size))
         if not self.url or (self.url == bsread.DEFAULT_DISPATCHER_URL):
             host, port = None, 9999
             stream_channels = channels
@@ -45,43 +57,82 @@ class Bsread(Source):
             stream_channels = None
 
         self.context = None
-
-        with bsread.source(host=host, port=port, mode=mode, receive_timeout=receive_timeout, channels=stream_channels) as stream:
-            self.context = stream.stream.context
-            pulse_id = -1
-            init = True
-            while not self.has_stream_finished(id=pulse_id+1):
-                data = stream.receive()
-                if not data:
-                    raise Exception("Received None message.")
-                pulse_id = data.data.pulse_id
-                if init:
-                    init = False
-                    self.range.set_init_id(pulse_id)
-                if self.range.has_ended(id=pulse_id):
-                    break
-                if self.range.has_started(id = pulse_id):
-                    timestamp = create_timestamp(data.data.global_timestamp, data.data.global_timestamp_offset)
-                    format_changed = data.data.format_changed
-                    data=data.data.data
-
-                    keys = channels if (channels and (len(channels)>0)) else data.keys()
-                    msg = {channel: data[channel].value for channel in keys}
-
-                    try:
-                        if not filter or self.is_valid(filter, id, timestamp, msg):
-                            self.on_msg(pulse_id, timestamp, msg, format_changed)
-                    except Exception as e:
-                        _logger.exception("Error receiving data: %s " % str(e))
-
-            self.close_channels()
+        self.format_changed = False
+        decode = lambda data: self.decode_message(data, channels, filter)
+        self.pipeline = MessagePipeline(decode, self.dispatch_message, ring_size, int(query.get("workers", self.workers)),
+                                        self.on_dropped_message, name=f"{self.get_id()}", block=(mode == bsread.PULL)) \
+                                        if ring_size > 0 else None
+        health = self.get_stream_health()
+        try:
+            with bsread.source(host=host, port=port, mode=mode, receive_timeout=receive_timeout, channels=stream_channels) as stream:
+                self.context = stream.stream.context
+                pulse_id = -1
+                init = True
+                while not self.has_stream_finished(id=pulse_id+1):
+                    data = stream.receive()
+                    if not data:
+                        raise Exception("Received None message.")
+                    pulse_id = data.data.pulse_id
+                    health.add(pulse_id, create_timestamp(data.data.global_timestamp, data.data.global_timestamp_offset))
+                    if init:
+                        init = False
+                        self.range.set_init_id(pulse_id)
+                    if self.range.has_ended(id=pulse_id):
+                        break
+                    if self.pipeline:
+                        self.pipeline.put(data)
+                    else:
+                        msg = decode(data)
+                        if msg is not None:
+                            self.dispatch_message(msg)
+                if self.pipeline:
+                    self.pipeline.close(abort=self.is_aborted())
+                self.close_channels()
+        finally:
+            if self.pipeline:
+                self.pipeline.close(abort=True)
         if self.context:
             self.context.destroy()
             self.context = None
 
+    def decode_message(self, data, channels, filter):
+        #Returns the message to be dispatched, or None if out of range or filtered
+        pulse_id = data.data.pulse_id
+        if not self.range.has_started(id=pulse_id):
+            return None
+        timestamp = create_timestamp(data.data.global_timestamp, data.data.global_timestamp_offset)
+        format_changed = data.data.format_changed
+        data = data.data.data
+        keys = channels if (channels and (len(channels)>0)) else data.keys()
+        msg = {channel: data[channel].value for channel in keys}
+        try:
+            if filter and not self.is_valid(filter, pulse_id, timestamp, msg):
+                return None
+        except Exception as e:
+            _logger.exception("Error receiving data: %s " % str(e))
+            return None
+        return pulse_id, timestamp, msg, format_changed
+
+    def dispatch_message(self, message):
+        pulse_id, timestamp, msg, format_changed = message
+        #Format changes in dropped messages are reported on the next one
+        format_changed, self.format_changed = format_changed or self.format_changed, False
+        try:
+            self.on_msg(pulse_id, timestamp, msg, format_changed)
+        except Exception as e:
+            _logger.exception("Error receiving data: %s " % str(e))
+
+    def on_dropped_message(self):
+        self.format_changed = True
+        self.get_stream_health().add_dropped()
+
+    def get_pipeline_stats(self):
+        #Occupancy, high-water mark and drop counters of the receiving ring buffer
+        return None if self.pipeline is None else self.pipeline.get_stats()
+
     def is_valid(self, filter, id, timestamp, msg):
         try:
-            return check_msg(msg, filter)
+            return get_filter(filter)(msg)
         except Exception as e:
             _logger.warning("Error processing filter: %s " % str(e))
             return False
@@ -105,8 +156,7 @@ class BsreadStream(Bsread):
 
     def __init__(self, channels, filter=None, queue_size=100,  **kwargs):
         Bsread.__init__(self, **kwargs)
-        self.message_buffer = collections.deque(maxlen=queue_size)
-        self.condition = threading.Condition()
+        self.message_buffer = MessageBuffer(queue_size)
         now = time.time()
         self.req(channels, now, now + 365 * 24 * 60 * 60, filter=filter, background=True, **kwargs)
 
@@ -114,18 +164,19 @@ class BsreadStream(Bsread):
         Bsread.close(self)
 
     def on_msg(self, id, timestamp, msg, format_changed):
-        with self.condition:
-            self.message_buffer.append((id, timestamp, msg))
-            self.condition.notify()
+        if self.message_buffer.put(id, timestamp, msg):
+            self.get_stream_health().add_dropped()
 
     def drain(self):
-        with self.condition:
-            self.message_buffer.clear()
+        self.message_buffer.clear()
 
     def receive(self, timeout=None):
-        with self.condition:
-            if not self.message_buffer:
-                self.condition.wait(timeout)
-            if self.message_buffer:
-                return self.message_buffer.popleft()
+        return self.message_buffer.get(timeout)
+
+    def receive_many(self, max_n=None, timeout=None, as_arrays=False):
+        return self.message_buffer.get_many(max_n, timeout, as_arrays)
+
+    def get_buffer_stats(self):
+        #Size, depth, received and dropped counters of the message queue
+        return self.message_buffer.get_stats()
 
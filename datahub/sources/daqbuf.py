@@ -1,11 +1,149 @@
 from datahub import *
 import io
-from threading import Thread
+import time
+import queue
+from threading import Thread, Lock
+from functools import partial
+from datahub.utils.cache import CacheSink, iso_to_nanos, nanos_to_iso
+from datahub.utils.checkpoint import is_transient_error, get_retry_delay
 from http.client import IncompleteRead
 import http
 
 _logger = logging.getLogger(__name__)
 
+class ShardBuffer():
+    """
+    Bounded buffer of the events retrieved for a time shard, forwarded to the source once previous shards are done.
+    """
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.cancelled = False
+        self.claimed = False
+        self.lock = Lock()
+
+    def claim(self):
+        #True for the first caller only: the shard is retrieved by a pool worker or by the forwarding thread
+        with self.lock:
+            if self.claimed or self.cancelled:
+                return False
+            self.claimed = True
+            return True
+
+    def put(self, item):
+        while not self.cancelled:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def receive_channel(self, *args, **kwargs):
+        self.put((False, args, kwargs))
+
+    def receive_channel_batch(self, *args, **kwargs):
+        self.put((True, args, kwargs))
+
+    def finish(self, exception=None):
+        self.put((None, exception, None))
+
+    def cancel(self):
+        self.cancelled = True
+
+    def forward(self, source):
+        while True:
+            batch, args, kwargs = self.queue.get()
+            if batch is None:
+                if args is not None:
+                    raise args
+                return
+            if batch:
+                source.receive_channel_batch(*args, **kwargs)
+            else:
+                source.receive_channel(*args, **kwargs)
+
+
+class WorkerPool():
+    """
+    Bounded pool of threads executing retrievals, each one reusing a persistent connection.
+    Tasks are functions receiving the connection of the worker (None if not streamed): on errors it is closed.
+    """
+    def __init__(self, workers, url, streamed, timeout=None):
+        self.url = url
+        self.streamed = streamed
+        self.timeout = timeout
+        self.tasks = queue.Queue()
+        self.threads = [Thread(target=self.run_worker, daemon=True) for i in range(max(int(workers), 1))]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, task):
+        self.tasks.put(task)
+
+    def run_worker(self):
+        conn = None
+        try:
+            while True:
+                task = self.tasks.get()
+                try:
+                    if task is None:
+                        return
+                    if self.streamed and conn is None:
+                        conn = create_http_conn(self.url, timeout=self.timeout)
+                    task(conn)
+                except Exception as e:
+                    #Connection state is unknown after an error
+                    if conn:
+                        conn.close()
+                        conn = None
+                finally:
+                    self.tasks.task_done()
+        finally:
+            if conn:
+                conn.close()
+
+    def join(self):
+        #Waits until all submitted tasks are done
+        self.tasks.join()
+
+    def close(self):
+        for thread in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class ResumeSink():
+    """
+    Forwards the events of a channel retrieval, recording the timestamp of the last one.
+    Events up to this timestamp are dropped, so that the retrieval can be resumed without duplicates.
+    """
+    def __init__(self, sink, after=None):
+        self.sink = sink
+        self.last = after
+        self.count = 0
+
+    def receive_channel(self, channel_name, value, timestamp, id, *args, **kwargs):
+        if (timestamp is not None) and (self.last is not None) and (timestamp <= self.last):
+            return
+        self.sink.receive_channel(channel_name, value, timestamp, id, *args, **kwargs)
+        if timestamp is not None:
+            self.last = int(timestamp)
+        self.count += 1
+
+    def receive_channel_batch(self, channel_name, values, timestamps, ids, *args, **kwargs):
+        if (timestamps is not None) and (len(timestamps) > 0):
+            timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+            if (self.last is not None) and (timestamps[0] <= self.last):
+                selected = numpy.flatnonzero(timestamps > self.last)
+                if len(selected) == 0:
+                    return
+                values, timestamps, ids = Source.take(values, selected), timestamps[selected], Source.take(ids, selected)
+        self.sink.receive_channel_batch(channel_name, values, timestamps, ids, *args, **kwargs)
+        if (timestamps is not None) and (len(timestamps) > 0):
+            self.last = int(timestamps[-1])
+        self.count += len(values)
+
+
 class Daqbuf(Source):
     """
     Retrieves data from a Daqbuf service (new retrieval).
@@ -14,14 +152,42 @@ class Daqbuf(Source):
     DEFAULT_URL = os.environ.get("DAQBUF_DEFAULT_URL", "https://data-api.psi.ch/api/4")
     DEFAULT_BACKEND = os.environ.get("DAQBUF_DEFAULT_BACKEND", "sf-databuffer")
     DEFAULT_COMPRESSION = os.environ.get("DAQBUF_DEFAULT_COMPRESSION", "false")
+    DEFAULT_MAX_WORKERS = int(os.environ.get("DAQBUF_DEFAULT_MAX_WORKERS", "16"))
+    SCALAR_TYPES = {"u8": numpy.uint8, "u16": numpy.uint16, "u32": numpy.uint32, "u64": numpy.uint64,
+                    "i8": numpy.int8, "i16": numpy.int16, "i32": numpy.int32, "i64": numpy.int64,
+                    "f32": numpy.float32, "f64": numpy.float64, "bool": numpy.bool_}
+    RESUMABLE = True
 
-    def __init__(self, url=DEFAULT_URL, backend=DEFAULT_BACKEND, delay=1.0, cbor=True, parallel=True, streamed=True, compressed=None, **kwargs):
+    def __init__(self, url=DEFAULT_URL, backend=DEFAULT_BACKEND, delay=1.0, cbor=True, parallel=True, streamed=True, compressed=None,
+                 max_workers=DEFAULT_MAX_WORKERS, cache=None, cache_size=None, cache_delay=60.0, retries=3, retry_delay=1.0, **kwargs):
         """
         url (str, optional): Daqbuf URL. Default value can be set by the env var DAQBUF_DEFAULT_URL.
         backend (str, optional): Daqbuf backend. Default value can be set by the env var DAQBUF_DEFAULT_BACKEND.
         delay (float, optional): Wait time for channels to be uploaded to storage before retrieval.
         cbor (bool, optional): if True (default) retrieves data as CBOR, otherwise as JSON.
         parallel (bool, optional): if True (default) performs the retrieval of multiple channels in differt threads.
+        max_workers (int, optional): maximum number of threads fetching channels in parallel, each one reusing a
+                                     persistent connection. Default value can be set by the env var DAQBUF_DEFAULT_MAX_WORKERS.
+        cache (str or bool, optional): if defined, retrieved data is stored in a local cache and only the intervals
+                                       not yet cached are fetched. If True uses the default cache folder, which can be
+                                       set by the env var DATAHUB_CACHE_PATH. Only non-binned numeric channels are cached.
+        cache_size (float, optional): maximum cache size in MB, evicting the least recently used data.
+                                      Default value can be set by the env var DATAHUB_CACHE_SIZE.
+        cache_delay (float, optional): time in seconds after the end of a range for its data to be considered final
+                                       and stored in the cache (default 60s).
+        retries (int, optional): number of retries of a channel retrieval on connection or stream errors.
+                                 Retrieval is resumed after the last received event.
+        retry_delay (float, optional): wait time before the first retry in seconds, doubled on each retry.
+        Additional query arguments:
+        shards (int, optional): splits the range of each channel in time shards retrieved concurrently by the
+                                workers of the pool. Cached channels are not sharded: the intervals missing in the
+                                cache are retrieved in single requests.
+        shard_duration (float, optional): alternatively, duration of the shards in seconds.
+        shard_workers (int, optional): maximum number of shards of a channel retrieved ahead (default is max_workers).
+        shard_buffer (int, optional): maximum number of frames buffered per shard waiting to be forwarded (default 100).
+        checkpoint (str, optional): file to record the progress of the query.
+        resume (bool, optional): if True resumes the query from the checkpoint file, skipping completed channels
+                                 and continuing the others after the last event received.
         streamed (bool, optional): if True (default) performs receives data as stream, forwarding events while receiving message.
         compressed (bool or str, optional): Defines the supported stream compressions from server.
                                             If True uses "gzip, deflate".
@@ -42,7 +208,24 @@ class Daqbuf(Source):
         self.delay = delay
         self.cbor = str_to_bool(cbor)
         self.parallel = str_to_bool(parallel)
+        self.max_workers = int(max_workers)
+        self.channel_status = {}
+        self.channel_status_lock = Lock()
+        self.shards = None
+        self.shard_duration = None
+        self.shard_buffer = 100
+        self.shard_workers = self.max_workers
+        self.pool = None
         self.streamed = str_to_bool(streamed)
+        if isinstance(cache, RetrievalCache):
+            self.cache = cache
+        elif cache is None or str(cache).lower() == "false":
+            self.cache = None
+        else:
+            self.cache = RetrievalCache(None if str(cache).lower() == "true" else cache, cache_size)
+        self.cache_delay = float(cache_delay)
+        self.retries = int(retries)
+        self.retry_delay = float(retry_delay)
         self.add_headers = {"daqbuf-api-version":Daqbuf.API_VERSION }
         self.headers = get_default_header()
         self.headers.update(self.add_headers)
@@ -79,7 +262,9 @@ class Daqbuf(Source):
             _logger.exception(e)
             return []
 
-    def read_cbor(self, stream, channel):
+    def read_cbor(self, stream, channel, sink=None):
+        #Returns True if the end of the range has been received
+        sink = self if sink is None else sink
         try:
             while not self.is_run_timeout():
                 bytes_read = stream.read(4)
@@ -93,7 +278,8 @@ class Daqbuf(Source):
 
                 bytes_read = stream.read(length)
                 if len(bytes_read) != length:
-                    raise RuntimeError("unexpected EOF")
+                    _logger.error("Unexpected end of input")
+                    raise ProtocolError()
                 data = self.cbor.loads(bytes_read)
 
                 padding = padding = (8 - (length % 8)) % 8
@@ -118,15 +304,15 @@ class Daqbuf(Source):
 
                     if scalar_type:
                         nelm = len(values)
-                        for i in range(nelm):
-                            timestamp = tss[i] if len(tss)>i else None
-                            pulse_id = pulses[i] if len(pulses)>i else None
-                            value = values[i]
-                            if enums:
-                                value = Enum(value,valuestrings[i])
-                            self.receive_channel(channel, value, timestamp, pulse_id, check_changes=False, check_types=True)
+                        if enums:
+                            values = Enums(numpy.asarray(values, dtype=numpy.int64), valuestrings)
+                        else:
+                            values = self.get_frame_array(values, scalar_type)
+                        #Channel format is checked once per frame
+                        sink.receive_channel_batch(channel, values, tss if len(tss) == nelm else None,
+                                                   pulses if len(pulses) == nelm else None, check_changes=True, check_types=True)
                     if rangeFinal:
-                        break
+                        return True
                     elif not scalar_type:
                         raise RuntimeError("Invalid cbor frame keys: " + str(data.keys()))
 
@@ -136,9 +322,19 @@ class Daqbuf(Source):
         except IncompleteRead:
             _logger.error("Unexpected end of input")
             raise ProtocolError()
+        return False
 
+    def get_frame_array(self, values, scalar_type):
+        #Converts a CBOR frame column to an array with the declared type, or keeps the list if not possible
+        if scalar_type == "string":
+            return values
+        dtype = Daqbuf.SCALAR_TYPES.get(scalar_type, None)
+        try:
+            return numpy.asarray(values, dtype=dtype)
+        except (TypeError, ValueError):
+            return values
 
-    def read_json(self, stream, channel, bins=None):
+    def read_json(self, stream, channel, bins=None, sink=None):
         try:
             while not self.is_run_timeout():
                 length = stream.readline()
@@ -156,7 +352,7 @@ class Daqbuf(Source):
                     raise Exception(data.get("error"))
                 if not data.get ("type","") == 'keepalive':
                     rangeFinal = data.get('rangeFinal', False)
-                    self.read_json_single(data, channel, bins)
+                    self.read_json_single(data, channel, bins, sink)
                     if rangeFinal:
                         break
                     if not self.is_running() or self.is_aborted():
@@ -166,7 +362,8 @@ class Daqbuf(Source):
             _logger.error("Unexpected end of input")
             raise ProtocolError()
 
-    def read_json_single(self, data, channel, bins=None):
+    def read_json_single(self, data, channel, bins=None, sink=None):
+        sink = self if sink is None else sink
         if bins:
             avgs = data['avgs']
             nelm = len(avgs)
@@ -192,7 +389,7 @@ class Daqbuf(Source):
                 timestamp = int((timestamp1 + timestamp2) / 2)
                 args = {"bins": bins, "min": numpy.float64(min), "max": numpy.float64(max), "count": numpy.int64(count),
                         "start": timestamp1, "end": timestamp2}
-                self.receive_channel(channel, value, timestamp, None, check_changes=False, check_types=True,
+                sink.receive_channel(channel, value, timestamp, None, check_changes=False, check_types=True,
                                      metadata={"bins": bins}, **args)
         else:
             nelm = len(data['values'])
@@ -203,7 +400,7 @@ class Daqbuf(Source):
                 timestamp = create_timestamp(secs, data['tsNs'][i])
                 pulse_id = None if pulseAnchor is None else pulseAnchor + data['pulseOff'][i]
                 value = data['values'][i]
-                self.receive_channel(channel, value, timestamp, pulse_id, check_changes=False, check_types=True)
+                sink.receive_channel(channel, value, timestamp, pulse_id, check_changes=False, check_types=True)
 
     def check_response(self, response, channel):
         if type(response) == http.client.HTTPResponse:
@@ -225,14 +422,42 @@ class Daqbuf(Source):
                 ex = RuntimeError(f"Error retrieving data: {response.reason} [{status}]\nChannel: {channel}")
             raise ex
 
-    def run_channel(self, channel, backend, cbor, bins=None, last=None,  conn=None):
+    def run_channel(self, channel, backend, cbor, bins=None, last=None, conn=None, start=None, end=None, sink=None, after=None):
+        #Retries transient errors with exponential backoff, resuming just after the last received event
+        resume = ResumeSink(self if sink is None else sink, after)
+        retry = 0
+        try:
+            while True:
+                count = resume.count
+                try:
+                    resumed = resume.last is not None
+                    return self.query_channel(channel, backend, cbor, bins, None if resumed else last, conn,
+                                              nanos_to_iso(resume.last) if resumed else start, end, resume)
+                except Exception as e:
+                    if not is_transient_error(e) or (retry >= self.retries) or not self.is_running() or \
+                            self.is_aborted() or self.is_run_timeout():
+                        raise
+                    if resume.count > count:
+                        retry = 0
+                    delay = get_retry_delay(retry, self.retry_delay)
+                    retry += 1
+                    _logger.warning(f"Error retrieving channel {channel}: {str(e)} - retry {retry}/{self.retries} in {delay}s")
+                    if conn:
+                        #Reconnects on next request
+                        conn.close()
+                    time.sleep(delay)
+        finally:
+            if sink is None and self.receiving_channel(channel):
+                self.on_channel_completed(channel)
+
+    def query_channel(self, channel, backend, cbor, bins=None, last=None, conn=None, start=None, end=None, sink=None):
         query = dict()
         if channel.isdigit():
             query["seriesId"] = channel
         else:
             query["channelName"] = channel
-        query["begDate"] = self.range.get_start_str_iso()
-        query["endDate"] = self.range.get_end_str_iso()
+        query["begDate"] = self.range.get_start_str_iso() if start is None else start
+        query["endDate"] = self.range.get_end_str_iso() if end is None else end
         query["backend"] = backend
         if last is not None:
             query["oneBeforeRange"] = "true" if last else "false"
@@ -247,6 +472,7 @@ class Daqbuf(Source):
         streamed = self.streamed or cbor
         create_connection = streamed and (conn is None)
         url = self.binned_url if bins else self.url
+        raw_response = None
         if streamed:
             conn = http_data_query(query, url, method="GET",
                                    accept="application/cbor-framed" if cbor else "application/json-framed",
@@ -254,7 +480,7 @@ class Daqbuf(Source):
                                    add_headers=self.add_headers,
                                    accept_comppression=self.accept_comppression,
                                    timeout=self.get_timeout())
-            response = conn.getresponse()
+            response = raw_response = conn.getresponse()
             self.check_response(response, channel)
             if self.accept_comppression:
                 response = check_compression(response)
@@ -267,25 +493,141 @@ class Daqbuf(Source):
         try:
             if cbor:
                 try:
-                    self.read_cbor(reader, channel)
+                    final = self.read_cbor(reader, channel, sink)
                 except Exception as e:
                     _logger.exception(e)
                     raise
+                if not final and raw_response.length and not self.is_run_timeout():
+                    #Connection closed before the declared content length
+                    _logger.error("Unexpected end of input")
+                    raise ProtocolError()
             else:
                 if self.streamed:
                     try:
-                        self.read_json(reader, channel, bins if bins else None)
+                        self.read_json(reader, channel, bins if bins else None, sink)
                     except Exception as e:
                         _logger.exception(e)
                         raise
                 else:
-                    self.read_json_single(data, channel, bins if bins else None)
+                    self.read_json_single(data, channel, bins if bins else None, sink)
+            if raw_response is not None and not create_connection and not self.is_run_timeout():
+                #Consume the end of the response so that the connection can be reused
+                raw_response.read()
         finally:
-            if self.receiving_channel(channel):
-                self.on_channel_completed(channel)
             if create_connection and conn:
                 conn.close()
 
+    def run_shard(self, buffer, channel, backend, cbor, bins, last, start, end, conn=None):
+        if not buffer.claim():
+            return
+        try:
+            self.run_channel(channel, backend, cbor, bins, last, conn, start, end, buffer)
+            buffer.finish()
+        except Exception as e:
+            buffer.finish(e)
+            raise
+
+    def run_channel_sharded(self, channel, backend, cbor, bins=None, last=None, conn=None):
+        #Retrieves time shards concurrently in the worker pool, forwarding the events in time order
+        ranges = [] if bins else self.range.split_str_iso(self.shards, self.shard_duration)
+        if len(ranges) < 2 or self.pool is None:
+            return self.run_channel(channel, backend, cbor, bins, last, conn)
+        buffers = [ShardBuffer(self.shard_buffer) for r in ranges]
+        submitted = 0
+        try:
+            for i in range(len(ranges)):
+                while (submitted < len(ranges)) and (submitted < i + self.shard_workers):
+                    start, end = ranges[submitted]
+                    self.pool.submit(partial(self.run_shard, buffers[submitted], channel, backend, cbor, bins,
+                                             last if submitted == 0 else None, start, end))
+                    submitted += 1
+                if buffers[i].claim():
+                    #Not yet started by the pool: retrieved by this thread, forwarding the events directly
+                    start, end = ranges[i]
+                    self.run_channel(channel, backend, cbor, bins, last if i == 0 else None, conn, start, end, self)
+                else:
+                    buffers[i].forward(self)
+        finally:
+            for buffer in buffers:
+                buffer.cancel()
+            if self.receiving_channel(channel):
+                self.on_channel_completed(channel)
+
+    def run_channel_cached(self, channel, backend, cbor, bins=None, last=None, conn=None):
+        #Reads the intervals available in the cache, retrieving only the gaps
+        key = self.cache.get_key(type(self).__name__, backend, channel, bins)
+        start, end = iso_to_nanos(self.range.get_start_str_iso()), iso_to_nanos(self.range.get_end_str_iso())
+        final = self.range.is_final(self.cache_delay)
+        writers = []
+        try:
+            for piece_start, piece_end, segment in self.cache.get_plan(key, start, end):
+                if segment is None:
+                    writer = self.cache.create_writer(key, piece_start, piece_end)
+                    writers.append(writer)
+                    try:
+                        self.run_channel(channel, backend, cbor, bins, None, conn, nanos_to_iso(piece_start),
+                                         nanos_to_iso(piece_end), CacheSink(writer, self))
+                    finally:
+                        writer.close()
+                else:
+                    _logger.debug(f"Reading channel {channel} from cache: {nanos_to_iso(piece_start)} to {nanos_to_iso(piece_end)}")
+                    for timestamps, ids, values in self.cache.read(key, segment, piece_start, piece_end):
+                        self.receive_channel_batch(channel, values, timestamps, ids, check_changes=True)
+                if not self.is_running() or self.is_aborted() or self.is_run_timeout():
+                    raise RuntimeError("Query has been aborted")
+            #Segments are only added once all pieces have been read, as merging changes the existing ones
+            for writer in writers if final else []:
+                writer.commit([type(self).__name__, backend, channel, bins])
+        finally:
+            for writer in writers:
+                writer.discard()
+            if self.receiving_channel(channel):
+                self.on_channel_completed(channel)
+
+    def retrieve_channel(self, channel, backend, cbor, bins=None, last=None, conn=None):
+        after = None if self.checkpoint is None else self.checkpoint.get_last(channel)
+        if after is not None:
+            _logger.info(f"Resuming channel {channel} from {nanos_to_iso(after)}")
+            return self.run_channel(channel, backend, cbor, bins, None, conn, after=after)
+        if (self.cache is not None) and not last:
+            return self.run_channel_cached(channel, backend, cbor, bins, last, conn)
+        return self.run_channel_sharded(channel, backend, cbor, bins, last, conn)
+
+    def set_channel_status(self, channel, status):
+        with self.channel_status_lock:
+            self.channel_status[channel] = status
+        if status == "completed" and self.checkpoint is not None:
+            self.checkpoint.set_completed(channel)
+
+    def get_channel_status(self):
+        #Status of the channels of the last query: "pending", "running", "completed" or the exception
+        with self.channel_status_lock:
+            return dict(self.channel_status)
+
+    def run_channels_parallel(self, channels, backend, cbor, bins, last):
+        completed = []
+
+        def run_task(channel, conn):
+            if self.is_aborted():
+                return
+            self.set_channel_status(channel, "running")
+            try:
+                self.retrieve_channel(channel, backend, cbor, bins, last, conn)
+            except Exception as e:
+                self.set_channel_status(channel, e)
+                _logger.error(f"Error retrieving channel {channel}: {str(e)}")
+                raise
+            self.set_channel_status(channel, "completed")
+            completed.append(channel)
+            _logger.info(f"Completed channel {channel} ({len(completed)}/{len(channels)})")
+
+        for channel in channels:
+            self.pool.submit(partial(run_task, channel))
+        self.pool.join()
+        failed = {channel: status for channel, status in self.get_channel_status().items() if isinstance(status, Exception)}
+        if failed:
+            raise RuntimeError(f"Error retrieving channels: {', '.join(failed.keys())}")
+
     def run(self, query):
         self.range.wait_end(delay=self.delay)
         channels = query.get("channels", [])
@@ -294,27 +636,46 @@ class Daqbuf(Source):
         backend = query.get("backend", self.backend)
         cbor = self.cbor and not bins
         streamed = self.streamed or cbor
+        max_workers = int(query.get("max_workers", self.max_workers))
+        self.shard_workers = int(query.get("shard_workers", max_workers))
+        self.shards = query.get("shards", None)
+        self.shard_duration = query.get("shard_duration", None)
+        self.shard_buffer = int(query.get("shard_buffer", 100))
         if isinstance(channels, str):
             channels = [channels, ]
+        self.channel_status = {channel: "pending" for channel in channels}
+        if self.checkpoint is not None:
+            for channel in channels:
+                if self.checkpoint.is_completed(channel):
+                    self.channel_status[channel] = "completed"
+            channels = [channel for channel in channels if self.channel_status[channel] != "completed"]
+        url = self.binned_url if bins else self.url
+        sharded = bool(self.shards or self.shard_duration) and not bins
+        #Channels and time shards share the same bounded pool of workers
+        if self.parallel or sharded:
+            workers = max_workers if sharded else min(max_workers, len(channels))
+            self.pool = WorkerPool(workers, url, streamed, self.get_timeout())
         conn = None
-        threads = []
         try:
             if self.parallel:
-                for channel in channels:
-                    thread = Thread(target=self.run_channel, args=(channel, backend, cbor, bins, last))
-                    thread.setDaemon(True)
-                    thread.start()
-                    threads.append(thread)
-                for thread in threads:
-                    thread.join()
+                self.run_channels_parallel(channels, backend, cbor, bins, last)
             else:
                 if streamed:
-                    conn = create_http_conn(self.binned_url if bins else self.url,timeout =self.get_timeout())
+                    conn = create_http_conn(url, timeout=self.get_timeout())
                 for channel in channels:
-                    self.run_channel(channel, backend, cbor, bins, last, conn)
+                    self.set_channel_status(channel, "running")
+                    try:
+                        self.retrieve_channel(channel, backend, cbor, bins, last, conn)
+                    except Exception as e:
+                        self.set_channel_status(channel, e)
+                        raise
+                    self.set_channel_status(channel, "completed")
         finally:
             if conn:
                 conn.close()
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
             self.close_channels()
 
     def search(self, regex, case_sensitive=True):
@@ -1,4 +1,5 @@
 from datahub import *
+from datahub.utils.jsonstream import JsonStreamReader
 
 _logger = logging.getLogger(__name__)
 
@@ -11,6 +12,8 @@ class DataBuffer(Source):
 
     DEFAULT_URL = os.environ.get("DATA_BUFFER_DEFAULT_URL", "https://data-api.psi.ch/sf-databuffer")
     DEFAULT_BACKEND = os.environ.get("DATA_BUFFER_DEFAULT_BACKEND", "sf-databuffer")
+    BATCH_SIZE = 10000
+    CHUNK_SIZE = 65536
 
     def __init__(self, url=DEFAULT_URL, backend=DEFAULT_BACKEND, delay=1.0, **kwargs):
         """
@@ -86,25 +89,45 @@ class DataBuffer(Source):
         if server_side_mapping:
             query["mapping"] = {"incomplete": server_side_mapping_strategy}
 
-        response = requests.post(self.url, json=query, timeout=self.get_timeout())
-
-        # Check for successful return of data
-        if response.status_code != 200:
-            raise RuntimeError("Unable to retrieve data from server: ", response)
-
-        data = response.json()
-
-        for ch in data:
-            check_changes=True
-            name = ch["channel"]["name"]
-            for rec in ch["data"]:
-                timestamp = create_timestamp(float(rec["globalSeconds"]))   #rec['eventCount']
-                pulse_id = rec["pulseId"]
-                value = rec["value"]
-                self.receive_channel(name, value, timestamp,pulse_id, check_changes=check_changes, check_types=True)
-                check_changes = False
+        response = requests.post(self.url, json=query, timeout=self.get_timeout(), stream=True)
+        try:
+            # Check for successful return of data
+            if response.status_code != 200:
+                raise RuntimeError("Unable to retrieve data from server: ", response)
+            self.read(JsonStreamReader(response.iter_content(chunk_size=DataBuffer.CHUNK_SIZE)))
+        finally:
+            response.close()
         self.close_channels()
 
+    def read(self, reader):
+        #Parses the response as it is received: [{"channel": {...}, "data": [{record}, ...]}, ...]
+        for _ in reader.iter_array():
+            name, records = None, []
+            for key in reader.iter_object():
+                if key == "channel":
+                    name = reader.read_value()["name"]
+                elif key == "data":
+                    for _ in reader.iter_array():
+                        records.append(reader.read_value())
+                        if (name is not None) and (len(records) >= DataBuffer.BATCH_SIZE):
+                            self.receive_records(name, records)
+                            records = []
+                            if not self.is_running() or self.is_aborted() or self.is_run_timeout():
+                                raise RuntimeError("Query has been aborted")
+                else:
+                    reader.read_value()
+            if name is not None:
+                self.receive_records(name, records)
+
+    def receive_records(self, name, records):
+        if len(records) == 0:
+            return
+        seconds = numpy.asarray([rec["globalSeconds"] for rec in records], dtype=numpy.float64)
+        timestamps = (seconds * 1000000).astype(numpy.int64) * 1000 #As create_timestamp
+        pulse_ids = [rec["pulseId"] for rec in records]
+        values = [rec["value"] for rec in records]
+        self.receive_channel_batch(name, values, timestamps, pulse_ids, check_changes=True, check_types=True)
+
     def search(self, regex, case_sensitive=True):
         import requests
         #Always case insensitive
@@ -5,8 +5,13 @@ except:
 
 from datahub import *
 from datahub.utils.align import *
+from datahub.utils.data import MessageBuffer, MaxLenDict
 
 import threading
+import socket
+import collections
+import heapq
+from concurrent.futures import ThreadPoolExecutor
 
 _logger = logging.getLogger(__name__)
 
@@ -14,14 +19,31 @@ class Redis(Source):
     """
     Retrieves data from the Redis or Dragonfly streams.
     """
+    SEEK_MARGIN = 1.0 #Seconds read before the start and after the end of the range, for differences between clocks
+    SCAN_COUNT = 10000
+    SEARCH_CACHE_TTL = 10.0 #Seconds search results are reused
+    SEARCH_CACHE_SIZE = 100 #Maximum number of cached search results
+    search_cache = MaxLenDict(maxlen=SEARCH_CACHE_SIZE)
+    search_cache_lock = threading.Lock()
 
     DEFAULT_URL = os.environ.get("REDIS_DEFAULT_URL", 'sf-daqsync-18:6379')
     DEFAULT_BACKEND = os.environ.get("REDIS_DEFAULT_BACKEND", '0')
 
-    def __init__(self, url=DEFAULT_URL, backend=DEFAULT_BACKEND, **kwargs):
+    def __init__(self, url=DEFAULT_URL, backend=DEFAULT_BACKEND, batch_size=1000, group=None, consumer=None,
+                 seek=True, historical=None, max_workers=8, **kwargs):
         """
         url (str, optional): Redis URL. Default value can be set by the env var REDIS_DEFAULT_URL.
         backend (str): Redis database. Default value can be set by the env var REDIS_DEFAULT_BACKEND.
+        batch_size (int, optional): maximum number of entries read per stream in each request.
+        group (str, optional): if defined, streams are read as a member of this consumer group (XREADGROUP), so that
+                               several processes can share the entries of the same streams.
+        consumer (str, optional): consumer name in the group. Default is "<hostname>-<pid>".
+        seek (bool, optional): if True (default) reading starts at the stream ID corresponding to the query start,
+                               as IDs are reception times in milliseconds. If False streams are read from the beginning.
+        historical (bool, optional): if True the streams are read with XRANGE, in pages per channel in parallel,
+                                     and the query finishes when the retained data is read. If None (default), it is
+                                     True if the query range has already ended.
+        max_workers (int, optional): maximum number of channels read in parallel in historical mode.
         """
         Source.__init__(self, url=url, backend=backend, **kwargs)
         if redis is None:
@@ -30,6 +52,12 @@ class Redis(Source):
         self.db = self.backend
         self.messages = []
         self.streaming = True
+        self.batch_size = int(batch_size)
+        self.group = group
+        self.consumer = consumer if consumer else f"{socket.gethostname()}-{os.getpid()}"
+        self.seek = str_to_bool(str(seek))
+        self.historical = historical
+        self.max_workers = int(max_workers)
 
     def run(self, query):
         partial_msg = query.get("partial_msg", True)
@@ -37,30 +65,159 @@ class Redis(Source):
         channels = query.get("channels", [])
         size_buffer = query.get("size_buffer", 1000)
         filter = query.get("filter", None)
+        batch_size = int(query.get("batch_size", self.batch_size))
+        group = query.get("group", self.group)
         align = Align(self.on_msg, channels, self.range, filter , partial_msg=partial_msg, size_buffer=size_buffer, utc_timestamp=utc_timestamp)
 
+        seek = str_to_bool(str(query.get("seek", self.seek)))
+        historical = query.get("historical", self.historical)
+        historical = self.range.has_ended() if historical is None else str_to_bool(str(historical))
+        #Stream IDs and message timestamps are UTC: range limits are converted as done by the aligner
+        start = self.range.get_start_sec() - align.utc_offset
+        end = self.range.get_end_sec() - align.utc_offset
+        ID = self.get_stream_id(start - Redis.SEEK_MARGIN) if seek else "0-0"
         with redis.Redis(host=self.host, port=self.port, db=self.db, decode_responses=False) as r:
             try:
-                ID = "0-0" #from beggining of stream
-                #ID = "$"  # new messages
-                streams = {channel : ID for channel in channels}
-                while not self.has_stream_finished():
-                    entries = r.xread(streams, count=1, block=10)
-                    if entries:
-                        for stream, messages in entries:
-                            for message_id, message_data in messages:
-                                streams[stream.decode('utf-8')] = message_id
-                                channel = message_data[b'channel'].decode('utf-8')
-                                timestamp = int(message_data[b'timestamp'].decode('utf-8'))
-                                id = int(message_data[b'id'].decode('utf-8'))
-                                data = message_data[b'value']
-                                value = decode(data)
-                                align.add(id, timestamp, channel, value)
-                                #print (id, channel, value)
-                            align.process()
+                if historical:
+                    self.read_range(r, channels, ID, self.get_stream_id(end + Redis.SEEK_MARGIN), end, batch_size,
+                                    int(query.get("max_workers", self.max_workers)), align)
+                else:
+                    self.read_streams(r, channels, ID, end, batch_size, group, align)
+                if not self.is_aborted():
+                    align.process(flush=True)
             finally:
                 self.close_channels()
 
+    def get_stream_id(self, timestamp):
+        return f"{max(int(timestamp * 1000), 0)}-0"
+
+    def read_streams(self, r, channels, id, end, batch_size, group, align):
+        if group:
+            self.create_group(r, channels, group, id)
+            streams = {channel: ">" for channel in channels}
+        else:
+            streams = {channel : id for channel in channels}
+        held, last, pending = {channel: collections.deque() for channel in channels}, {}, set(channels)
+        #Reading finishes when all streams are past the end of the range, or when the range has ended and there is
+        #no more data to read
+        while streams and not self.is_aborted() and not self.is_run_timeout():
+            request = {channel: streams[channel] for channel in streams if len(held[channel]) < batch_size}
+            if not request:
+                entries = []
+            elif group:
+                entries = r.xreadgroup(group, self.consumer, request, count=batch_size, block=10)
+            else:
+                entries = r.xread(request, count=batch_size, block=10)
+            pages = {stream.decode('utf-8'): messages for stream, messages in (entries or [])}
+            for channel in request:
+                page = pages.get(channel, [])
+                if page and not group:
+                    streams[channel] = page[-1][0]
+                #Channels read with a full page have pending entries
+                if len(page) < batch_size:
+                    pending.discard(channel)
+                else:
+                    pending.add(channel)
+                self.hold_entries(held, last, channel, page)
+            ready = self.release_entries(held, last, pending)
+            if ready:
+                for channel in self.read_entries(ready, None, align, end):
+                    del streams[channel]
+                    held[channel].clear()
+                    pending.discard(channel)
+                align.process()
+                if group:
+                    self.ack_entries(r, group, ready)
+            elif self.range.has_ended():
+                break
+
+    def read_range(self, r, channels, min_id, max_id, end, batch_size, max_workers, align):
+        #Each round reads a page of the channels in parallel, and passes the entries to the aligner with similar
+        #progress. A channel is read while it has less than a page of entries held.
+        cursors = {channel: min_id for channel in channels}
+        held, last = {channel: collections.deque() for channel in channels}, {}
+        with ThreadPoolExecutor(max_workers=max(min(len(channels), max_workers), 1)) as executor:
+            while (cursors or any(held.values())) and not self.is_aborted() and not self.is_run_timeout():
+                names = [name for name in cursors if len(held[name]) < batch_size]
+                pages = executor.map(lambda name: r.xrange(name, min=cursors[name], max=max_id, count=batch_size), names)
+                for name, page in zip(names, pages):
+                    if len(page) < batch_size:
+                        del cursors[name]
+                    else:
+                        ms, _, seq = page[-1][0].decode('utf-8').partition("-")
+                        cursors[name] = f"{ms}-{int(seq) + 1}"
+                    self.hold_entries(held, last, name, page)
+                for name in self.read_entries(self.release_entries(held, last, cursors), None, align, end):
+                    cursors.pop(name, None)
+                    held[name].clear()
+                align.process()
+
+    def hold_entries(self, held, last, channel, page):
+        held[channel].extend(page)
+        if page:
+            last[channel] = self.get_entry_time(page[-1][0])
+
+    def release_entries(self, held, last, pending):
+        #Releases the entries held up to the last one read from the channels with pending entries, merged in time
+        #order: channels at different rates reach the aligner with the same progress, and its buffer does not overflow.
+        frontier = min((last[channel] for channel in pending if channel in last), default=None)
+        released = []
+        for channel, entries in held.items():
+            messages = []
+            while entries and ((frontier is None) or (self.get_entry_time(entries[0][0]) <= frontier)):
+                messages.append(entries.popleft())
+            if messages:
+                stream = channel.encode('utf-8')
+                released.append([(self.get_entry_time(message[0]), i, stream, message) for i, message in enumerate(messages)])
+        ready = []
+        for _, _, stream, message in heapq.merge(*released):
+            if ready and ready[-1][0] == stream:
+                ready[-1][1].append(message)
+            else:
+                ready.append((stream, [message]))
+        return ready
+
+    def get_entry_time(self, entry_id):
+        #Stream entry IDs are "<milliseconds>-<sequence>"
+        return int(entry_id.split(b"-")[0])
+
+    def create_group(self, r, channels, group, id):
+        for channel in channels:
+            try:
+                r.xgroup_create(channel, group, id=id, mkstream=True)
+            except redis.exceptions.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    def ack_entries(self, r, group, entries):
+        pipeline = r.pipeline(transaction=False)
+        for stream, messages in entries:
+            if messages:
+                pipeline.xack(stream, group, *[message_id for message_id, _ in messages])
+        pipeline.execute()
+
+    def read_entries(self, entries, streams, align, end=None):
+        #Decodes a batch of stream entries into the aligner, updating the last read IDs if streams is given.
+        #Returns the channels with entries after the end of the range (in seconds).
+        finished = set()
+        end = None if end is None else int(end * 1e9)
+        for stream, messages in entries:
+            if not messages:
+                continue
+            name = stream.decode('utf-8')
+            if streams is not None:
+                streams[name] = messages[-1][0]
+            for message_id, message_data in messages:
+                channel = message_data[b'channel'].decode('utf-8')
+                timestamp = int(message_data[b'timestamp'])
+                if (end is not None) and (timestamp > end):
+                    finished.add(name)
+                    break
+                id = int(message_data[b'id'])
+                self.get_stream_health(channel).add(id, timestamp)
+                align.add(id, timestamp, channel, decode(message_data[b'value']))
+        return finished
+
     def on_msg(self, id, timestamp, msg):
         for channel_name in msg.keys():
             v = msg.get(channel_name, None)
@@ -76,25 +233,60 @@ class Redis(Source):
                 # return r.config_get('databases')
                 return r.info('keyspace')
             else:
+                cache_key = (self.host, self.port, self.db, regex, case_sensitive)
+                with Redis.search_cache_lock:
+                    cached = Redis.search_cache.get(cache_key, None)
+                if cached and (time.time() - cached[0]) < Redis.SEARCH_CACHE_TTL:
+                    return list(cached[1])
                 pattern = re.compile(f".*{re.escape(regex)}.*", 0 if case_sensitive else re.IGNORECASE)
-                cursor = 0
-                streams = []
+                match = self.get_match_pattern(regex, case_sensitive)
+                streams = sorted(key for key in self.scan_streams(r, match) if pattern.match(key))
+                self.add_search_cache(cache_key, streams)
+                return list(streams)
+
+    def add_search_cache(self, cache_key, streams):
+        #Expired entries are dropped on insertion, and the oldest ones if the cache is full
+        now = time.time()
+        with Redis.search_cache_lock:
+            for key in [key for key, (timestamp, _) in Redis.search_cache.items() if (now - timestamp) >= Redis.SEARCH_CACHE_TTL]:
+                del Redis.search_cache[key]
+            Redis.search_cache.pop(cache_key, None)
+            Redis.search_cache[cache_key] = (now, streams)
+
+    def get_match_pattern(self, regex, case_sensitive):
+        #Glob pattern for SCAN MATCH equivalent to the substring search
+        pattern = ""
+        for c in regex:
+            if c in "*?[]\\":
+                pattern += "\\" + c
+            elif not case_sensitive and c.lower() != c.upper():
+                pattern += f"[{c.lower()}{c.upper()}]"
+            else:
+                pattern += c
+        return f"*{pattern}*"
 
-                while True:
-                    cursor, keys = r.scan(cursor=cursor)
+    def scan_streams(self, r, match):
+        try:
+            return list(r.scan_iter(match=match, count=Redis.SCAN_COUNT, _type="stream"))
+        except redis.exceptions.ResponseError:
+            #Server without TYPE filtering: key types are checked in a pipeline per page
+            streams = []
+            cursor = 0
+            while True:
+                cursor, keys = r.scan(cursor=cursor, match=match, count=Redis.SCAN_COUNT)
+                if keys:
+                    pipeline = r.pipeline(transaction=False)
                     for key in keys:
-                        if r.type(key) == 'stream' and pattern.match(key):
-                            streams.append(key)
-                    if cursor == 0:
-                        break
-                return sorted(streams)
+                        pipeline.type(key)
+                    streams.extend(key for key, typ in zip(keys, pipeline.execute()) if typ == "stream")
+                if cursor == 0:
+                    return streams
 
 class RedisStream(Redis):
 
     def __init__(self, channels, filter=None, queue_size=100,  **kwargs):
         Redis.__init__(self, **kwargs)
-        self.message_buffer = collections.deque(maxlen=queue_size)
-        self.condition = threading.Condition()
+        self.message_buffer = MessageBuffer(queue_size)
         now = time.time()
         self.req(channels, now, now + 365 * 24 * 60 * 60, filter=filter, background=True, **kwargs)
 
@@ -102,20 +294,21 @@ class RedisStream(Redis):
         Redis.close(self)
 
     def on_msg(self, id, timestamp, msg):
-        with self.condition:
-            self.message_buffer.append((id, timestamp, msg))
-            self.condition.notify()
+        if self.message_buffer.put(id, timestamp, msg):
+            self.get_stream_health().add_dropped()
 
     def drain(self):
-        with self.condition:
-            self.message_buffer.clear()
+        self.message_buffer.clear()
 
     def receive(self, timeout=None):
-        with self.condition:
-            if not self.message_buffer:
-                self.condition.wait(timeout)
-            if self.message_buffer:
-                return self.message_buffer.popleft()
+        return self.message_buffer.get(timeout)
+
+    def receive_many(self, max_n=None, timeout=None, as_arrays=False):
+        return self.message_buffer.get_many(max_n, timeout, as_arrays)
+
+    def get_buffer_stats(self):
+        #Size, depth, received and dropped counters of the message queue
+        return self.message_buffer.get_stats()
 
     def forward_bsread(self, port, mode="PUB"):
         from datahub.utils.bsread import create_sender
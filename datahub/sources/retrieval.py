@@ -1,6 +1,11 @@
 from datahub import *
 import io
+import time
+import queue
+from threading import Thread
 from http.client import IncompleteRead
+from datahub.utils.checkpoint import is_transient_error, get_retry_delay
+from datahub.utils.cache import nanos_to_iso
 
 _logger = logging.getLogger(__name__)
 
@@ -15,6 +20,7 @@ class ProcessChannelHeaderResult:
         self.extractor_writer = None
         self.compression = None
         self.shape = None
+        self.event_dtype = None
 
 def extractor_raw_data_blob(ts, pulse, buf, name, data_type, shape):
     return ts, pulse, buf
@@ -27,6 +33,11 @@ def extractor_basic_shaped(ts, pulse, buf, name, data_type, shape):
     value = numpy.reshape(numpy.frombuffer(buf, dtype=data_type), shape)
     return ts, pulse, value
 
+def get_event_dtype(data_type):
+    #Layout of the event message of a scalar channel: length, message type, timestamp, pulse id, value, length check
+    return numpy.dtype([("length", ">i4"), ("mtype", "i1"), ("timestamp", ">i8"), ("pulse_id", ">i8"),
+                        ("value", data_type), ("length_check", ">i4")])
+
 def resolve_struct_dtype(data_type: str, byte_order: str) -> str:
     if data_type is None:
         None
@@ -95,6 +106,7 @@ def process_channel_header(msg):
         compression = int(compression)
     if compression == 0:
         compression = None
+    data_type = None
     if compression is None:
         if shape == [1]:
             # NOTE legacy compatibility: historically a shape [1] is treated as scalar
@@ -137,8 +149,53 @@ def process_channel_header(msg):
     res.extractor_writer = extractor_writer
     res.compression = Compression.BITSHUFFLE_LZ4 if compression else None
     res.shape = shape
+    if (compression is None) and (len(shape) == 0) and (dtype != "str"):
+        res.event_dtype = get_event_dtype(data_type)
     return res
 
+
+class FrameBuffer():
+    """
+    Reusable buffer of the received stream, so that messages can be parsed in place with memoryviews.
+    """
+    def __init__(self, stream, size=4 * 1024 * 1024):
+        self.stream = stream
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def available(self):
+        return self.end - self.start
+
+    def fill(self, size):
+        #Makes at least size bytes available, returns False if the stream ends before
+        if self.available() >= size:
+            return True
+        remaining = self.available()
+        if size > len(self.buffer):
+            buffer = bytearray(max(size, 2 * len(self.buffer)))
+            buffer[:remaining] = self.view[self.start:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+        elif self.start > 0:
+            self.buffer[:remaining] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, remaining
+        while self.end < size:
+            read = self.stream.readinto(self.view[self.end:])
+            if not read:
+                return False
+            self.end += read
+        return True
+
+    def read_int(self, offset=0):
+        return int.from_bytes(self.view[self.start + offset:self.start + offset + 4], "big", signed=True)
+
+    def get(self, size, offset=0):
+        return self.view[self.start + offset:self.start + offset + size]
+
+    def skip(self, size):
+        self.start += size
+
 class Retrieval(Source):
     """
     Retrieves data from the old Retrieval.
@@ -146,12 +203,27 @@ class Retrieval(Source):
 
     DEFAULT_URL = os.environ.get("RETRIEVAL_DEFAULT_URL", "https://data-api.psi.ch/api/1")
     DEFAULT_BACKEND = os.environ.get("RETRIEVAL_DEFAULT_BACKEND", "sf-databuffer")
+    DEFAULT_MAX_WORKERS = int(os.environ.get("RETRIEVAL_DEFAULT_MAX_WORKERS", "8"))
+    RESUMABLE = True
 
-    def __init__(self, url=DEFAULT_URL, backend=DEFAULT_BACKEND, delay=1.0, **kwargs):
+    def __init__(self, url=DEFAULT_URL, backend=DEFAULT_BACKEND, delay=1.0, retries=3, retry_delay=1.0,
+                 group_size=None, max_workers=DEFAULT_MAX_WORKERS, **kwargs):
         """
         url (str, optional): Retrieval URL. Default value can be set by the env var RETRIEVAL_DEFAULT_URL.
         backend (str, optional): Retrieval backend. Default value can be set by the env var RETRIEVAL_DEFAULT_BACKEND.
         delay (float, optional): Wait time for channels to be uploaded to storage before retrieval.
+        retries (int, optional): number of retries on connection or stream errors. The query is resumed
+                                 with the channels not completed, after the last received event.
+        retry_delay (float, optional): wait time before the first retry in seconds, doubled on each retry.
+        group_size (int, optional): if defined, the channels are split in groups of this size, each one
+                                    retrieved in a separate request. Otherwise all channels are retrieved in one request.
+        max_workers (int, optional): maximum number of requests performed concurrently.
+                                     Default value can be set by the env var RETRIEVAL_DEFAULT_MAX_WORKERS.
+        Additional query arguments:
+        group_size (int, optional): overrides the constructor argument.
+        max_workers (int, optional): overrides the constructor argument.
+        checkpoint (str, optional): file to record the progress of the query.
+        resume (bool, optional): if True resumes the query from the checkpoint file.
         """
         if url is None:
             raise RuntimeError("Invalid URL")
@@ -163,10 +235,17 @@ class Retrieval(Source):
         Source.__init__(self, url=url, backend=backend, query_path="/query", search_path="/channels",
                         known_backends=KNOWN_BACKENDS, **kwargs)
         self.delay = delay
+        self.retries = int(retries)
+        self.retry_delay = float(retry_delay)
+        self.group_size = None if group_size is None else int(group_size)
+        self.max_workers = int(max_workers)
+        self.last_timestamps = {}
+        self.completed_channels = set()
+        self.received_records = 0
 
-    def _get_range(self, start_expansion=False, end_expansion=False):
+    def _get_range(self, start_expansion=False, end_expansion=False, start=None):
         #TODO: Only searching by date?
-        start = self.range.get_start_str_iso()
+        start = self.range.get_start_str_iso() if start is None else start
         end = self.range.get_end_str_iso()
         return {
             "type": "date",
@@ -193,10 +272,80 @@ class Retrieval(Source):
 
     def run(self, query):
         self.range.wait_end(delay=1.0)
+        channels = query["channels"]
+        group_size = query.get("group_size", self.group_size)
+        group_size = int(group_size) if group_size else None
+        max_workers = int(query.get("max_workers", self.max_workers))
+        self.last_timestamps = {}
+        self.completed_channels = set()
+        self.received_records = 0
+        if self.checkpoint is not None:
+            for channel in channels:
+                if self.checkpoint.is_completed(channel):
+                    self.completed_channels.add(channel)
+                elif self.checkpoint.get_last(channel) is not None:
+                    self.last_timestamps[channel] = self.checkpoint.get_last(channel)
+        retry = 0
+        while True:
+            count = self.received_records
+            try:
+                pending = [channel for channel in channels if channel not in self.completed_channels]
+                #Channels partially received are resumed individually, after the last event
+                requests = [([channel], nanos_to_iso(self.last_timestamps[channel])) for channel in pending
+                            if channel in self.last_timestamps]
+                pending = [channel for channel in pending if channel not in self.last_timestamps]
+                size = group_size if group_size else max(len(pending), 1)
+                requests += [(pending[i:i + size], None) for i in range(0, len(pending), size)]
+                self.run_requests(requests, max_workers)
+                return
+            except Exception as e:
+                if not is_transient_error(e) or (retry >= self.retries) or self.is_aborted() or self.is_run_timeout():
+                    raise
+                if self.received_records > count:
+                    retry = 0
+                delay = get_retry_delay(retry, self.retry_delay)
+                retry += 1
+                _logger.warning(f"Error retrieving data: {str(e)} - retry {retry}/{self.retries} in {delay}s")
+                time.sleep(delay)
+
+    def run_requests(self, requests, max_workers):
+        #Performs the requests with at most max_workers concurrent threads
+        if len(requests) <= 1 or max_workers <= 1:
+            for channels, start in requests:
+                self.run_request(channels, start)
+            return
+        pending = queue.Queue()
+        for request in requests:
+            pending.put(request)
+        errors = []
 
+        def run_worker():
+            while not self.is_aborted():
+                try:
+                    channels, start = pending.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self.run_request(channels, start)
+                except Exception as e:
+                    _logger.error(f"Error retrieving channels {', '.join(channels)}: {str(e)}")
+                    errors.append(e)
+
+        threads = []
+        for i in range(min(max_workers, len(requests))):
+            thread = Thread(target=run_worker, daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if errors:
+            #Transient errors are only raised if all errors can be retried
+            raise ([e for e in errors if not is_transient_error(e)] + errors)[0]
+
+    def run_request(self, channels, start=None):
         json = {}
-        json["channels"] = query["channels"]
-        json["range"] = self._get_range()
+        json["channels"] = channels
+        json["range"] = self._get_range(start=start)
         if self.backend is not None:
             json["defaultBackend"] = self.backend
         conn = http_data_query(json, self.url, timeout=self.get_timeout())
@@ -208,6 +357,9 @@ class Retrieval(Source):
                 raise RuntimeError(f"Unable to retrieve data  {str(status)}")
             try:
                 self.read(io.BufferedReader(response))
+                if start is not None:
+                    for channel in channels:
+                        self.set_channel_completed(channel)
                 reqid = response.headers["x-daqbuffer-request-id"]
                 stat = self._get_request_status(self.url, reqid)
                 if stat.get("errors") is not None:
@@ -216,11 +368,21 @@ class Retrieval(Source):
                 _logger.error(f"error during request  {e}")
                 reqid = response.headers["x-daqbuffer-request-id"]
                 stat = self._get_request_status(self.url, reqid)
-                _logger.error(f"request status: {stat}")
+                _logger.error(f"request status of {', '.join(channels)}: {stat}")
                 raise
         finally:
             conn.close()
 
+    def set_channel_completed(self, name):
+        self.completed_channels.add(name)
+        self.last_timestamps.pop(name, None)
+        if self.checkpoint is not None:
+            self.checkpoint.set_completed(name)
+        if self.receiving_channel_name(name):
+            self.on_channel_completed(name)
+
+    def receiving_channel_name(self, name):
+        return (self.prefix + name) in self.channel_info
 
     def read(self, stream):
         try:
@@ -233,35 +395,50 @@ class Retrieval(Source):
         current_channel_info = None
         current_channel_name = None
         header = None
+        buffer = FrameBuffer(stream)
 
         while not self.is_run_timeout():
-            bytes_read = stream.read(4)
-            if len(bytes_read) != 4:
+            if not buffer.fill(4):
+                if buffer.available() > 0:
+                    raise ProtocolError()
                 if current_channel_name is not None:
-                    self.on_channel_completed(current_channel_name)
+                    self.set_channel_completed(current_channel_name)
                 break
-            length = struct.unpack('>i', bytes_read)[0]
-            bytes_read = stream.read(length)
-            if len(bytes_read) != length:
-                raise RuntimeError("unexpected EOF")
-            mtype = struct.unpack('b', bytes_read[:1])[0]
+
+            #Runs of events of scalar channels are decoded as a batch
+            if (header is not None) and (header.event_dtype is not None):
+                if self.read_events(buffer, current_channel_name, header.event_dtype) > 0:
+                    continue
+
+            length = buffer.read_int()
+            if not buffer.fill(length + 8):
+                _logger.error("unexpected end of input")
+                raise ProtocolError()
+            length_check = buffer.read_int(length + 4)
+            if length_check != length:
+                raise RuntimeError(f"corrupted file reading {length} {length_check}")
+            message = buffer.get(length, 4)
+            mtype = struct.unpack('b', message[:1])[0]
 
             if mtype == 1 and (current_channel_info is not None):
-                timestamp = struct.unpack('>q', bytes_read[1:9])[0]
-                pulse_id = struct.unpack('>q', bytes_read[9:17])[0]
-                raw_data_blob = bytes_read[17:]
-                timestamp, pulse_id, value = header.extractor_writer(timestamp, pulse_id, raw_data_blob)
-                self.on_channel_record(current_channel_name, timestamp, pulse_id, value)
+                timestamp, pulse_id = struct.unpack('>qq', message[1:17])
+                last_timestamp = self.last_timestamps.get(current_channel_name, None)
+                if (last_timestamp is None) or (timestamp > last_timestamp):
+                    timestamp, pulse_id, value = header.extractor_writer(timestamp, pulse_id, bytes(message[17:]))
+                    self.on_channel_record(current_channel_name, timestamp, pulse_id, value)
+                    self.last_timestamps[current_channel_name] = timestamp
+                    self.received_records += 1
 
             # Channel header message
             # A json message that specifies among others data type, shape, compression flags.
             elif mtype == 0:
                 if current_channel_name is not None:
-                    self.on_channel_completed(current_channel_name)
+                    self.set_channel_completed(current_channel_name)
                 current_channel_name = None
                 current_channel_info = None
+                header = None
                 try:
-                    msg = json.loads(bytes_read[1:])
+                    msg = json.loads(bytes(message[1:]))
                     res = process_channel_header(msg)
                 except Exception as e:
                     raise RuntimeError("Can not process channel header") from e
@@ -269,6 +446,7 @@ class Retrieval(Source):
                     _logger.error(f"Can not parse channel header message: {msg}")
                 elif res.empty:
                     _logger.debug(f"No data for channel {res.channel_name}")
+                    self.set_channel_completed(res.channel_name)
                 else:
                     if "type" not in msg:
                         raise RuntimeError()
@@ -277,14 +455,39 @@ class Retrieval(Source):
                     current_channel_name = res.channel_name
                     if current_channel_info.get('shape', None) is not None:
                          current_channel_info['shape'].reverse()
-                    self.on_channel_header(current_channel_name, current_channel_info['type'],
+                    #When resuming, the channel header has already been sent
+                    if not self.receiving_channel_name(current_channel_name):
+                        self.on_channel_header(current_channel_name, current_channel_info['type'],
                                                     current_channel_info['byteOrder'],
                                                     current_channel_info['shape'],
                                                     res.compression)
-            bytes_read = stream.read(4)
-            length_check = struct.unpack('>i', bytes_read)[0]
-            if length_check != length:
-                raise RuntimeError(f"corrupted file reading {length} {length_check}")
+            del message
+            buffer.skip(length + 8)
+
+    def read_events(self, buffer, name, event_dtype):
+        #Decodes the consecutive event messages available in the buffer as columns. Returns the number of events.
+        count = buffer.available() // event_dtype.itemsize
+        if count == 0:
+            return 0
+        events = numpy.frombuffer(buffer.buffer, dtype=event_dtype, count=count, offset=buffer.start)
+        length = event_dtype.itemsize - 8
+        valid = (events["length"] == length) & (events["mtype"] == 1) & (events["length_check"] == length)
+        count = count if valid.all() else int(numpy.argmin(valid))
+        if count > 0:
+            timestamps = events["timestamp"][:count].astype(numpy.int64)
+            pulse_ids = events["pulse_id"][:count].astype(numpy.int64)
+            values = events["value"][:count].astype(event_dtype["value"].newbyteorder("="))
+            last_timestamp = self.last_timestamps.get(name, None)
+            if (last_timestamp is not None) and (timestamps[0] <= last_timestamp):
+                selected = timestamps > last_timestamp
+                timestamps, pulse_ids, values = timestamps[selected], pulse_ids[selected], values[selected]
+            if len(timestamps) > 0:
+                self.on_channel_records(name, timestamps, pulse_ids, values)
+                self.last_timestamps[name] = int(timestamps[-1])
+                self.received_records += len(timestamps)
+        del events
+        buffer.skip(count * event_dtype.itemsize)
+        return count
 
     def search(self, regex, case_sensitive=True):
         import requests
@@ -186,5 +186,6 @@ class Stddaq(Array10):
 
 
     def search(self, regex=None, case_sensitive=True):
-        redis_source = datahub.Redis(url=self.address, backend=self.db)
-        return redis_source.search(regex, case_sensitive)
+        #Search results are cached by the Redis class, shared by all its instances
+        with datahub.Redis(url=self.address, backend=self.db) as redis_source:
+            return redis_source.search(regex, case_sensitive)
@@ -1,16 +1,25 @@
 import logging
 import time
+import heapq
 from datahub.utils.data import *
-from datahub.utils.checker import check_msg
+from datahub.utils.checker import get_filter
 from datahub.utils.timing import get_utc_offset, string_to_timestamp, time_to_pulse_id
 
 _logger = logging.getLogger(__name__)
 
 class Align():
+    """
+    Aligns channel values by id, calling back with messages in id order.
+    Ids are kept in a min-heap and the highest complete id is tracked on insertion,
+    so that each processed message costs O(log n) regardless of the buffer size.
+    """
     def __init__(self, callback,  channels=None, range=None, filter=None, partial_msg=True, size_buffer=1000, utc_timestamp=False):
+        self.aligned_data = {}
+        self.ids = []  # Min-heap of the ids in aligned_data
+        self.last_complete_id = -1
         self.set_channels(channels)
         self.size_buffer = size_buffer
-        self.aligned_data = MaxLenDict(maxlen=int(size_buffer*1.2))
+        self.max_size = int(size_buffer*1.2)
         if partial_msg == "after":
             self.partial_after = True
             self.partial_msg = False
@@ -21,21 +30,39 @@ class Align():
         self.range = range
         self.filter = filter
         self.sent_id = -1
+        self.overflows = 0
         self.utc_offset = get_utc_offset() if utc_timestamp else 0
 
     def set_channels(self, channels):
         self.channels = channels
         self.no_channels = 0 if channels==None else len(channels)
+        complete = [id for id, msg in self.aligned_data.items() if self.is_complete(msg)]
+        self.last_complete_id = max(complete) if complete else -1
+
+    def is_complete(self, msg):
+        return len(msg) == (self.no_channels + 1)
 
     def add(self, id, timestamp, channel, value):
         if not id:
             id = time_to_pulse_id(timestamp)
-        if id not in self.aligned_data:
-            self.aligned_data[id] = {"timestamp": timestamp}
-        self.aligned_data[id][channel] = value
+        msg = self.aligned_data.get(id, None)
+        if msg is None:
+            if len(self.aligned_data) >= self.max_size:
+                #Full buffer: the oldest messages are processed (sent as partial or discarded) to make room
+                if not self.overflows:
+                    _logger.warning(f"Align buffer full: processing incomplete messages from id {self.ids[0]}")
+                self.overflows += 1
+                self.process()
+            msg = self.aligned_data[id] = {"timestamp": timestamp}
+            heapq.heappush(self.ids, id)
+        msg[channel] = value
+        if id > self.last_complete_id and self.is_complete(msg):
+            self.last_complete_id = id
 
     def reset(self):
         self.aligned_data.clear()
+        self.ids.clear()
+        self.last_complete_id = -1
 
     def set_range(self, range):
         self.range = range
@@ -43,20 +70,15 @@ class Align():
     def set_filter(self, filter):
         self.filter = filter
 
-    def process(self):
-        keys_in_order = sorted(list(self.aligned_data.keys()))
-        last_complete_id = -1
-        for id in [keys_in_order[i] for i in range(len(keys_in_order) - 1, 0, -1)]:
-            if len(self.aligned_data[id]) == (self.no_channels + 1):
-                last_complete_id = id
-                break
-
-        for i in range(len(keys_in_order)):
-            id = keys_in_order[i]
-            complete = len(self.aligned_data[id]) == (self.no_channels + 1)
-            done = complete or (last_complete_id > id) or (len(self.aligned_data) > self.size_buffer)
+    def process(self, flush=False):
+        #If flush is True, also processes the incomplete messages remaining in the buffer
+        while self.ids:
+            id = self.ids[0]
+            complete = self.is_complete(self.aligned_data[id])
+            done = complete or flush or (self.last_complete_id > id) or (len(self.aligned_data) > self.size_buffer)
             if not done:
                 break
+            heapq.heappop(self.ids)
             msg = self.aligned_data.pop(id)
             if complete or self.partial_msg:
                 if self.partial_after and not self.partial_msg:
@@ -86,7 +108,7 @@ class Align():
 
     def is_valid(self, filter, id, timestamp, msg):
         try:
-            return check_msg(msg, filter)
+            return get_filter(filter)(msg)
         except Exception as e:
             _logger.warning("Error processing filter: %s " % str(e))
             return False
\ No newline at end of file
@@ -0,0 +1,332 @@
+########################################################################################################################
+# Retrieval Cache
+########################################################################################################################
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import contextlib
+import numpy
+from datetime import datetime, timedelta, timezone
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def iso_to_nanos(date_str):
+    #Microsecond resolution, as ISO strings
+    delta = datetime.fromisoformat(date_str) - EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds) * 1000
+
+
+def nanos_to_iso(nanos):
+    return (EPOCH + timedelta(microseconds=nanos // 1000)).isoformat()
+
+
+class RetrievalCache():
+    """
+    On-disk cache of retrieved channel data, keyed by (source type, backend, channel, bins).
+    Each key holds a list of segments, covering retrieved intervals [start, end) in nanoseconds.
+    Segment data is stored in raw files, read as memory-mapped arrays. Adjacent segments are merged, and
+    least recently used segments are evicted when the cache exceeds its maximum size.
+    """
+    DEFAULT_PATH = os.environ.get("DATAHUB_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "datahub"))
+    DEFAULT_SIZE = float(os.environ.get("DATAHUB_CACHE_SIZE", "10240")) #MB
+    INDEX_FILE = "index.json"
+    LOCK_FILE = "index.lock"
+    FIELDS = "timestamps", "ids", "values"
+
+    def __init__(self, path=None, max_size=None):
+        """
+        path (str, optional): cache folder. Default value can be set by the env var DATAHUB_CACHE_PATH.
+        max_size (float, optional): maximum cache size in MB. Default value can be set by the env var DATAHUB_CACHE_SIZE.
+        """
+        self.path = RetrievalCache.DEFAULT_PATH if path is None else str(path)
+        self.max_size = int((RetrievalCache.DEFAULT_SIZE if max_size is None else float(max_size)) * 1024 * 1024)
+        self.lock = threading.RLock()
+        self.lock_depth = 0
+        self.lock_file = None
+        os.makedirs(self.path, exist_ok=True)
+
+    @contextlib.contextmanager
+    def locked(self):
+        #Serializes the index updates of the threads (lock) and of the processes sharing the folder (file lock)
+        with self.lock:
+            if self.lock_depth == 0 and fcntl is not None:
+                self.lock_file = open(os.path.join(self.path, RetrievalCache.LOCK_FILE), "a")
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+                if self.lock_depth == 0 and self.lock_file is not None:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+                    self.lock_file.close()
+                    self.lock_file = None
+
+    def get_key(self, *fields):
+        return hashlib.sha1(json.dumps([str(f) for f in fields]).encode()).hexdigest()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.path, RetrievalCache.INDEX_FILE), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            _logger.warning(f"Invalid cache index in {self.path}: {str(e)}")
+            return {}
+
+    def _save_index(self, index):
+        #Written to a temporary file and renamed, so that readers never see a partial index
+        fd, tmp = tempfile.mkstemp(prefix=RetrievalCache.INDEX_FILE, suffix=".tmp", dir=self.path)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp, os.path.join(self.path, RetrievalCache.INDEX_FILE))
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    def _get_file(self, key, segment_id, field):
+        return os.path.join(self.path, key, f"{segment_id}.{field}")
+
+    def get_plan(self, key, start, end):
+        """
+        Returns the list of pieces to cover the interval [start, end) (nanoseconds), as (start, end, segment) tuples.
+        Segment is None for the gaps to be retrieved.
+        """
+        with self.locked():
+            index = self._load_index()
+            segments = sorted(index.get(key, {}).get("segments", []), key=lambda s: s["start"])
+            plan, cursor = [], start
+            now = time.time()
+            for segment in segments:
+                if segment["end"] <= cursor or segment["start"] >= end:
+                    continue
+                if segment["start"] > cursor:
+                    plan.append((cursor, segment["start"], None))
+                    cursor = segment["start"]
+                plan.append((cursor, min(end, segment["end"]), segment))
+                segment["access"] = now
+                cursor = segment["end"]
+                if cursor >= end:
+                    break
+            if cursor < end:
+                plan.append((cursor, end, None))
+            if key in index:
+                self._save_index(index)
+            return plan
+
+    def read(self, key, segment, start, end, chunk_size=100000):
+        """
+        Generator of (timestamps, ids, values) arrays of a segment in the interval [start, end), in chunks.
+        """
+        count = segment["count"]
+        if count == 0:
+            return
+        timestamps = numpy.memmap(self._get_file(key, segment["id"], "timestamps"), dtype=numpy.int64, mode="r", shape=(count,))
+        ids = numpy.memmap(self._get_file(key, segment["id"], "ids"), dtype=numpy.int64, mode="r", shape=(count,)) if segment["has_ids"] else None
+        values = numpy.memmap(self._get_file(key, segment["id"], "values"), dtype=numpy.dtype(segment["dtype"]), mode="r",
+                              shape=(count,) + tuple(segment["shape"]))
+        first, last = numpy.searchsorted(timestamps, [start, end], side="left")
+        for i in range(first, last, chunk_size):
+            j = min(i + chunk_size, last)
+            yield numpy.array(timestamps[i:j]), None if ids is None else numpy.array(ids[i:j]), numpy.array(values[i:j])
+
+    def create_writer(self, key, start, end):
+        return SegmentWriter(self, key, start, end)
+
+    def add_segment(self, key, segment, info=None):
+        with self.locked():
+            index = self._load_index()
+            entry = index.setdefault(key, {"info": info, "segments": []})
+            entry["segments"].append(segment)
+            self._merge(key, entry)
+            self._save_index(index)
+            self._evict(index)
+
+    def _merge(self, key, entry):
+        #Merges adjacent segments of same format
+        segments = sorted(entry["segments"], key=lambda s: s["start"])
+        merged = []
+        for segment in segments:
+            previous = merged[-1] if merged else None
+            if previous and previous["end"] >= segment["start"]:
+                if segment["count"] == 0 or previous["count"] == 0 or \
+                        (previous["dtype"], previous["shape"], previous["has_ids"]) == (segment["dtype"], segment["shape"], segment["has_ids"]):
+                    self._append_segment(key, previous, segment)
+                    continue
+            merged.append(segment)
+        entry["segments"] = merged
+
+    def _append_segment(self, key, segment, next_segment):
+        if next_segment["count"] > 0:
+            if segment["count"] == 0:
+                for field in "dtype", "shape", "has_ids":
+                    segment[field] = next_segment[field]
+            #Drop overlapping events
+            timestamps = numpy.fromfile(self._get_file(key, next_segment["id"], "timestamps"), dtype=numpy.int64)
+            skip = int(numpy.searchsorted(timestamps, segment["end"], side="left"))
+            record_size = {"timestamps": 8, "ids": 8,
+                           "values": numpy.dtype(segment["dtype"]).itemsize * int(numpy.prod(segment["shape"], dtype=numpy.int64))}
+            for field in RetrievalCache.FIELDS:
+                if field == "ids" and not segment["has_ids"]:
+                    continue
+                with open(self._get_file(key, segment["id"], field), "ab") as dest:
+                    with open(self._get_file(key, next_segment["id"], field), "rb") as src:
+                        src.seek(skip * record_size[field])
+                        shutil.copyfileobj(src, dest)
+            segment["count"] += next_segment["count"] - skip
+        segment["end"] = max(segment["end"], next_segment["end"])
+        segment["size"] = self._get_segment_size(key, segment)
+        segment["access"] = max(segment["access"], next_segment["access"])
+        self._remove_files(key, next_segment)
+
+    def _get_segment_size(self, key, segment):
+        size = 0
+        for field in RetrievalCache.FIELDS:
+            try:
+                size += os.path.getsize(self._get_file(key, segment["id"], field))
+            except OSError:
+                pass
+        return size
+
+    def _remove_files(self, key, segment):
+        for field in RetrievalCache.FIELDS:
+            try:
+                os.remove(self._get_file(key, segment["id"], field))
+            except OSError:
+                pass
+
+    def _evict(self, index):
+        segments = [(segment["access"], key, segment) for key, entry in index.items() for segment in entry["segments"]]
+        size = sum(segment["size"] for _, _, segment in segments)
+        if size <= self.max_size:
+            return
+        for access, key, segment in sorted(segments, key=lambda s: s[0]):
+            if size <= self.max_size:
+                break
+            _logger.debug(f"Evicting cache segment {key}/{segment['id']}")
+            self._remove_files(key, segment)
+            index[key]["segments"].remove(segment)
+            size -= segment["size"]
+            if not index[key]["segments"]:
+                del index[key]
+                shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+        self._save_index(index)
+
+    def get_size(self):
+        with self.locked():
+            index = self._load_index()
+            return sum(segment["size"] for entry in index.values() for segment in entry["segments"])
+
+    def clear(self):
+        with self.locked():
+            index = self._load_index()
+            for key in index.keys():
+                shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+            self._save_index({})
+
+
+class SegmentWriter():
+    """
+    Writes the data retrieved for a gap of the cache progressively into a new segment.
+    It also acts as a sink for the source events, forwarding them to the source.
+    The segment is discarded if data cannot be represented as arrays of a fixed format.
+    """
+    def __init__(self, cache, key, start, end):
+        self.cache = cache
+        self.key = key
+        self.start = start
+        self.end = end
+        self.id = f"{start}_{time.time_ns()}_{threading.get_ident()}"
+        self.files = None
+        self.format = None
+        self.count = 0
+        self.valid = True
+        self.committed = False
+        os.makedirs(os.path.join(cache.path, key), exist_ok=True)
+
+    def write(self, values, timestamps, ids):
+        if not self.valid:
+            return
+        if not isinstance(values, numpy.ndarray) or (timestamps is None) or (values.dtype.kind in "OUSV"):
+            self.valid = False
+            return
+        fmt = (values.dtype.str, list(values.shape[1:]), ids is not None)
+        if self.format is None:
+            self.format = fmt
+            self.files = {field: open(self.cache._get_file(self.key, self.id, field), "wb") for field in RetrievalCache.FIELDS
+                          if field != "ids" or (ids is not None)}
+        elif fmt != self.format:
+            self.valid = False
+            return
+        self.files["timestamps"].write(numpy.ascontiguousarray(timestamps, dtype=numpy.int64).tobytes())
+        if ids is not None:
+            self.files["ids"].write(numpy.ascontiguousarray(ids, dtype=numpy.int64).tobytes())
+        self.files["values"].write(numpy.ascontiguousarray(values).tobytes())
+        self.count += len(values)
+
+    def receive_channel(self, source, *args, **kwargs):
+        self.valid = False
+        source.receive_channel(*args, **kwargs)
+
+    def receive_channel_batch(self, source, channel_name, values, timestamps, ids, *args, **kwargs):
+        array = source.adjust_types(values)
+        try:
+            self.write(array, None if timestamps is None else numpy.asarray(timestamps, dtype=numpy.int64),
+                       None if ids is None else numpy.asarray(ids, dtype=numpy.int64))
+        except Exception:
+            self.valid = False
+        source.receive_channel_batch(channel_name, values if array is None else array, timestamps, ids, *args, **kwargs)
+
+    def close(self):
+        if self.files:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+    def get_segment(self):
+        return {"id": self.id, "start": self.start, "end": self.end, "count": self.count,
+                "dtype": self.format[0] if self.format else "<f8", "shape": self.format[1] if self.format else [],
+                "has_ids": self.format[2] if self.format else False, "access": time.time()}
+
+    def commit(self, info=None):
+        #Adds the segment to the cache, merging it to the adjacent ones
+        self.close()
+        if not self.valid:
+            return self.discard()
+        segment = self.get_segment()
+        segment["size"] = self.cache._get_segment_size(self.key, segment)
+        self.cache.add_segment(self.key, segment, info)
+        self.committed = True
+
+    def discard(self):
+        self.close()
+        if not self.committed:
+            self.cache._remove_files(self.key, self.get_segment())
+
+
+class CacheSink():
+    #Binds a SegmentWriter to a source, to be used as the sink of the retrieval
+    def __init__(self, writer, source):
+        self.writer = writer
+        self.source = source
+
+    def receive_channel(self, *args, **kwargs):
+        self.writer.receive_channel(self.source, *args, **kwargs)
+
+    def receive_channel_batch(self, *args, **kwargs):
+        self.writer.receive_channel_batch(self.source, *args, **kwargs)
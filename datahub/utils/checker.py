@@ -1,109 +1,184 @@
 import re
+import operator
+import functools
+import numpy
 
 CHANNEL_NAME_ALLOWED_SYMBOLS =  ":-"
-CHANNEL_NAME_PATTERN = "[\w" + CHANNEL_NAME_ALLOWED_SYMBOLS + "]"
+CHANNEL_NAME_PATTERN = r"[\w" + CHANNEL_NAME_ALLOWED_SYMBOLS + "]"
 
-def check_msg_single_statement(msg, statement):
-    pattern = r"^(?P<name>" + CHANNEL_NAME_PATTERN + "+)(?P<op>==|!=|<=|>=|>|<)(?P<value>.+)$"
-    match = re.match(pattern, statement)
+STATEMENT_PATTERN = re.compile(r"^(?P<name>" + CHANNEL_NAME_PATTERN + "+)(?P<op>==|!=|<=|>=|>|<)(?P<value>.+)$")
+TOKEN_PATTERN = re.compile(r'\s*(AND|OR|\(|\)|True|False|' + CHANNEL_NAME_PATTERN + r'+(<|>|[!=<>]=)[^\s()]+)\s*')
+STATEMENT_TOKEN_PATTERN = re.compile(r"^" + CHANNEL_NAME_PATTERN + "+([!=<>]=|>|<).+$")
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "<": operator.lt,
+    ">": operator.gt,
+}
+
+def parse_statement(statement):
+    match = STATEMENT_PATTERN.match(statement)
     if not match:
         raise ValueError(f"Invalid statement: {statement}")
     name = match.group("name")
     op = match.group("op")
     value_str = match.group("value")
 
-    if name not in msg:
-        return False
-    actual_value = msg[name]
-
     #Convert the value to the appropriate type (int, float, bool, or str)
-    try:
-        if value_str.lower() == 'true':
-            value = True
-        elif value_str.lower() == 'false':
-            value = False
-        elif value_str.isdigit():
-            value = int(value_str)
-        else:
-            try:
-                value = float(value_str)
-            except ValueError:
-                value = value_str.strip('"\'')  # Remove surrounding quotes for string
-    except ValueError:
-        raise ValueError(f"Invalid value: {value}")
-
-    # Try using eval to perform the comparison
-    #try:
-    #    return eval(f"{repr(actual_value)} {op} {repr(value)}")
-    #except Exception:
-    #    return False
-    # Perform the comparison with no eval to improve performance
-    if op == "==":
-        return actual_value == value
-    elif op == "!=":
-        return actual_value != value
-    elif op == "<=":
-        return actual_value <= value
-    elif op == ">=":
-        return actual_value >= value
-    elif op == "<":
-        return actual_value < value
-    elif op == ">":
-        return actual_value > value
+    if value_str.lower() == 'true':
+        value = True
+    elif value_str.lower() == 'false':
+        value = False
+    elif value_str.isdigit():
+        value = int(value_str)
     else:
+        try:
+            value = float(value_str)
+        except ValueError:
+            value = value_str.strip('"\'')  # Remove surrounding quotes for string
+
+    if op not in OPERATORS:
         raise ValueError(f"Invalid operator: {op}")
+    return name, OPERATORS[op], value
+
+def check_msg_single_statement(msg, statement):
+    name, op, value = parse_statement(statement)
+    if name not in msg:
+        return False
+    return op(msg[name], value)
 
+def tokenize(expression):
+    tokens = TOKEN_PATTERN.findall(expression)
+    # Extract the first element from each tuple in tokens, which contains the actual token.
+    return [token[0] for token in tokens]
 
-def check_msg(msg, statement):
-    def tokenize(expression):
-        #token_pattern = re.compile(r'\s*(AND|OR|\(|\)|True|False|\w+(<|>|[!=<>]=)[^\s()]+)\s*')
-        token_pattern = re.compile(r'\s*(AND|OR|\(|\)|True|False|' + CHANNEL_NAME_PATTERN + '+(<|>|[!=<>]=)[^\s()]+)\s*')
-        tokens = token_pattern.findall(expression)
-        # Extract the first element from each tuple in tokens, which contains the actual token.
-        tokens = [token[0] for token in tokens]
-        return tokens
-
-    def eval_expr(entry, tokens):
-        def parse_value():
-            token = tokens.pop(0)
-            if token == '(':
-                val = eval_expr(entry, tokens)
-                if tokens and tokens[0] == ')':
-                    tokens.pop(0)  # Remove ')'
-                return val
-            elif token == 'True':
-                return True
-            elif token == 'False':
-                return False
-            elif re.match(r"^" + CHANNEL_NAME_PATTERN + "+([!=<>]=|>|<).+$", token):
-                return check_msg_single_statement(entry, token)
-            else:
-                raise ValueError(f"Unexpected token: {token}")
-
-        values = [parse_value()]
 
+class Filter():
+    """
+    Filter expression parsed once, to be evaluated on single messages (dicts channel->value)
+    or on batches of aligned messages, returning a boolean mask.
+    Operators AND and OR have the same precedence and are evaluated from left to right.
+    """
+    def __init__(self, statement):
+        self.statement = statement
+        tokens = tokenize(statement)
+        # Add a check for balanced parentheses
+        if tokens.count('(') != tokens.count(')'):
+            raise ValueError("Unbalanced parentheses in the statement")
+        if len(tokens) == 1: #Speed up normal case (1 simple statement)
+            self.tree = self._parse_value(tokens)
+        else:
+            self.tree = self._parse_expr(tokens)
+        self.check = self._compile(self.tree)
+
+    def _parse_expr(self, tokens):
+        node = self._parse_value(tokens)
         while tokens:
-            if not tokens:
-                break
             op = tokens.pop(0)
             if op == ')':
                 break
-            next_value = parse_value()
-            if op == 'AND':
-                values[-1] = values[-1] and next_value
-            elif op == 'OR':
-                values[-1] = values[-1] or next_value
-            else:
+            next_node = self._parse_value(tokens)
+            if op not in ('AND', 'OR'):
                 raise ValueError(f"Unexpected operator: {op}")
+            node = (op, node, next_node)
+        return node
+
+    def _parse_value(self, tokens):
+        if not tokens:
+            raise ValueError("Unexpected end of statement")
+        token = tokens.pop(0)
+        if token == '(':
+            node = self._parse_expr(tokens)
+            if tokens and tokens[0] == ')':
+                tokens.pop(0)  # Remove ')'
+            return node
+        elif token == 'True':
+            return ("CONST", True)
+        elif token == 'False':
+            return ("CONST", False)
+        elif STATEMENT_TOKEN_PATTERN.match(token):
+            return ("STATEMENT",) + parse_statement(token)
+        else:
+            raise ValueError(f"Unexpected token: {token}")
+
+    def _compile(self, node):
+        kind = node[0]
+        if kind == "CONST":
+            const = node[1]
+            return lambda msg: const
+        if kind == "STATEMENT":
+            _, name, op, value = node
+            def check_statement(msg):
+                if name not in msg:
+                    return False
+                return op(msg[name], value)
+            return check_statement
+        left, right = self._compile(node[1]), self._compile(node[2])
+        #Both sides are evaluated, so that errors are reported as when checking unparsed statements
+        if kind == "AND":
+            def check_and(msg):
+                l, r = left(msg), right(msg)
+                return l and r
+            return check_and
+        def check_or(msg):
+            l, r = left(msg), right(msg)
+            return l or r
+        return check_or
 
-        return values[0]
+    def __call__(self, msg):
+        return self.check(msg)
 
-    tokens = tokenize(statement)
+    def get_mask(self, columns, size):
+        """
+        columns (dict): channel name -> sequence of values of the aligned messages (None if absent).
+        size (int): number of messages.
+        """
+        return self._get_mask(self.tree, columns, size)
 
-    # Add a check for balanced parentheses
-    if tokens.count('(') != tokens.count(')'):
-        raise ValueError("Unbalanced parentheses in the statement")
+    def check_msgs(self, msgs):
+        names = self.get_channels()
+        columns = {name: [msg.get(name, None) for msg in msgs] for name in names}
+        return self.get_mask(columns, len(msgs))
+
+    def get_channels(self, node=None):
+        if node is None:
+            node = self.tree
+        if node[0] == "STATEMENT":
+            return {node[1]}
+        if node[0] == "CONST":
+            return set()
+        return self.get_channels(node[1]) | self.get_channels(node[2])
+
+    def _get_mask(self, node, columns, size):
+        kind = node[0]
+        if kind == "CONST":
+            return numpy.full(size, node[1], dtype=bool)
+        if kind == "STATEMENT":
+            _, name, op, value = node
+            column = columns.get(name, None)
+            if column is None:
+                return numpy.zeros(size, dtype=bool)
+            column = numpy.asarray(column)
+            if column.dtype.kind != "O" and column.ndim == 1:
+                try:
+                    return numpy.asarray(op(column, value), dtype=bool)
+                except TypeError:
+                    pass
+            return numpy.fromiter(((v is not None) and bool(op(v, value)) for v in column), dtype=bool, count=size)
+        left = self._get_mask(node[1], columns, size)
+        right = self._get_mask(node[2], columns, size)
+        return (left & right) if kind == "AND" else (left | right)
+
+
+@functools.lru_cache(maxsize=128)
+def get_filter(statement):
+    return Filter(statement)
+
+def check_msg(msg, statement):
+    return get_filter(statement)(msg)
 
-    if len(tokens) == 1: #Speed up normal case (1 simple statement)
-        return check_msg_single_statement(msg, tokens[0])
-    return eval_expr(msg, tokens)
\ No newline at end of file
+def check_msgs(msgs, statement):
+    return get_filter(statement).check_msgs(msgs)
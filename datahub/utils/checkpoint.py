@@ -0,0 +1,130 @@
+########################################################################################################################
+# Query Checkpoints
+########################################################################################################################
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from http.client import HTTPException
+from datahub import ProtocolError
+
+_logger = logging.getLogger(__name__)
+
+TRANSIENT_ERRORS = (ProtocolError, HTTPException, ConnectionError, socket.timeout, TimeoutError)
+
+
+def is_transient_error(ex):
+    #Errors of the connection or of the stream, which can be recovered by repeating the request
+    return isinstance(ex, TRANSIENT_ERRORS)
+
+
+def get_retry_delay(retry, retry_delay, max_delay=60.0):
+    #Exponential backoff
+    return min(retry_delay * (2 ** retry), max_delay)
+
+
+class Checkpoint():
+    """
+    Records the progress of a query per channel: the timestamp of the last delivered event and completed channels.
+    It is saved periodically to a file, together with the resolved query range, so that an interrupted query can be
+    resumed over the same absolute window.
+    If request_save is defined, it is called when a save is due, and the progress is saved with save(snapshot) once
+    the consumers have stored the data delivered up to the snapshot.
+    """
+    def __init__(self, filename, signature, resume=True, interval=30.0, request_save=None):
+        """
+        filename (str): checkpoint file.
+        signature (dict): identification of the query. A stored checkpoint is only resumed if it matches.
+        resume (bool, optional): if False an existing checkpoint is discarded.
+        interval (float, optional): minimum interval between file updates in seconds.
+        request_save (function, optional): called in place of save when a save is due.
+        """
+        self.filename = filename
+        self.signature = json.loads(json.dumps(signature, default=str))
+        self.interval = interval
+        self.request_save = request_save
+        self.lock = threading.Lock()
+        self.last_save = 0.0
+        self.channels = {}
+        self.range = None
+        self.sequence = 0
+        self.saved_sequence = -1
+        self.removed = False
+        self.resumed = False
+        if resume:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, "r") as f:
+                data = json.load(f)
+            if data.get("signature") == self.signature:
+                self.channels = data.get("channels", {})
+                self.range = data.get("range", None)
+                self.resumed = True
+                _logger.info(f"Resuming query from checkpoint: {self.filename}")
+            else:
+                _logger.warning(f"Checkpoint does not match the query: {self.filename}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            _logger.warning(f"Invalid checkpoint {self.filename}: {str(e)}")
+
+    def get_snapshot(self):
+        #Copy of the current progress, to be saved later
+        with self.lock:
+            self.sequence += 1
+            return self.sequence, json.loads(json.dumps(self.channels))
+
+    def save(self, snapshot=None):
+        if snapshot is None:
+            snapshot = self.get_snapshot()
+        sequence, channels = snapshot
+        with self.lock:
+            #Snapshots older than the saved one are ignored, and nothing is saved after removal
+            if self.removed or sequence <= self.saved_sequence:
+                return
+            data = {"signature": self.signature, "range": self.range, "channels": channels}
+            with open(self.filename + ".tmp", "w") as f:
+                json.dump(data, f)
+            os.replace(self.filename + ".tmp", self.filename)
+            self.saved_sequence = sequence
+
+    def request(self):
+        with self.lock:
+            self.last_save = time.time()
+        if self.request_save is None:
+            self.save()
+        else:
+            self.request_save()
+
+    def remove(self):
+        with self.lock:
+            self.removed = True
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+    def get_last(self, channel):
+        return self.channels.get(channel, {}).get("last", None)
+
+    def is_completed(self, channel):
+        return self.channels.get(channel, {}).get("completed", False)
+
+    def update(self, channel, timestamp):
+        if timestamp is None:
+            return
+        with self.lock:
+            self.channels.setdefault(channel, {})["last"] = int(timestamp)
+            save = (time.time() - self.last_save) > self.interval
+        if save:
+            self.request()
+
+    def set_completed(self, channel):
+        with self.lock:
+            self.channels.setdefault(channel, {})["completed"] = True
+        self.request()
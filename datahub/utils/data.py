@@ -1,6 +1,8 @@
+import numbers
 import secrets
 import string
 import collections
+import threading
 #import pickle
 try:
     import cbor2
@@ -58,4 +60,84 @@ def encode(obj):
     else:
         obj = {"data": obj}
     ret = cbor2.dumps(obj)
-    return ret
\ No newline at end of file
+    return ret
+
+class MessageBuffer():
+    """
+    Bounded queue of (id, timestamp, message) tuples, handed from the receiving thread to the consumer.
+    If full, the oldest entries are discarded and counted as dropped.
+    """
+    def __init__(self, size=100):
+        self.queue = collections.deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, id, timestamp, msg):
+        #Returns True if the oldest entry was dropped
+        with self.condition:
+            dropped = len(self.queue) == self.queue.maxlen
+            if dropped:
+                self.dropped += 1
+            self.queue.append((id, timestamp, msg))
+            self.received += 1
+            self.condition.notify()
+            return dropped
+
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.queue:
+                self.condition.wait(timeout)
+            if self.queue:
+                return self.queue.popleft()
+
+    def get_many(self, max_n=None, timeout=None, as_arrays=False):
+        """
+        Returns all entries available, up to max_n, in a single lock acquisition. Waits up to timeout for the first one.
+        If as_arrays is False returns a list of (id, timestamp, msg) tuples, otherwise the columns built by
+        stack_messages.
+        """
+        with self.condition:
+            if not self.queue:
+                self.condition.wait(timeout)
+            size = len(self.queue) if max_n is None else min(len(self.queue), int(max_n))
+            messages = [self.queue.popleft() for _ in range(size)]
+        return stack_messages(messages) if as_arrays else messages
+
+    def clear(self):
+        with self.condition:
+            self.queue.clear()
+
+    def get_stats(self):
+        with self.condition:
+            return {"size": self.queue.maxlen, "depth": len(self.queue), "received": self.received, "dropped": self.dropped}
+
+
+def stack_messages(messages):
+    """
+    Converts a list of (id, timestamp, message) tuples into columns: a dict with "id" and "timestamp" arrays and one
+    array per channel. Scalars are stacked into numeric arrays (missing values as NaN), arrays of equal shape into
+    arrays with an additional first dimension. Other values result in object arrays.
+    """
+    ret = {"id": np.array([-1 if id is None else id for id, _, _ in messages], dtype=np.int64),
+           "timestamp": np.array([timestamp for _, timestamp, _ in messages])}
+    channels = {}
+    for _, _, msg in messages:
+        channels.update(dict.fromkeys(msg.keys()))
+    for channel in channels:
+        values = [msg.get(channel, None) for _, _, msg in messages]
+        try:
+            if any(value is None for value in values):
+                #Missing values as NaN only in numeric columns: strings such as "1" are not converted
+                numeric = all((value is None) or isinstance(value, (numbers.Number, np.bool_)) for value in values)
+                column = np.array(values, dtype=np.float64) if numeric else None
+            else:
+                column = np.array(values)
+        except (ValueError, TypeError):
+            column = None
+        if column is None or column.dtype.kind in "OV":
+            column = np.empty(len(values), dtype=object)
+            for i, value in enumerate(values):
+                column[i] = value
+        ret[channel] = column
+    return ret
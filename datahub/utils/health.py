@@ -0,0 +1,107 @@
+########################################################################################################################
+# Stream health statistics
+########################################################################################################################
+
+import time
+import bisect
+import threading
+import collections
+
+#Upper edges of the latency histogram bins in seconds (the last bin counts latencies above the last edge)
+LATENCY_BINS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+
+class StreamHealth():
+    """
+    Tracks the pulse ids received from a stream, to tell pulses lost before reception (gaps in the sequence) from
+    the ones dropped by local buffers. The pulse id step is the smallest increment observed, unless given, so that
+    streams at reduced rates are not reported as gaps. Also builds a histogram of the latency between the message
+    timestamp and the local reception time.
+    """
+    WINDOW = 1000
+
+    def __init__(self, step=None, latency_bins=LATENCY_BINS):
+        """
+        step (int, optional): expected pulse id increment. If None, it is the smallest increment received.
+        latency_bins (tuple, optional): upper edges of the latency histogram bins in seconds.
+        """
+        self.step = step
+        self.latency_bins = tuple(latency_bins)
+        self.lock = threading.Lock()
+        self.received = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.dropped = 0
+        self.first_id = None
+        self.last_id = None
+        self.increments = collections.Counter()
+        self.recent = collections.deque()
+        self.recent_ids = set()
+        self.latency_counts = [0] * (len(self.latency_bins) + 1)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.latency_min = None
+        self.latency_max = None
+
+    def add(self, pulse_id, timestamp=None, receive_time=None):
+        """
+        pulse_id (int): pulse id of the received message, or None if the stream has no ids.
+        timestamp (int, optional): message timestamp in nanoseconds.
+        receive_time (float, optional): local reception time in seconds. Default is now.
+        """
+        with self.lock:
+            self.received += 1
+            if timestamp is not None:
+                self._add_latency((time.time() if receive_time is None else receive_time) - timestamp / 1e9)
+            if pulse_id is None:
+                return
+            pulse_id = int(pulse_id)
+            if pulse_id in self.recent_ids:
+                self.duplicates += 1
+                return
+            self.recent.append(pulse_id)
+            self.recent_ids.add(pulse_id)
+            if len(self.recent) > StreamHealth.WINDOW:
+                self.recent_ids.discard(self.recent.popleft())
+            if self.last_id is None:
+                self.first_id = self.last_id = pulse_id
+            elif pulse_id > self.last_id:
+                self.increments[pulse_id - self.last_id] += 1
+                self.last_id = pulse_id
+            else:
+                self.out_of_order += 1
+                self.first_id = min(self.first_id, pulse_id)
+
+    def add_dropped(self, count=1):
+        #Messages received but discarded by local buffers
+        with self.lock:
+            self.dropped += count
+
+    def _add_latency(self, latency):
+        self.latency_counts[bisect.bisect_left(self.latency_bins, latency)] += 1
+        self.latency_sum += latency
+        self.latency_count += 1
+        self.latency_min = latency if self.latency_min is None else min(self.latency_min, latency)
+        self.latency_max = latency if self.latency_max is None else max(self.latency_max, latency)
+
+    def get_step(self):
+        if self.step:
+            return int(self.step)
+        return min(self.increments) if self.increments else 1
+
+    def get_stats(self):
+        with self.lock:
+            step = self.get_step()
+            unique = self.received - self.duplicates
+            if self.first_id is None:
+                expected = gaps = missing = 0
+            else:
+                expected = (self.last_id - self.first_id) // step + 1
+                gaps = sum(count for increment, count in self.increments.items() if increment > step)
+                missing = max(expected - unique, 0)
+            return {"received": self.received, "first_id": self.first_id, "last_id": self.last_id, "step": step,
+                    "expected": expected, "missing": missing, "gaps": gaps, "duplicates": self.duplicates,
+                    "out_of_order": self.out_of_order, "dropped": self.dropped,
+                    "latency_min": self.latency_min, "latency_max": self.latency_max,
+                    "latency_mean": (self.latency_sum / self.latency_count) if self.latency_count else None,
+                    "latency_bins": list(self.latency_bins), "latency_counts": list(self.latency_counts)}
@@ -0,0 +1,156 @@
+########################################################################################################################
+# Incremental JSON parsing
+########################################################################################################################
+
+import re
+import json
+import codecs
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+STRUCTURE = re.compile(r'[\[\]{}"]')
+STRING_END = re.compile(r'["\\]')
+LITERAL_END = re.compile(r"[ \t\n\r,\]}:]")
+
+
+class JsonStreamReader():
+    """
+    Parses a JSON document incrementally from an iterable of byte chunks (e.g. requests' iter_content).
+    Arrays and objects can be iterated element by element, so that memory usage does not depend on the document size:
+    iter_array yields once per element and iter_object once per key, and the caller must consume the corresponding
+    value with read_value, or with a nested iteration, before continuing.
+    """
+    COMPACT_SIZE = 1000000
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _next_chunk(self):
+        #Decoded text of the next chunk, or None after the end of stream
+        if self.eof:
+            return None
+        for chunk in self.chunks:
+            if chunk:
+                return self.decoder.decode(chunk)
+        self.eof = True
+        return self.decoder.decode(b"", final=True)
+
+    def _read(self):
+        #Appends a chunk to the buffer, returns False on end of stream
+        if self.pos > JsonStreamReader.COMPACT_SIZE:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        text = self._next_chunk()
+        if text is None:
+            return False
+        self.buffer += text
+        return not self.eof
+
+    def _scan(self, text, index, state):
+        #Scans text from index for the end of the current value, given the state at index: (depth, in_string,
+        #escape, literal). Returns the end position (None if not in text) and the state at the end of text.
+        depth, in_string, escape, literal = state
+        if literal:
+            match = LITERAL_END.search(text, index)
+            return (None if match is None else match.start()), state
+        size = len(text)
+        while index < size:
+            if escape:
+                index, escape = index + 1, False
+            elif in_string:
+                match = STRING_END.search(text, index)
+                if match is None:
+                    break
+                index = match.end()
+                if match.group() == "\\":
+                    escape = True
+                else:
+                    in_string = False
+                    if depth == 0:
+                        return index, state
+            else:
+                match = STRUCTURE.search(text, index)
+                if match is None:
+                    break
+                index = match.end()
+                char = match.group()
+                if char == '"':
+                    in_string = True
+                elif char in "[{":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return index, state
+        return None, (depth, in_string, escape, literal)
+
+    def _skip_whitespace(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return
+            if not self._read():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def peek(self):
+        self._skip_whitespace()
+        return self.buffer[self.pos]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Invalid JSON stream: expecting '{char}' at {self.pos}, found '{self.buffer[self.pos]}'")
+        self.pos += 1
+
+    def read_value(self):
+        #Received chunks are scanned once for the end of the value, which is then decoded at once
+        self._skip_whitespace()
+        first = self.buffer[self.pos]
+        state = (0, first == '"', False, first not in '[{"')
+        end, state = self._scan(self.buffer, self.pos + (first == '"'), state)
+        if end is None:
+            parts, offset = [self.buffer], len(self.buffer)
+            while end is None:
+                text = self._next_chunk()
+                if text is None:
+                    break
+                end, state = self._scan(text, 0, state)
+                if end is not None:
+                    end += offset
+                parts.append(text)
+                offset += len(text)
+            self.buffer = "".join(parts)
+            if end is None and not state[3]:
+                raise ValueError("Unexpected end of JSON stream")
+        value, self.pos = self.json_decoder.raw_decode(self.buffer, self.pos)
+        return value
+
+    def _iter_members(self, close):
+        if self.peek() == close:
+            self.pos += 1
+            return
+        while True:
+            yield
+            separator = self.peek()
+            self.pos += 1
+            if separator == close:
+                return
+            if separator != ",":
+                raise ValueError(f"Invalid JSON stream: unexpected '{separator}' at {self.pos - 1}")
+
+    def iter_array(self):
+        self.expect("[")
+        for _ in self._iter_members("]"):
+            yield
+
+    def iter_object(self):
+        self.expect("{")
+        for _ in self._iter_members("}"):
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise ValueError(f"Invalid JSON stream: invalid key {key}")
+            self.expect(":")
+            yield key
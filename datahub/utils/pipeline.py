@@ -0,0 +1,143 @@
+########################################################################################################################
+# Receive/decode/dispatch pipeline
+########################################################################################################################
+
+import logging
+import threading
+import collections
+
+_logger = logging.getLogger(__name__)
+
+
+class MessagePipeline():
+    """
+    Decouples the reception of messages from their processing: the receiving thread only stores messages in a bounded
+    ring, which are decoded by worker threads and dispatched by a single thread in the order they were received.
+    If the ring is full, the oldest message waiting to be decoded is dropped (or the new one, if all are decoded),
+    unless the pipeline is blocking.
+    """
+    DROPPED = object()
+
+    def __init__(self, decode, dispatch, size=1000, workers=1, on_drop=None, name="pipeline", block=False):
+        """
+        decode (function): called by the worker threads with a received message. Returns the object to be dispatched,
+                           or None if the message is to be discarded.
+        dispatch (function): called by the dispatching thread with the decoded objects, in reception order.
+        size (int, optional): maximum number of messages in the pipeline, waiting to be decoded or dispatched.
+        workers (int, optional): number of decoding threads.
+        on_drop (function, optional): called by the dispatching thread in place of dispatch for dropped messages.
+        block (bool, optional): if True, put waits for room in the pipeline instead of dropping messages.
+        """
+        self.decode = decode
+        self.dispatch = dispatch
+        self.on_drop = on_drop
+        self.block = block
+        self.size = max(int(size), 1)
+        self.ring = collections.deque()
+        self.results = {}
+        self.condition = threading.Condition()
+        self.result_condition = threading.Condition()
+        self.sequence = 0
+        self.dispatch_sequence = 0
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+        self.high_water = 0
+        self.occupancy = 0
+        self.stopping = False
+        self.aborted = False
+        self.workers = [threading.Thread(target=self._run_worker, name=f"{name} worker {i}", daemon=True)
+                        for i in range(max(int(workers), 1))]
+        self.dispatcher = threading.Thread(target=self._run_dispatcher, name=f"{name} dispatcher", daemon=True)
+        for thread in self.workers + [self.dispatcher]:
+            thread.start()
+
+    def put(self, message):
+        #Called by the receiving thread: only blocks if the pipeline is blocking
+        with self.condition:
+            self.received += 1
+            while self.block and (self.occupancy >= self.size) and not self.stopping:
+                self.condition.wait(0.1)
+            if self.occupancy >= self.size:
+                self.dropped += 1
+                if not self.ring:
+                    #All messages in the pipeline are decoded: drops the new one
+                    self._set_result(self.sequence, MessagePipeline.DROPPED)
+                    self.sequence += 1
+                    return
+                sequence, _ = self.ring.popleft()
+                self._set_result(sequence, MessagePipeline.DROPPED)
+                self.occupancy -= 1
+            self.ring.append((self.sequence, message))
+            self.sequence += 1
+            self.occupancy += 1
+            self.high_water = max(self.high_water, self.occupancy)
+            self.condition.notify()
+
+    def _set_result(self, sequence, result):
+        with self.result_condition:
+            self.results[sequence] = result
+            self.result_condition.notify_all()
+
+    def _run_worker(self):
+        while True:
+            with self.condition:
+                while not self.ring and not self.stopping:
+                    self.condition.wait()
+                if not self.ring:
+                    return
+                sequence, message = self.ring.popleft()
+            try:
+                result = self.decode(message)
+            except Exception as e:
+                _logger.exception("Error decoding message: %s " % str(e))
+                result = None
+            self._set_result(sequence, result)
+
+    def _run_dispatcher(self):
+        while True:
+            with self.result_condition:
+                while (self.dispatch_sequence not in self.results) and not self.aborted:
+                    if self.stopping and (self.dispatch_sequence >= self.sequence):
+                        return
+                    self.result_condition.wait(0.1)
+                if self.aborted:
+                    return
+                result = self.results.pop(self.dispatch_sequence)
+                self.dispatch_sequence += 1
+            try:
+                if result is MessagePipeline.DROPPED:
+                    if self.on_drop:
+                        self.on_drop()
+                elif result is not None:
+                    self.dispatch(result)
+            except Exception as e:
+                _logger.exception("Error dispatching message: %s " % str(e))
+            with self.condition:
+                if result is not MessagePipeline.DROPPED:
+                    self.occupancy -= 1
+                self.processed += 1
+                self.condition.notify_all()
+
+    def close(self, timeout=None, abort=False):
+        """
+        Stops the pipeline. If abort is False, waits for the messages received to be dispatched.
+        """
+        with self.condition:
+            self.stopping = True
+            self.aborted = abort
+            if abort:
+                self.occupancy -= len(self.ring)
+                self.ring.clear()
+            self.condition.notify_all()
+        for thread in self.workers + [self.dispatcher]:
+            thread.join(timeout)
+
+    def get_occupancy(self):
+        #Messages received and not yet dispatched
+        return self.occupancy
+
+    def get_stats(self):
+        with self.condition:
+            return {"size": self.size, "occupancy": self.occupancy, "high_water": self.high_water,
+                    "received": self.received, "dropped": self.dropped, "processed": self.processed}
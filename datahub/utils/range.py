@@ -1,5 +1,6 @@
 import sys
 import time
+import math
 
 from datahub import is_null_str
 from datahub.utils.timing import *
@@ -195,6 +196,10 @@ class QueryRange():
             tm = time.time()
         return tm > self.get_end_sec()
 
+    def is_final(self, delay=0.0):
+        #True if the range has ended more than delay seconds ago, so that stored data is not expected to change
+        return self.has_ended(time.time() - delay)
+
     def is_running(self, tm=None, id=None):
         if tm is None:
             tm = time.time()
@@ -228,6 +233,34 @@ class QueryRange():
         end = self.string_to_datetime(end)
         return datetime.isoformat(end)
 
+    def split(self, shards=None, shard_duration=None):
+        """
+        Splits the range into consecutive sub-ranges, given the number of shards or the shard duration in seconds.
+        Returns a list of (start, end) tuples in seconds.
+        """
+        start, end = self.get_start_sec(), self.get_end_sec()
+        if shard_duration:
+            shard_duration = float(shard_duration)
+            shards = int(math.ceil((end - start) / shard_duration)) if shard_duration > 0 else 1
+        else:
+            shards = int(shards) if shards else 1
+            shard_duration = (end - start) / shards if shards > 0 else 0.0
+        if shards <= 1 or shard_duration <= 0:
+            return [(start, end)]
+        limits = [start + i * shard_duration for i in range(shards)] + [end]
+        return list(zip(limits[:-1], limits[1:]))
+
+    def split_str_iso(self, shards=None, shard_duration=None):
+        #Same as split, returning ISO strings in the time zone of the range start
+        start, end = self.get_start_str_iso(), self.get_end_str_iso()
+        ranges = self.split(shards, shard_duration)
+        if len(ranges) == 1:
+            return [(start, end)]
+        start_date = datetime.fromisoformat(start)
+        limits = [start] + [(start_date + timedelta(seconds=shard_start - self.get_start_sec())).isoformat()
+                            for shard_start, shard_end in ranges[1:]] + [end]
+        return list(zip(limits[:-1], limits[1:]))
+
     def get_start_id(self):
         return self.start_id
 
@@ -1,6 +1,7 @@
 import time
 import datetime
 import logging
+import numpy
 from datetime import datetime, timezone
 
 _logger = logging.getLogger(__name__)
@@ -71,6 +72,18 @@ def convert_timestamp(timestamp, type="nano", from_type=None):
                         return int(timestamp * 1000000000)
     return timestamp
 
+def convert_timestamps(timestamps, type="nano", from_type="nano"):
+    #Vectorized version of convert_timestamp for arrays of nanosecond timestamps
+    if timestamps is None or not type or type == from_type:
+        return timestamps
+    timestamps = numpy.asarray(timestamps)
+    if from_type == "nano":
+        if type == "sec":
+            return timestamps / 1000000000.0
+        elif type == "milli":
+            return timestamps // 1000000
+    return [convert_timestamp(timestamp, type, from_type) for timestamp in timestamps.tolist()]
+
 def time_to_pulse_id(tm=None):
     if not tm:
         tm = time.time()
@@ -0,0 +1,108 @@
+#Minimal Daqbuf server generating CBOR-framed events, for offline tests
+import json
+import struct
+import threading
+import urllib.parse
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import cbor2
+
+RATE = 10.0  #Events per second
+FRAME_SIZE = 50
+
+
+def get_events(beg, end):
+    #Timestamps in ns of the events in the range [beg, end)
+    first = int(beg * RATE)
+    if first / RATE < beg:
+        first += 1
+    last = int(end * RATE)
+    if last / RATE >= end:
+        last -= 1
+    return [int(round(i * 1e9 / RATE)) for i in range(first, last + 1)]
+
+
+def encode_frame(data):
+    payload = cbor2.dumps(data)
+    padding = (8 - (len(payload) % 8)) % 8
+    return struct.pack('<i', len(payload)) + bytes(12) + payload + bytes(padding)
+
+
+class DaqbufHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        pars = dict(urllib.parse.parse_qsl(url.query))
+        if url.path.endswith("/backend/list"):
+            return self.send_body(json.dumps({"backends_available": [{"name": "test"}]}).encode(), "application/json")
+        if not url.path.endswith("/events"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        channel = pars["channelName"]
+        beg = datetime.fromisoformat(pars["begDate"]).timestamp()
+        end = datetime.fromisoformat(pars["endDate"]).timestamp()
+        with self.server.lock:
+            self.server.requests.append((channel, beg, end))
+            fail = self.server.failures > 0
+            if fail:
+                self.server.failures -= 1
+        tss = get_events(beg, end)
+        body = b""
+        for i in range(0, max(len(tss), 1), FRAME_SIZE):
+            frame_tss = tss[i:i + FRAME_SIZE]
+            body += encode_frame({"scalar_type": "f64",
+                                  "tss": frame_tss,
+                                  "pulses": [int(ts // 10000000) for ts in frame_tss],
+                                  "values": [ts / 1e9 for ts in frame_tss],
+                                  "rangeFinal": i + FRAME_SIZE >= len(tss)})
+        if fail:
+            #Breaks the connection in the middle of the stream
+            self.send_response(200)
+            self.send_header("Content-Type", "application/cbor-framed")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.send_body(body, "application/cbor-framed")
+
+
+class DaqbufServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), DaqbufHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        self.failures = 0  #Number of requests to be interrupted
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def get_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/4"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.shutdown()
+        self.server_close()
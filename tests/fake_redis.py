@@ -0,0 +1,144 @@
+import time
+import threading
+import fnmatch
+import redis
+from datahub.utils.data import encode
+
+def parse_id(id):
+    if isinstance(id, bytes):
+        id = id.decode()
+    if id in ("-", "0"):
+        return (0, 0)
+    if id == "+":
+        return (2 ** 64, 0)
+    ms, _, seq = id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+class FakeRedis():
+    """
+    In-memory replacement of redis.Redis implementing the stream commands used by the Redis source.
+    """
+    streams = {}
+    others = {}
+    groups = {}
+    calls = []
+    lock = threading.Lock()
+    type_filter = True
+
+    def __init__(self, host=None, port=None, db=None, decode_responses=False, **kwargs):
+        self.decode_responses = decode_responses
+
+    @staticmethod
+    def reset():
+        FakeRedis.streams, FakeRedis.others, FakeRedis.groups, FakeRedis.calls = {}, {}, {}, []
+        FakeRedis.type_filter = True
+
+    @staticmethod
+    def add(channel, pulse_id, timestamp, value):
+        #Entry IDs are the timestamp in milliseconds, as generated by the server
+        entries = FakeRedis.streams.setdefault(channel, [])
+        ms, seq = int(timestamp // 1000000), 0
+        if entries and parse_id(entries[-1][0])[0] >= ms:
+            ms, seq = parse_id(entries[-1][0])[0], parse_id(entries[-1][0])[1] + 1
+        fields = {b"channel": channel.encode(), b"timestamp": str(timestamp).encode(), b"id": str(pulse_id).encode(),
+                  b"value": encode(value)}
+        entries.append((f"{ms}-{seq}".encode(), fields))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+    def _key(self, key):
+        return key.encode() if (isinstance(key, str) and not self.decode_responses) else key
+
+    def xread(self, streams, count=None, block=None):
+        FakeRedis.calls.append("xread")
+        ret = []
+        for name, last in streams.items():
+            entries = [e for e in FakeRedis.streams.get(name, []) if parse_id(e[0]) > parse_id(last)]
+            if entries:
+                ret.append([self._key(name), entries[:count]])
+        if not ret and block:
+            time.sleep(block / 1000.0)
+        return ret
+
+    def xrange(self, name, min="-", max="+", count=None):
+        FakeRedis.calls.append("xrange")
+        exclusive = isinstance(min, str) and min.startswith("(")
+        low = parse_id(min[1:] if exclusive else min)
+        entries = [e for e in FakeRedis.streams.get(name, [])
+                   if (parse_id(e[0]) > low if exclusive else parse_id(e[0]) >= low) and parse_id(e[0]) <= parse_id(max)]
+        return entries[:count]
+
+    def xgroup_create(self, name, groupname, id="$", mkstream=False):
+        FakeRedis.groups.setdefault((name, groupname), id)
+
+    def xreadgroup(self, groupname, consumername, streams, count=None, block=None):
+        FakeRedis.calls.append("xreadgroup")
+        ret = []
+        with FakeRedis.lock:
+            for name in streams:
+                last = FakeRedis.groups[(name, groupname)]
+                entries = [e for e in FakeRedis.streams.get(name, []) if parse_id(e[0]) > parse_id(last)][:count]
+                if entries:
+                    FakeRedis.groups[(name, groupname)] = entries[-1][0]
+                    ret.append([self._key(name), entries])
+        if not ret and block:
+            time.sleep(block / 1000.0)
+        return ret
+
+    def xack(self, name, groupname, *ids):
+        FakeRedis.calls.append("xack")
+        return len(ids)
+
+    def _keys(self, match):
+        keys = sorted(list(FakeRedis.streams.keys()) + list(FakeRedis.others.keys()))
+        return [self._key(key) for key in keys if match is None or fnmatch.fnmatchcase(key, match)]
+
+    def scan_iter(self, match=None, count=None, _type=None):
+        FakeRedis.calls.append("scan")
+        if _type is not None and not FakeRedis.type_filter:
+            raise redis.exceptions.ResponseError("syntax error")
+        return iter([key for key in self._keys(match) if _type is None or self.type(key) == _type])
+
+    def scan(self, cursor=0, match=None, count=None):
+        FakeRedis.calls.append("scan")
+        keys = self._keys(match)
+        count = count or 10
+        page = keys[cursor:cursor + count]
+        cursor = cursor + count
+        return (cursor if cursor < len(keys) else 0), page
+
+    def type(self, key):
+        key = key.decode() if isinstance(key, bytes) else key
+        return "stream" if key in FakeRedis.streams else FakeRedis.others.get(key, "none")
+
+    def info(self, section=None):
+        return {"db0": {"keys": len(FakeRedis.streams) + len(FakeRedis.others)}}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline():
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    def execute(self):
+        FakeRedis.calls.append("execute")
+        ret = [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+        self.commands = []
+        return ret
@@ -0,0 +1,77 @@
+#Minimal Retrieval server generating the binary event protocol, for offline tests
+import json
+import struct
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from tests.daqbuf_server import get_events
+
+
+def encode_message(payload):
+    return struct.pack(">i", len(payload)) + payload + struct.pack(">i", len(payload))
+
+
+class RetrievalHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type, headers={}):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        #Request status
+        with self.server.lock:
+            self.server.status_requests.append(self.path.split("/")[-1])
+        self.send_body(json.dumps({}).encode(), "application/json")
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        beg = datetime.fromisoformat(query["range"]["startDate"]).timestamp()
+        end = datetime.fromisoformat(query["range"]["endDate"]).timestamp()
+        with self.server.lock:
+            self.server.requests.append((query["channels"], beg, end))
+            reqid = str(len(self.server.requests))
+            fail = self.server.failures > 0
+            if fail:
+                self.server.failures -= 1
+        body = b""
+        for channel in query["channels"]:
+            body += encode_message(b"\x00" + json.dumps({"name": channel, "type": "float64", "byteOrder": "BIG_ENDIAN",
+                                                         "shape": []}).encode())
+            for ts in get_events(beg, end):
+                body += encode_message(b"\x01" + struct.pack(">qqd", ts, ts // 10000000, ts / 1e9))
+        self.send_body(body[:len(body) // 2] if fail else body, "application/octet-stream",
+                       {"x-daqbuffer-request-id": reqid})
+        if fail:
+            self.close_connection = True
+
+
+class RetrievalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), RetrievalHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.status_requests = []
+        self.failures = 0  #Number of requests to be interrupted
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def get_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,69 @@
+import time
+import unittest
+from datahub.utils.align import Align
+
+channels = ["CHANNEL1", "CHANNEL2", "CHANNEL3"]
+
+class AlignTest(unittest.TestCase):
+
+    def run_align(self, records, partial_msg=True, size_buffer=1000, filter=None, channels=channels):
+        received = []
+        align = Align(lambda id, timestamp, msg: received.append((id, msg)), channels, filter=filter,
+                      partial_msg=partial_msg, size_buffer=size_buffer)
+        for id, channel, value in records:
+            align.add(id, id * 10000000, channel, value)
+            align.process()
+        return received
+
+    def test_complete(self):
+        records = [(id, channel, id) for id in range(1, 11) for channel in channels]
+        received = self.run_align(records)
+        self.assertEqual([id for id, msg in received], list(range(1, 11)))
+        self.assertTrue(all(len(msg) == len(channels) for id, msg in received))
+
+    def test_partial(self):
+        #Channel 3 misses odd ids, and data comes unordered
+        records = []
+        for id in range(1, 21):
+            for channel in channels:
+                if channel != channels[2] or id % 2 == 0:
+                    records.append((id, channel, id))
+        records[3], records[4] = records[4], records[3]
+        received = self.run_align(records, partial_msg=True)
+        self.assertEqual([id for id, msg in received], list(range(1, 21)))
+        received = self.run_align(records, partial_msg=False)
+        self.assertEqual([id for id, msg in received], list(range(2, 21, 2)))
+        received = self.run_align(records, partial_msg="after")
+        self.assertEqual([id for id, msg in received], list(range(2, 21)))
+
+    def test_buffer_overflow(self):
+        #Channel 3 never sends: partial messages are emitted when buffer is full
+        records = [(id, channel, id) for id in range(1, 101) for channel in channels[:2]]
+        received = self.run_align(records, partial_msg=True, size_buffer=10)
+        self.assertEqual([id for id, msg in received], list(range(1, 91)))
+
+    def test_filter(self):
+        records = [(id, channel, id) for id in range(1, 11) for channel in channels]
+        received = self.run_align(records, filter="CHANNEL1>5")
+        self.assertEqual([id for id, msg in received], list(range(6, 11)))
+
+    def test_performance(self):
+        #Cost per message should not grow with the buffer size
+        costs = []
+        for size_buffer in 100, 1000, 10000:
+            #Channel 3 arrives with a delay of size_buffer/2 ids: buffer keeps half full
+            delay = size_buffer // 2
+            records = []
+            for id in range(1, 20001):
+                records.append((id, channels[0], id))
+                records.append((id, channels[1], id))
+                if id > delay:
+                    records.append((id - delay, channels[2], id - delay))
+            start = time.time()
+            received = self.run_align(records, size_buffer=size_buffer)
+            cost = (time.time() - start) / len(received)
+            costs.append(cost)
+        self.assertLess(costs[-1], costs[0] * 5)
+
+if __name__ == '__main__':
+    unittest.main()
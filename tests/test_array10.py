@@ -0,0 +1,143 @@
+import json
+import time
+import threading
+import unittest
+import numpy
+import zmq
+from datahub import *
+from unittest import mock
+from datahub.sources.array10 import FrameMerger, FramePool, FrameDecoder
+
+START_ID = 20000000000
+FRAMES = 50
+SHAPE = [4, 6]
+
+class Records(Consumer):
+    def __init__(self, **kwargs):
+        Consumer.__init__(self, **kwargs)
+        self.records = []
+
+    def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
+        self.records.append((pulse_id, value))
+
+class Array10Test(unittest.TestCase):
+
+    def send(self, socket, frames=range(FRAMES)):
+        for i in frames:
+            id = START_ID + i
+            header = {"source": "test", "shape": SHAPE, "type": "uint16", "frame": id}
+            socket.send(json.dumps(header).encode(), zmq.SNDMORE)
+            socket.send(numpy.full(SHAPE, i, dtype=numpy.uint16).tobytes())
+
+    def receive(self, consumer=None, **kwargs):
+        ctx = zmq.Context()
+        socket = ctx.socket(zmq.PUSH)
+        port = socket.bind_to_random_port("tcp://127.0.0.1")
+        try:
+            sender = threading.Thread(target=self.send, args=(socket,), daemon=True)
+            sender.start()
+            consumer = Records() if consumer is None else consumer
+            with Array10(url=f"tcp://127.0.0.1:{port}", mode="PULL", **kwargs) as source:
+                source.add_listener(consumer)
+                source.req(None, None, None, start_id=START_ID, end_id=START_ID + FRAMES - 1, timeout=10.0)
+                stats = source.get_stream_stats()[None]
+            sender.join()
+            return consumer.records, stats
+        finally:
+            socket.close(linger=0)
+            ctx.term()
+
+    def test_receive(self):
+        records, stats = self.receive()
+        self.assertEqual([id for id, _ in records], list(range(START_ID, START_ID + FRAMES)))
+        for i, (_, value) in enumerate(records):
+            self.assertEqual(value.shape, tuple(SHAPE))
+            self.assertEqual(value.dtype, numpy.uint16)
+            self.assertTrue((value == i).all())
+        self.assertEqual(stats["received"], FRAMES)
+        self.assertEqual(stats["missing"], 0)
+
+    def test_pool(self):
+        records, _ = self.receive(pool_size=4)
+        values = [value for _, value in records]
+        self.assertEqual(len({id(value) for value in values}), 4)
+        self.assertTrue(values[0].flags.writeable)
+        self.assertTrue((values[-1] == FRAMES - 1).all())
+
+    def test_pool_queue(self):
+        #Consumers with event queues receive copies of the pooled buffers
+        class Slow(Records):
+            def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
+                time.sleep(0.002)
+                Records.on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs)
+        consumer = Slow(queue_policy="block")
+        records, _ = self.receive(pool_size=2, consumer=consumer)
+        consumer.close()
+        self.assertEqual(len(consumer.records), FRAMES)
+        for id, value in consumer.records:
+            self.assertTrue((value == id - START_ID).all())
+
+    def test_workers(self):
+        ctx = zmq.Context()
+        sockets = [ctx.socket(zmq.PUSH) for _ in range(2)]
+        urls = [f"tcp://127.0.0.1:{socket.bind_to_random_port('tcp://127.0.0.1')}" for socket in sockets]
+        try:
+            #Each endpoint sends half of the frames
+            senders = [threading.Thread(target=self.send, args=(socket, range(i, FRAMES, 2)), daemon=True)
+                       for i, socket in enumerate(sockets)]
+            for sender in senders:
+                sender.start()
+            consumer = Records()
+            with Array10(url=urls, mode="PULL", workers=3) as source:
+                source.add_listener(consumer)
+                source.req(None, None, None, start_id=START_ID, end_id=START_ID + FRAMES - 1, timeout=10.0)
+                stats = source.get_worker_stats()
+            self.assertEqual([id for id, _ in consumer.records], list(range(START_ID, START_ID + FRAMES)))
+            for id, value in consumer.records:
+                self.assertTrue((value == id - START_ID).all())
+            self.assertEqual(len(stats), 3)
+            self.assertEqual(sum(worker["frames"] for worker in stats), FRAMES)
+            self.assertEqual(sum(worker["bytes"] for worker in stats), FRAMES * SHAPE[0] * SHAPE[1] * 2)
+        finally:
+            for socket in sockets:
+                socket.close(linger=0)
+            ctx.term()
+
+    def test_merger(self):
+        merger = FrameMerger(size=10, timeout=0.05)
+        for id in [3, 1, 2, 0, 5, 4]:
+            merger.put(id, None)
+        self.assertEqual([merger.get(1.0)[0] for _ in range(6)], [0, 1, 2, 3, 4, 5])
+        merger.put(8, None)
+        merger.put(7, None)
+        #Frame 6 is missing: the next ones are dispatched after the timeout
+        self.assertEqual(merger.get(1.0)[0], 7)
+        merger.put(6, None)
+        self.assertEqual([merger.get(1.0)[0], merger.get(1.0)[0]], [6, 8])
+        self.assertIsNone(merger.get(0.01))
+        self.assertEqual(merger.get_stats()["late"], 1)
+
+    def test_pool_reuse(self):
+        #A buffer is only reused after the other size-1 buffers: the last size-1 frames are never overwritten
+        for size in 2, 3, 4:
+            pool, held = FramePool(size), []
+            for i in range(20):
+                held.append((i, pool.copy(numpy.full(SHAPE, i, dtype=numpy.uint16))))
+                held = held[-(size - 1):]
+                for value, buffer in held:
+                    self.assertTrue((buffer == value).all())
+
+    def test_decoder(self):
+        decoder = FrameDecoder()
+        data = numpy.arange(24, dtype=numpy.uint16).tobytes()
+        with mock.patch("json.loads", wraps=json.loads) as loads:
+            for frame in range(10):
+                header = json.dumps({"htype": "array-1.0", "type": "uint16", "shape": SHAPE, "frame": frame}).encode()
+                id, array = decoder.decode(header, data)
+                self.assertEqual(id, frame)
+                self.assertEqual(array.shape, tuple(SHAPE))
+        #Headers differing only in the frame number are parsed once
+        self.assertEqual(loads.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
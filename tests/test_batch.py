@@ -0,0 +1,87 @@
+import io
+import os
+import struct
+import tempfile
+import cbor2
+import unittest
+import numpy
+import h5py
+from datahub import *
+
+channel = "CHANNEL"
+size = 100000
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.timestamps = numpy.arange(size, dtype=numpy.int64) * 10000000 + 1700000000000000000
+        self.pulse_ids = numpy.arange(size, dtype=numpy.int64) + 1000
+        self.values = numpy.random.random(size)
+
+    def test_table(self):
+        with Source() as source:
+            source.set_id("batch")
+            table = Table()
+            source.add_listener(table)
+            source.receive_channel_batch(channel, self.values, self.timestamps, self.pulse_ids)
+            dataframe = table.as_dataframe(Table.PULSE_ID)
+            self.assertEqual(len(dataframe), size)
+            self.assertTrue(numpy.array_equal(dataframe[channel].to_numpy(), self.values))
+
+    def test_hdf5(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "batch.h5")
+            with Source() as source:
+                source.set_id("batch")
+                h5 = HDF5Writer(filename)
+                source.add_listener(h5)
+                source.receive_channel_batch(channel, self.values[:size//2], self.timestamps[:size//2], self.pulse_ids[:size//2])
+                for i in range(size//2, size):
+                    source.receive_channel(channel, self.values[i], int(self.timestamps[i]), int(self.pulse_ids[i]))
+                source.close_channels()
+                h5.close()
+            with h5py.File(filename, "r") as f:
+                self.assertTrue(numpy.array_equal(f[f"batch/{channel}/value"][:], self.values))
+                self.assertTrue(numpy.array_equal(f[f"batch/{channel}/id"][:], self.pulse_ids))
+                self.assertTrue(numpy.array_equal(f[f"batch/{channel}/timestamp"][:], self.timestamps))
+
+    def test_fallback(self):
+        values = [1, 2, None, 4]
+        with Source() as source:
+            source.set_id("batch")
+            table = Table()
+            source.add_listener(table)
+            source.receive_channel_batch(channel, values, self.timestamps[:4], self.pulse_ids[:4], check_types=True)
+            self.assertEqual(len(table.data[channel]), 4)
+
+    def test_daqbuf_cbor(self):
+        def frame(data):
+            payload = cbor2.dumps(data)
+            padding = (8 - (len(payload) % 8)) % 8
+            return struct.pack('<i', len(payload)) + bytes(12) + payload + bytes(padding)
+        tss = self.timestamps.tolist()
+        pulses = self.pulse_ids.tolist()
+        stream = frame({"scalar_type": "f32", "values": self.values.tolist()[:10], "tss": tss[:10], "pulses": pulses[:10]}) + \
+                 frame({"scalar_type": "f32", "values": self.values.tolist()[10:20], "tss": tss[10:20], "pulses": pulses[10:20]}) + \
+                 frame({"scalar_type": "enum", "values": [1, 2], "valuestrings": ["ON", "OFF"], "tss": tss[:2], "pulses": pulses[:2], "rangeFinal": True})
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "cbor.h5")
+            with Daqbuf(url="http://localhost:1") as source:
+                source.set_id("daqbuf")
+                h5 = HDF5Writer(filename)
+                table = Table()
+                source.add_listener(h5)
+                source.add_listener(table)
+                source.query, source.running = {}, True
+                source.read_cbor(io.BufferedReader(io.BytesIO(stream)), channel)
+                source.close_channels()
+                h5.close()
+            self.assertEqual(len(table.data[channel]), 2)
+            self.assertEqual(str(table.data[channel][1][channel]), "2:OFF")
+            with h5py.File(filename, "r") as f:
+                self.assertEqual(f[f"daqbuf/{channel}/value"].dtype, numpy.float32)
+                self.assertTrue(numpy.array_equal(f[f"daqbuf/{channel}/value"][:], self.values[:20].astype(numpy.float32)))
+                self.assertEqual(list(f[f"daqbuf/{channel}_1/value"][:]), [1, 2])
+                self.assertEqual([s.decode() for s in f[f"daqbuf/{channel}_1/value_string"][:]], ["ON", "OFF"])
+
+if __name__ == '__main__':
+    unittest.main()
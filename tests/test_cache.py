@@ -0,0 +1,78 @@
+import tempfile
+import threading
+import unittest
+from datahub import *
+from tests.daqbuf_server import DaqbufServer, RATE
+
+channel = "CHANNEL"
+
+class CacheTest(unittest.TestCase):
+
+    def query(self, server, cache, start, end):
+        with Daqbuf(url=server.get_url(), backend="test", delay=0.0, cache=cache) as source:
+            table = Table()
+            source.add_listener(table)
+            source.req([channel], start, end)
+            return [record[Table.PULSE_ID] for record in table.data.get(channel, [])]
+
+    def test_gaps(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = RetrievalCache(folder)
+            with DaqbufServer() as server:
+                ids = self.query(server, cache, "2024-01-01 00:00:10", "2024-01-01 00:00:20")
+                self.assertEqual(len(ids), 10 * RATE)
+                ids = self.query(server, cache, "2024-01-01 00:00:00", "2024-01-01 00:00:30")
+                self.assertEqual(len(ids), 30 * RATE)
+                self.assertEqual(ids, sorted(set(ids)))
+                #Only the gaps before and after the cached interval are retrieved
+                self.assertEqual(len(server.requests), 3)
+                self.assertEqual([end - beg for _, beg, end in server.requests], [10.0, 10.0, 10.0])
+                ids = self.query(server, cache, "2024-01-01 00:00:05", "2024-01-01 00:00:25")
+                self.assertEqual(len(ids), 20 * RATE)
+                self.assertEqual(ids, sorted(set(ids)))
+                self.assertEqual(len(server.requests), 3)
+            #Adjacent intervals are merged
+            key = cache.get_key("Daqbuf", "test", channel, None)
+            self.assertEqual(len(cache.get_plan(key, 0, 2 ** 62)), 3)
+
+    def test_not_final(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = RetrievalCache(folder)
+            with DaqbufServer() as server:
+                for i in range(2):
+                    self.query(server, cache, -2.0, -1.0)
+                self.assertEqual(len(server.requests), 2)
+                self.assertEqual(cache.get_size(), 0)
+
+    def test_eviction(self):
+        with tempfile.TemporaryDirectory() as folder:
+            #Each minute of data takes 600 * 24 bytes
+            cache = RetrievalCache(folder, max_size=(2.5 * 600 * 24) / (1024 * 1024))
+            with DaqbufServer() as server:
+                for minute in range(3):
+                    self.query(server, cache, f"2024-01-01 00:{2 * minute:02d}:00", f"2024-01-01 00:{2 * minute + 1:02d}:00")
+                self.assertLessEqual(cache.get_size(), cache.max_size)
+                self.query(server, cache, "2024-01-01 00:04:00", "2024-01-01 00:05:00")
+                self.assertEqual(len(server.requests), 3)
+                self.query(server, cache, "2024-01-01 00:00:00", "2024-01-01 00:01:00")
+                self.assertEqual(len(server.requests), 4)
+
+    def test_shared_folder(self):
+        #Instances sharing a folder do not lose each other's index updates
+        with tempfile.TemporaryDirectory() as folder:
+            caches = [RetrievalCache(folder), RetrievalCache(folder)]
+            def add(cache, n):
+                for i in range(50):
+                    segment = {"id": "0", "start": 0, "end": 1, "count": 0, "dtype": "<f8", "shape": [],
+                               "has_ids": False, "access": time.time(), "size": 0}
+                    cache.add_segment(f"{n}_{i}", segment)
+            threads = [threading.Thread(target=add, args=(caches[n % 2], n)) for n in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(caches[0]._load_index()), 200)
+            self.assertFalse([f for f in os.listdir(folder) if f.endswith(".tmp")])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import numpy
+from datahub.utils.checker import check_msg, check_msgs, get_filter
+
+msg = {"CHANNEL1": 1.0, "CHANNEL2": 5, "CHANNEL3": "ON"}
+
+class CheckerTest(unittest.TestCase):
+
+    def test_check_msg(self):
+        self.assertTrue(check_msg(msg, "CHANNEL1>0.5"))
+        self.assertFalse(check_msg(msg, "CHANNEL1<0.5"))
+        self.assertFalse(check_msg(msg, "CHANNEL4<0.5"))
+        self.assertTrue(check_msg(msg, "CHANNEL3=='ON'"))
+        self.assertTrue(check_msg(msg, "CHANNEL1<0.5 OR CHANNEL2==5"))
+        self.assertFalse(check_msg(msg, "CHANNEL1<0.5 AND CHANNEL2==5"))
+        self.assertTrue(check_msg(msg, "(CHANNEL1<0.5 AND CHANNEL2==5) OR CHANNEL3!='OFF'"))
+        self.assertFalse(check_msg(msg, "CHANNEL1>0.5 AND (CHANNEL2<3 OR CHANNEL3=='OFF')"))
+        self.assertRaises(ValueError, check_msg, msg, "(CHANNEL1>0.5")
+
+    def test_check_msgs(self):
+        size = 1000
+        msgs = [{"CHANNEL1": float(i), "CHANNEL2": i % 3} for i in range(size)]
+        msgs[10].pop("CHANNEL2")
+        for statement in "CHANNEL1>500", "CHANNEL1>500 AND CHANNEL2==1", "(CHANNEL1<100 OR CHANNEL1>900) AND CHANNEL2!=0":
+            mask = check_msgs(msgs, statement)
+            expected = numpy.array([check_msg(m, statement) for m in msgs])
+            self.assertTrue(numpy.array_equal(mask, expected))
+
+    def test_cache(self):
+        #Statements are parsed once and the compiled filter reused
+        statement = "(CHANNEL1<0.5 AND CHANNEL2==5) OR CHANNEL3!='OFF'"
+        get_filter.cache_clear()
+        for i in range(1000):
+            self.assertTrue(check_msg(msg, statement))
+        self.assertIs(get_filter(statement), get_filter(statement))
+        info = get_filter.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 1001)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import time
+import threading
+import unittest
+from datahub import *
+from tests.daqbuf_server import DaqbufServer, RATE
+
+channels = [f"CHANNEL{i}" for i in range(20)]
+start = "2024-01-01 00:00:00"
+end = "2024-01-01 00:00:10"
+
+class DaqbufServerTest(unittest.TestCase):
+
+    def count_threads(self):
+        #Threads apart from the ones of the server handling the requests
+        return len([thread for thread in threading.enumerate() if "process_request" not in thread.name])
+
+    def test_worker_pool(self):
+        with DaqbufServer() as server:
+            with Daqbuf(url=server.get_url(), backend="test", delay=0.0, max_workers=4) as source:
+                table = Table()
+                source.add_listener(table)
+                source.req(channels, start, end)
+                for channel in channels:
+                    self.assertEqual(len(table.data[channel]), 10 * RATE)
+                self.assertTrue(all(status == "completed" for status in source.get_channel_status().values()))
+            #Each worker reuses its connection (plus one for the backend list)
+            self.assertLessEqual(server.connections, 4 + 1)
+            self.assertEqual(len(server.requests), len(channels))
+
+    def test_serial(self):
+        with DaqbufServer() as server:
+            with Daqbuf(url=server.get_url(), backend="test", delay=0.0, parallel=False) as source:
+                table = Table()
+                source.add_listener(table)
+                source.req(channels[:3], start, end)
+                for channel in channels[:3]:
+                    self.assertEqual(len(table.data[channel]), 10 * RATE)
+            self.assertLessEqual(server.connections, 1 + 1)
+
+    def test_shards(self):
+        for shards in 1, 3, 7:
+            with DaqbufServer() as server:
+                with Daqbuf(url=server.get_url(), backend="test", delay=0.0) as source:
+                    table = Table()
+                    source.add_listener(table)
+                    source.req(channels[:2], start, end, shards=shards, shard_buffer=1, shard_workers=2)
+                    for channel in channels[:2]:
+                        ids = [record[Table.PULSE_ID] for record in table.data[channel]]
+                        self.assertEqual(len(ids), 10 * RATE)
+                        self.assertEqual(ids, sorted(set(ids)))
+                self.assertEqual(len(server.requests), 2 * shards)
+
+    def test_shards_pool(self):
+        #Shards are retrieved by the bounded pool of workers, reusing their connections
+        for parallel in True, False:
+            with DaqbufServer() as server:
+                with Daqbuf(url=server.get_url(), backend="test", delay=0.0, max_workers=2, parallel=parallel) as source:
+                    table = Table()
+                    source.add_listener(table)
+                    threads = self.count_threads()
+                    source.req(channels[:3], start, end, shards=5, shard_buffer=1, background=True)
+                    while source.is_running():
+                        #Processing thread and workers
+                        self.assertLessEqual(self.count_threads(), threads + 1 + 2)
+                        time.sleep(0.001)
+                    source.join()
+                    for channel in channels[:3]:
+                        ids = [record[Table.PULSE_ID] for record in table.data[channel]]
+                        self.assertEqual(ids, sorted(set(ids)))
+                        self.assertEqual(len(ids), 10 * RATE)
+                self.assertEqual(len(server.requests), 3 * 5)
+                self.assertLessEqual(server.connections, 2 + (0 if parallel else 1) + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import math
+import tempfile
+import unittest
+from unittest import mock
+import numpy
+import h5py
+from datahub import *
+from datahub.consumers.h5 import Dataset, DirectChunkWriteDataset
+
+channels = ["SCALAR", "IMAGE"]
+size = 500
+
+class HDF5Test(unittest.TestCase):
+
+    def write(self, filename, **kwargs):
+        with Source() as source:
+            source.set_id("h5")
+            h5 = HDF5Writer(filename, **kwargs)
+            source.add_listener(h5)
+            for i in range(size):
+                source.receive_channel(channels[0], float(i), 1700000000000000000 + i, 1000 + i, check_types=True)
+                source.receive_channel(channels[1], numpy.full((64, 32), i, dtype=numpy.uint16), 1700000000000000000 + i, 1000 + i)
+            source.close_channels()
+            h5.close()
+        return h5
+
+    def check(self, filename):
+        with h5py.File(filename, "r") as f:
+            self.assertTrue(numpy.array_equal(f[f"h5/{channels[0]}/value"][:], numpy.arange(size, dtype=float)))
+            self.assertTrue(numpy.array_equal(f[f"h5/{channels[0]}/id"][:], numpy.arange(size) + 1000))
+            images = f[f"h5/{channels[1]}/value"]
+            self.assertEqual(images.shape, (size, 64, 32))
+            self.assertTrue(numpy.array_equal(images[:, 0, 0], numpy.arange(size, dtype=numpy.uint16)))
+            self.assertTrue((images[-1] == size - 1).all())
+
+    def test_asynchronous(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "async.h5")
+            h5 = self.write(filename, asynchronous=True, queue_size=10)
+            self.check(filename)
+            stats = h5.get_write_stats()
+            self.assertEqual(stats["processed"], 2 * size)
+            self.assertEqual(stats["depth"], 0)
+            self.assertLessEqual(stats["max_depth"], 10 + 2)
+            self.assertGreater(stats["latency_max"], 0.0)
+            self.assertGreaterEqual(stats["latency_max"], stats["latency_mean"])
+
+    def test_parallel_compression(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "parallel.h5")
+            h5 = self.write(filename, compression_workers=4)
+            self.check(filename)
+            with h5py.File(filename, "r") as f:
+                images = f[f"h5/{channels[1]}/value"]
+                self.assertEqual(images.compression, "gzip")
+                self.assertTrue(images.shuffle)
+                #Compressed chunks are smaller than the raw data
+                self.assertLess(images.id.get_storage_size(), images.size * images.dtype.itemsize / 10)
+
+    def test_growth(self):
+        with tempfile.TemporaryDirectory() as folder:
+            with h5py.File(os.path.join(folder, "growth.h5"), "w") as f:
+                dataset = Dataset("h5", "CHANNEL", "value", f, shape=(4,), dtype=numpy.float64, chunk_bytes=3200)
+                chunk = dataset.chunks[0]
+                self.assertEqual(chunk, 100)
+                sizes = set()
+                for i in range(100 * chunk + 1):
+                    dataset.append(numpy.full(4, i, dtype=numpy.float64))
+                    sizes.add(dataset.dataset.shape[0])
+                #Number of resizes is logarithmic
+                self.assertLessEqual(len(sizes), 10)
+                self.assertEqual(dataset.dataset.attrs["valid_length"], 100 * chunk)
+                self.assertGreater(dataset.dataset.shape[0], 100 * chunk)
+                dataset.close()
+                self.assertEqual(dataset.dataset.shape, (100 * chunk + 1, 4))
+                self.assertEqual(dataset.dataset.attrs["valid_length"], 100 * chunk + 1)
+                self.assertEqual(dataset.dataset[-1, 0], 100 * chunk)
+
+    def test_chunks(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "chunks.h5")
+            self.write(filename, chunks={channels[1]: (16, 16)})
+            self.check(filename)
+            with h5py.File(filename, "r") as f:
+                #Chunks of about 1 MiB by default
+                self.assertEqual(f[f"h5/{channels[0]}/value"].chunks, (131072,))
+                self.assertEqual(f[f"h5/{channels[0]}/id"].chunks, (131072,))
+                self.assertEqual(f[f"h5/{channels[1]}/value"].chunks, (1, 16, 16))
+            filename = os.path.join(folder, "chunk_size.h5")
+            self.write(filename, chunk_size=64 * 1024)
+            self.check(filename)
+            with h5py.File(filename, "r") as f:
+                self.assertEqual(f[f"h5/{channels[0]}/value"].chunks, (8192,))
+                self.assertEqual(f[f"h5/{channels[1]}/value"].chunks, (16, 64, 32))
+            with h5py.File(os.path.join(folder, "large.h5"), "w") as f:
+                #Records larger than the target size are one per chunk
+                dataset = Dataset("h5", "CHANNEL", "value", f, shape=(1024, 1024), dtype=numpy.float32)
+                self.assertEqual(dataset.chunks, (1, 1024, 1024))
+
+    def test_swmr(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "swmr.h5")
+            with Source() as source:
+                source.set_id("h5")
+                h5 = HDF5Writer(filename, swmr=True, flush_records=100)
+                source.add_listener(h5)
+                for i in range(size):
+                    source.receive_channel(channels[0], float(i), 1700000000000000000 + i, 1000 + i, check_types=True)
+                    source.receive_channel(channels[1], numpy.full((64, 32), i, dtype=numpy.uint16), 1700000000000000000 + i, 1000 + i)
+                    if i == size // 2:
+                        #Records are visible to readers while the file is being written
+                        with h5py.File(filename, "r", libver="latest", swmr=True) as f:
+                            values = f[f"h5/{channels[0]}/value"]
+                            self.assertGreaterEqual(len(values), size // 2 - 50)
+                            self.assertTrue(numpy.array_equal(values[:], numpy.arange(len(values), dtype=float)))
+                            self.assertNotIn("valid_length", values.attrs)
+                            self.assertEqual(len(f[f"h5/{channels[1]}/value"]), len(f[f"h5/{channels[1]}/id"]))
+                #Channels starting in SWMR mode are rejected once, and their records ignored
+                with self.assertLogs("datahub", level="WARNING") as logs:
+                    for i in range(10):
+                        source.receive_channel("LATE", float(i), 1700000000000000000 + i, 1000 + i, check_types=True)
+                self.assertEqual(len(logs.records), 1)
+                source.close_channels()
+                h5.close()
+            self.check(filename)
+            with h5py.File(filename, "r") as f:
+                self.assertIn("conclusion", f.attrs)
+                self.assertNotIn("h5/LATE", f)
+
+    def count_writes(self, dataset, frames, value):
+        #Number of dataset resizes and attribute writes when appending frames
+        counts = {"resize": 0, "attrs": 0}
+        def counted(key, method):
+            def call(*args, **kwargs):
+                counts[key] += 1
+                return method(*args, **kwargs)
+            return call
+        with mock.patch.object(h5py.Dataset, "resize", counted("resize", h5py.Dataset.resize)), \
+                mock.patch.object(h5py.AttributeManager, "__setitem__", counted("attrs", h5py.AttributeManager.__setitem__)):
+            for i in range(frames):
+                dataset.append(value)
+            dataset.close()
+        self.assertEqual(len(dataset.dataset), frames)
+        return counts["resize"], counts["attrs"]
+
+    def test_benchmark(self):
+        #Appending many frames resizes the dataset a logarithmic number of times, and updates valid_length per chunk
+        frames = 20000
+        with tempfile.TemporaryDirectory() as folder:
+            with h5py.File(os.path.join(folder, "benchmark.h5"), "w") as f:
+                dataset = Dataset("h5", "CHANNEL", "value", f, shape=(4,), dtype=numpy.float64, chunk_bytes=1024)
+                resizes, attrs = self.count_writes(dataset, frames, numpy.arange(4, dtype=numpy.float64))
+                self.assertLessEqual(resizes, 2 * math.log2(frames))
+                self.assertLessEqual(attrs, frames // dataset.rows + 1)
+
+    @unittest.skipUnless(h5py.h5z.filter_avail(Compression.BITSHUFFLE_LZ4), "bitshuffle filter not available")
+    def test_benchmark_direct_chunk(self):
+        frames = 20000
+        with tempfile.TemporaryDirectory() as folder:
+            with h5py.File(os.path.join(folder, "benchmark.h5"), "w") as f:
+                dataset = DirectChunkWriteDataset("h5", "CHANNEL", "value", f, (4,), numpy.uint16, Compression.BITSHUFFLE_LZ4,
+                                                  Compression.BITSHUFFLE_LZ4)
+                resizes, attrs = self.count_writes(dataset, frames, bytes(16))
+                self.assertLessEqual(resizes, 2 * math.log2(frames))
+                self.assertLessEqual(attrs, 2 * math.log2(frames))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import time
+import tempfile
+import unittest
+import h5py
+from datahub import *
+from datahub.utils.health import StreamHealth
+
+class HealthTest(unittest.TestCase):
+
+    def test_sequence(self):
+        health = StreamHealth()
+        for id in [10, 11, 12, 15, 16, 16, 14, 17, 20]:
+            health.add(id)
+        stats = health.get_stats()
+        self.assertEqual(stats["received"], 9)
+        self.assertEqual(stats["step"], 1)
+        self.assertEqual(stats["expected"], 11)
+        self.assertEqual(stats["missing"], 3)
+        self.assertEqual(stats["gaps"], 2)
+        self.assertEqual(stats["duplicates"], 1)
+        self.assertEqual(stats["out_of_order"], 1)
+
+    def test_step(self):
+        health = StreamHealth()
+        for id in range(100, 200, 10):
+            if id != 150:
+                health.add(id)
+        stats = health.get_stats()
+        self.assertEqual(stats["step"], 10)
+        self.assertEqual(stats["expected"], 10)
+        self.assertEqual(stats["missing"], 1)
+        self.assertEqual(stats["gaps"], 1)
+
+    def test_latency(self):
+        health = StreamHealth()
+        now = time.time()
+        for latency in [0.0005, 0.003, 0.003, 20.0]:
+            health.add(None, create_timestamp(now - latency), now)
+        health.add_dropped(2)
+        stats = health.get_stats()
+        self.assertEqual(sum(stats["latency_counts"]), 4)
+        self.assertEqual(stats["latency_counts"][0], 1)
+        self.assertEqual(stats["latency_counts"][2], 2)
+        self.assertEqual(stats["latency_counts"][-1], 1)
+        self.assertAlmostEqual(stats["latency_max"], 20.0, places=3)
+        self.assertEqual(stats["dropped"], 2)
+
+    def test_h5_attributes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "health.h5")
+            source = Source(path="stream")
+            health = source.get_stream_health()
+            for id in [1, 2, 4]:
+                health.add(id)
+            with HDF5Writer(filename) as writer:
+                writer.on_start(source)
+                writer.file.create_group("stream")
+                writer.on_stop(source, None)
+            with h5py.File(filename, "r") as f:
+                attrs = f["stream"].attrs
+                self.assertEqual(attrs["stream_received"], 3)
+                self.assertEqual(attrs["stream_missing"], 1)
+                self.assertEqual(len(attrs["stream_latency_counts"]), len(attrs["stream_latency_bins"]) + 1)
+
+if __name__ == '__main__':
+    unittest.main()
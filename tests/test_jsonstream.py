@@ -0,0 +1,60 @@
+import json
+import unittest
+from datahub import *
+from datahub.utils.jsonstream import JsonStreamReader
+
+def chunks(data, size):
+    data = data.encode()
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+class JsonStreamTest(unittest.TestCase):
+
+    def test_reader(self):
+        doc = {"a": [1, 22222, {"b": "é"}, [3.5, None]], "c": 123456789, "d": []}
+        for size in 1, 3, 1000:
+            reader = JsonStreamReader(chunks(json.dumps(doc), size))
+            ret = {}
+            for key in reader.iter_object():
+                if key == "a":
+                    ret[key] = []
+                    for _ in reader.iter_array():
+                        ret[key].append(reader.read_value())
+                else:
+                    ret[key] = reader.read_value()
+            self.assertEqual(ret, doc)
+
+    def test_large_value(self):
+        #A value spanning many chunks is decoded once
+        doc = [{"name": 'a"[{\\', "values": list(range(i, i + 10))} for i in range(2000)]
+        for size in 1, 7, 100:
+            reader = JsonStreamReader(chunks(json.dumps({"doc": doc, "n": 12345}), size))
+            calls = []
+            decode = reader.json_decoder.raw_decode
+            reader.json_decoder.raw_decode = lambda *args: calls.append(args[1]) or decode(*args)
+            ret = {key: reader.read_value() for key in reader.iter_object()}
+            self.assertEqual(ret, {"doc": doc, "n": 12345})
+            self.assertEqual(len(calls), 4)
+
+    def test_databuffer(self):
+        size = 25000
+        data = [{"channel": {"name": "SCALAR", "backend": "sf-databuffer"},
+                 "data": [{"pulseId": 1000 + i, "globalSeconds": "%.9f" % (1700000000.123456789 + i * 0.01), "value": i * 0.5}
+                          for i in range(size)]},
+                {"data": [{"pulseId": 1000 + i, "globalSeconds": "%.9f" % (1700000000 + i), "value": [i, i + 1]}
+                          for i in range(10)],
+                 "channel": {"name": "WAVEFORM", "backend": "sf-databuffer"}}]
+        with DataBuffer(url="http://localhost:1") as source:
+            table = Table()
+            source.add_listener(table)
+            source.query, source.running = {}, True
+            source.read(JsonStreamReader(chunks(json.dumps(data), 4096)))
+            source.close_channels()
+        self.assertEqual(len(table.data["SCALAR"]), size)
+        self.assertEqual([rec["SCALAR"] for rec in table.data["SCALAR"]], [i * 0.5 for i in range(size)])
+        self.assertEqual([rec[Table.TIMESTAMP] for rec in table.data["SCALAR"]][:10],
+                         [create_timestamp(float(rec["globalSeconds"])) for rec in data[0]["data"][:10]])
+        self.assertEqual(len(table.data["WAVEFORM"]), 10)
+        self.assertEqual(list(table.data["WAVEFORM"][3]["WAVEFORM"]), [3, 4])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import threading
+import unittest
+import numpy
+from datahub.utils.data import MessageBuffer, stack_messages
+
+class MessageBufferTest(unittest.TestCase):
+
+    def test_drops(self):
+        buffer = MessageBuffer(10)
+        for i in range(25):
+            buffer.put(i, i * 1000, {"a": i})
+        stats = buffer.get_stats()
+        self.assertEqual(stats["received"], 25)
+        self.assertEqual(stats["dropped"], 15)
+        self.assertEqual(stats["depth"], 10)
+        messages = buffer.get_many(4)
+        self.assertEqual([id for id, _, _ in messages], [15, 16, 17, 18])
+        self.assertEqual(len(buffer.get_many()), 6)
+        self.assertEqual(buffer.get_many(timeout=0.01), [])
+        self.assertIsNone(buffer.get(timeout=0.01))
+
+    def test_wait(self):
+        buffer = MessageBuffer(10)
+        threading.Timer(0.05, buffer.put, (1, 1000, {"a": 1})).start()
+        self.assertEqual(len(buffer.get_many(10, timeout=5.0)), 1)
+
+    def test_arrays(self):
+        messages = [(i, i * 1000, {"a": i, "b": numpy.ones(3) * i, "c": str(i)}) for i in range(5)]
+        messages[2][2].pop("a")
+        columns = stack_messages(messages)
+        self.assertEqual(columns["id"].tolist(), list(range(5)))
+        self.assertEqual(columns["timestamp"].dtype, numpy.int64)
+        self.assertEqual(columns["a"].dtype, numpy.float64)
+        self.assertTrue(numpy.isnan(columns["a"][2]))
+        self.assertEqual(columns["b"].shape, (5, 3))
+        self.assertEqual(columns["c"].tolist(), ["0", "1", "2", "3", "4"])
+
+    def test_missing_strings(self):
+        messages = [(0, 0, {"a": "1", "b": True}), (1, 1, {}), (2, 2, {"a": "2", "b": False})]
+        columns = stack_messages(messages)
+        self.assertEqual(columns["a"].dtype, object)
+        self.assertEqual(columns["a"].tolist(), ["1", None, "2"])
+        self.assertEqual(columns["b"].dtype, numpy.float64)
+        self.assertTrue(numpy.isnan(columns["b"][1]))
+
+    def test_irregular(self):
+        messages = [(0, 0, {"a": numpy.ones(3)}), (1, 1, {"a": numpy.ones(4)})]
+        columns = stack_messages(messages)
+        self.assertEqual(columns["a"].dtype, object)
+        self.assertEqual(len(columns["a"][1]), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import time
+import random
+import unittest
+from datahub.utils.pipeline import MessagePipeline
+
+class PipelineTest(unittest.TestCase):
+
+    def test_order(self):
+        dispatched = []
+        def decode(msg):
+            time.sleep(random.random() * 0.001)
+            return None if msg % 10 == 0 else msg
+        pipeline = MessagePipeline(decode, dispatched.append, size=10000, workers=4)
+        for i in range(2000):
+            pipeline.put(i)
+        pipeline.close()
+        self.assertEqual(dispatched, [i for i in range(2000) if i % 10 != 0])
+        stats = pipeline.get_stats()
+        self.assertEqual(stats["received"], 2000)
+        self.assertEqual(stats["processed"], 2000)
+        self.assertEqual(stats["dropped"], 0)
+        self.assertEqual(stats["occupancy"], 0)
+
+    def test_drop(self):
+        dispatched, drops = [], []
+        def dispatch(msg):
+            time.sleep(0.01)
+            dispatched.append(msg)
+        pipeline = MessagePipeline(lambda msg: msg, dispatch, size=5, workers=1, on_drop=lambda: drops.append(1))
+        for i in range(100):
+            pipeline.put(i)
+        pipeline.close()
+        stats = pipeline.get_stats()
+        self.assertGreater(stats["dropped"], 0)
+        self.assertLessEqual(stats["high_water"], 5)
+        self.assertEqual(len(drops), stats["dropped"])
+        self.assertEqual(len(dispatched) + stats["dropped"], 100)
+        self.assertEqual(dispatched, sorted(dispatched))
+
+    def test_block(self):
+        dispatched = []
+        def dispatch(msg):
+            time.sleep(0.001)
+            dispatched.append(msg)
+        pipeline = MessagePipeline(lambda msg: msg, dispatch, size=5, workers=2, block=True)
+        for i in range(100):
+            pipeline.put(i)
+        pipeline.close()
+        stats = pipeline.get_stats()
+        self.assertEqual(stats["dropped"], 0)
+        self.assertLessEqual(stats["high_water"], 5)
+        self.assertEqual(dispatched, list(range(100)))
+
+if __name__ == '__main__':
+    unittest.main()
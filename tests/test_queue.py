@@ -0,0 +1,55 @@
+import time
+import unittest
+from datahub import *
+
+channels = ["CHANNEL1", "CHANNEL2"]
+
+class SlowTable(Table):
+    def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
+        time.sleep(0.01)
+        Table.on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs)
+
+class QueueTest(unittest.TestCase):
+
+    def send(self, consumer, records=100):
+        with Source() as source:
+            source.set_id("queue")
+            source.add_listener(consumer)
+            for i in range(records):
+                for channel in channels:
+                    source.receive_channel(channel, float(i), None, i, check_types=True)
+            consumer.queue.flush()
+            source.close_channels()
+
+    def test_block(self):
+        with SlowTable(queue_policy=QueuePolicy.BLOCK, queue_size=10) as table:
+            self.send(table, 20)
+            stats = table.get_queue_stats()
+            self.assertEqual(stats["dropped"], 0)
+            self.assertLessEqual(stats["max_depth"], 10 + 2)
+            self.assertEqual(len(table.data[channels[0]]), 20)
+
+    def test_drop_newest(self):
+        with SlowTable(queue_policy=QueuePolicy.DROP_NEWEST, queue_size=10) as table:
+            self.send(table)
+            stats = table.get_queue_stats()
+            self.assertGreater(stats["dropped"], 0)
+            self.assertEqual(stats["processed"] + stats["dropped"], stats["received"])
+            self.assertEqual(table.data[channels[0]][0][channels[0]], 0.0)
+
+    def test_drop_oldest(self):
+        with SlowTable(queue_policy=QueuePolicy.DROP_OLDEST, queue_size=10) as table:
+            self.send(table)
+            self.assertGreater(table.get_queue_stats()["dropped"], 0)
+            self.assertEqual(table.data[channels[0]][-1][channels[0]], 99.0)
+
+    def test_coalesce(self):
+        with SlowTable(queue_policy=QueuePolicy.COALESCE, queue_size=10) as table:
+            self.send(table)
+            stats = table.get_queue_stats()
+            self.assertGreater(stats["dropped"], 0)
+            for channel in channels:
+                self.assertEqual(table.data[channel][-1][channel], 99.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import time
+import unittest
+from unittest import mock
+from datahub import *
+from tests.fake_redis import FakeRedis
+
+channels = ["CHANNEL1", "CHANNEL2", "CHANNEL3"]
+SIZE = 200
+
+class Records(Consumer):
+    def __init__(self, **kwargs):
+        Consumer.__init__(self, **kwargs)
+        self.records = {}
+
+    def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
+        self.records.setdefault(name, []).append((pulse_id, value))
+
+class RedisBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeRedis.reset()
+        self.patch = mock.patch("datahub.sources.redis.redis.Redis", FakeRedis)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def produce(self, start, channels=channels, size=SIZE, interval=0.001):
+        for i in range(size):
+            for channel in channels:
+                FakeRedis.add(channel, 1000 + i, create_timestamp(start + i * interval), float(i))
+
+    def test_batch(self):
+        now = time.time()
+        self.produce(now)
+        consumer = Records()
+        with Redis(batch_size=50) as source:
+            source.add_listener(consumer)
+            source.req(channels, now - 1.0, now + 0.5, utc_timestamp=False)
+        for channel in channels:
+            self.assertEqual([id for id, _ in consumer.records[channel]], list(range(1000, 1000 + SIZE)))
+            self.assertEqual(consumer.records[channel][-1][1], float(SIZE - 1))
+        #One request per batch (plus the empty ones while waiting for the end of the range)
+        self.assertLess(FakeRedis.calls.count("xread"), SIZE)
+
+    def test_group(self):
+        now = time.time()
+        self.produce(now, ["CHANNEL1"], 1000, 0.0002)
+        consumers = [Records(), Records()]
+        sources = [Redis(batch_size=10, group="test", consumer=f"consumer{i}") for i in range(2)]
+        for source, consumer in zip(sources, consumers):
+            source.add_listener(consumer)
+            source.req(["CHANNEL1"], now - 1.0, now + 0.5, utc_timestamp=False, background=True)
+        for source in sources:
+            source.join()
+            source.close()
+        ids = [[id for id, _ in consumer.records.get("CHANNEL1", [])] for consumer in consumers]
+        self.assertEqual(sorted(ids[0] + ids[1]), list(range(1000, 2000)))
+        self.assertGreater(len(ids[0]), 0)
+        self.assertGreater(len(ids[1]), 0)
+        self.assertIn("xack", FakeRedis.calls)
+
+    def test_seek(self):
+        #Entries before the start of the range are not read, and reading stops after the end
+        now = time.time()
+        self.produce(now - 100.0, size=10)
+        self.produce(now, size=SIZE)
+        self.produce(now + 200.0, size=10)
+        consumer = Records()
+        with Redis(batch_size=50, historical=False) as source:
+            source.add_listener(consumer)
+            source.req(channels, now - 0.1, now + 100.0, utc_timestamp=False)
+        for channel in channels:
+            self.assertEqual([id for id, _ in consumer.records[channel]], list(range(1000, 1000 + SIZE)))
+        self.assertLessEqual(FakeRedis.calls.count("xread"), SIZE // 50 + 1)
+
+    def test_historical(self):
+        now = time.time()
+        #Channels with missing data at the end
+        self.produce(now - 30.0, channels[1:], SIZE)
+        self.produce(now - 30.0, channels[:1], SIZE + 10)
+        consumer = Records()
+        with Redis(batch_size=30) as source:
+            source.add_listener(consumer)
+            source.req(channels, now - 60.0, now - 1.0, utc_timestamp=False)
+        for channel in channels[1:]:
+            self.assertEqual([id for id, _ in consumer.records[channel]], list(range(1000, 1000 + SIZE)))
+        self.assertEqual(len(consumer.records[channels[0]]), SIZE + 10)
+        self.assertNotIn("xread", FakeRedis.calls)
+        #Pages of 30 entries: the last page of the first channel is empty
+        self.assertEqual(FakeRedis.calls.count("xrange"), 8 + 7 + 7)
+
+    def produce_rates(self, start, size, ratio=10, interval=0.0002):
+        #CHANNEL2 runs at a rate ratio times lower than CHANNEL1
+        for i in range(size):
+            FakeRedis.add(channels[0], 1000 + i, create_timestamp(start + i * interval), float(i))
+            if i % ratio == 0:
+                FakeRedis.add(channels[1], 1000 + i, create_timestamp(start + i * interval), float(i))
+
+    def check_rates(self, consumer, size, ratio=10):
+        self.assertEqual([id for id, _ in consumer.records[channels[0]]], list(range(1000, 1000 + size)))
+        self.assertEqual([id for id, _ in consumer.records[channels[1]]], list(range(1000, 1000 + size, ratio)))
+
+    def test_rates(self):
+        #Pages of the default size do not overflow the aligner with channels at different rates
+        now = time.time()
+        self.produce_rates(now - 10.0, 5000)
+        consumer = Records()
+        with Redis(historical=False) as source:
+            source.add_listener(consumer)
+            source.req(channels[:2], now - 11.0, now - 8.0, utc_timestamp=False)
+        self.check_rates(consumer, 5000)
+
+    def test_rates_historical(self):
+        now = time.time()
+        self.produce_rates(now - 10.0, 5000)
+        consumer = Records()
+        with Redis() as source:
+            source.add_listener(consumer)
+            #Aligner buffer smaller than the pages
+            source.req(channels[:2], now - 11.0, now - 8.0, utc_timestamp=False, size_buffer=100)
+        self.check_rates(consumer, 5000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+from datahub import *
+from tests.fake_redis import FakeRedis
+
+class RedisSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeRedis.reset()
+        for i in range(50):
+            FakeRedis.add(f"SARFE10-PSSS059:SPECTRUM{i}", i, 0, 0.0)
+            FakeRedis.add(f"SARES11-CAM{i}:FPICTURE", i, 0, 0.0)
+            FakeRedis.others[f"SARFE10-PSSS059:KEY{i}"] = "string"
+        self.patch = mock.patch("datahub.sources.redis.redis.Redis", FakeRedis)
+        self.patch.start()
+        Redis.search_cache.clear()
+
+    def tearDown(self):
+        self.patch.stop()
+        Redis.search_cache.clear()
+
+    def test_search(self):
+        with Redis() as source:
+            self.assertEqual(len(source.search("PSSS059")), 50)
+            self.assertEqual(len(source.search("psss059", case_sensitive=False)), 50)
+            self.assertEqual(source.search("psss059"), [])
+            self.assertEqual(source.search("CAM7:"), ["SARES11-CAM7:FPICTURE"])
+
+    def test_pipelined_types(self):
+        FakeRedis.type_filter = False
+        with Redis() as source:
+            streams = source.search("SPECTRUM1", case_sensitive=False)
+        self.assertEqual(streams, sorted([f"SARFE10-PSSS059:SPECTRUM{i}" for i in [1] + list(range(10, 20))]))
+        self.assertIn("execute", FakeRedis.calls)
+
+    def test_cache(self):
+        with Redis() as source:
+            source.search("PSSS059")
+            scans = FakeRedis.calls.count("scan")
+            FakeRedis.add("SARFE10-PSSS059:NEW", 0, 0, 0.0)
+            self.assertEqual(len(source.search("PSSS059")), 50)
+            self.assertEqual(FakeRedis.calls.count("scan"), scans)
+            Redis.search_cache.clear()
+            self.assertEqual(len(source.search("PSSS059")), 51)
+
+    def test_cache_pruning(self):
+        #Expired entries are dropped, and the number of entries is bounded
+        with Redis() as source:
+            for i in range(Redis.SEARCH_CACHE_SIZE + 10):
+                source.search(f"SPECTRUM{i}:")
+            self.assertEqual(len(Redis.search_cache), Redis.SEARCH_CACHE_SIZE)
+            with mock.patch.object(Redis, "SEARCH_CACHE_TTL", 0.0):
+                source.search("PSSS059")
+            self.assertEqual(len(Redis.search_cache), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import os
+import time
+import tempfile
+import unittest
+import h5py
+from datahub import *
+from tests.daqbuf_server import DaqbufServer, RATE
+
+channels = ["CHANNEL1", "CHANNEL2"]
+start = "2024-01-01 00:00:00"
+end = "2024-01-01 00:00:30"
+
+class ResumeTest(unittest.TestCase):
+
+    def get_ids(self, table, channel):
+        return [record[Table.PULSE_ID] for record in table.data.get(channel, [])]
+
+    def test_retry(self):
+        with DaqbufServer() as server:
+            server.failures = 3
+            with Daqbuf(url=server.get_url(), backend="test", delay=0.0, retry_delay=0.01) as source:
+                table = Table()
+                source.add_listener(table)
+                source.req(channels, start, end)
+                for channel in channels:
+                    ids = self.get_ids(table, channel)
+                    self.assertEqual(len(ids), 30 * RATE)
+                    self.assertEqual(ids, sorted(set(ids)))
+            self.assertEqual(len(server.requests), len(channels) + 3)
+            #Retries start after the last received event
+            self.assertGreater(max(beg for _, beg, _ in server.requests), min(beg for _, beg, _ in server.requests))
+
+    def test_no_retry(self):
+        with DaqbufServer() as server:
+            server.failures = 1
+            with Daqbuf(url=server.get_url(), backend="test", delay=0.0, retries=0, parallel=False) as source:
+                with self.assertRaises(ProtocolError):
+                    source.req(channels, start, end)
+
+    def test_checkpoint(self):
+        with tempfile.TemporaryDirectory() as folder:
+            checkpoint = os.path.join(folder, "query.checkpoint")
+            with DaqbufServer() as server:
+                server.failures = 1
+                with Daqbuf(url=server.get_url(), backend="test", delay=0.0, retries=0, parallel=False) as source:
+                    table = Table()
+                    source.add_listener(table)
+                    with self.assertRaises(ProtocolError):
+                        source.req(channels, start, end, checkpoint=checkpoint)
+                    first = {channel: self.get_ids(table, channel) for channel in channels}
+                self.assertTrue(os.path.exists(checkpoint))
+                self.assertLess(len(first[channels[0]]), 30 * RATE)
+
+                with Daqbuf(url=server.get_url(), backend="test", delay=0.0, retries=0, parallel=False) as source:
+                    table = Table()
+                    source.add_listener(table)
+                    source.req(channels, start, end, checkpoint=checkpoint, resume=True)
+                    for channel in channels:
+                        ids = first[channel] + self.get_ids(table, channel)
+                        self.assertEqual(len(ids), 30 * RATE)
+                        self.assertEqual(ids, sorted(set(ids)))
+                #Checkpoint is removed when the query completes
+                self.assertFalse(os.path.exists(checkpoint))
+
+    def test_resume_hdf5(self):
+        #Resumed queries appended to a file extend the datasets written before the failure
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "data.h5")
+            checkpoint = os.path.join(folder, "query.checkpoint")
+            with DaqbufServer() as server:
+                server.failures = 1
+                for resume in False, True:
+                    with HDF5Writer(filename, path="data", append=resume) as h5:
+                        with Daqbuf(url=server.get_url(), backend="test", delay=0.0, retries=0, parallel=False) as source:
+                            source.add_listener(h5)
+                            if resume:
+                                source.req(channels, start, end, checkpoint=checkpoint, resume=True)
+                            else:
+                                with self.assertRaises(ProtocolError):
+                                    source.req(channels, start, end, checkpoint=checkpoint)
+            with h5py.File(filename, "r") as f:
+                self.assertEqual(sorted(f["data"].keys()), channels)
+                for channel in channels:
+                    ids = list(f[f"data/{channel}/id"][:])
+                    self.assertEqual(len(ids), 30 * RATE)
+                    self.assertEqual(ids, sorted(set(ids)))
+                    self.assertEqual(len(f[f"data/{channel}/timestamp"]), 30 * RATE)
+                    self.assertEqual(len(f[f"data/{channel}/value"]), 30 * RATE)
+
+    def test_resume_hdf5_str(self):
+        #String timestamps cannot be truncated to the checkpoint: resumed data goes to new groups
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "data.h5")
+            checkpoint = os.path.join(folder, "query.checkpoint")
+            with DaqbufServer() as server:
+                server.failures = 1
+                for resume in False, True:
+                    with HDF5Writer(filename, path="data", append=resume, timetype="str") as h5:
+                        with Daqbuf(url=server.get_url(), backend="test", delay=0.0, retries=0, parallel=False) as source:
+                            source.add_listener(h5)
+                            if resume:
+                                source.req(channels, start, end, checkpoint=checkpoint, resume=True)
+                            else:
+                                with self.assertRaises(ProtocolError):
+                                    source.req(channels, start, end, checkpoint=checkpoint)
+            with h5py.File(filename, "r") as f:
+                self.assertIn(f"{channels[0]}_1", f["data"])
+                for channel in channels:
+                    ids = [id for group in (channel, f"{channel}_1") if group in f["data"] for id in f[f"data/{group}/id"][:]]
+                    self.assertEqual(len(ids), 30 * RATE)
+                    self.assertEqual(ids, sorted(set(ids)))
+
+    def test_checkpoint_ack(self):
+        #Progress is saved only when the consumers have stored the data
+        class Pending(Consumer):
+            acks = []
+            def on_checkpoint(self, source, ack):
+                self.acks.append(ack)
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "query.checkpoint")
+            with Source() as source:
+                consumer = Pending()
+                source.add_listener(consumer)
+                source.add_listener(Table())
+                source.checkpoint = Checkpoint(filename, {}, False, interval=0.0, request_save=source.save_checkpoint)
+                source.checkpoint.update(channels[0], 1000)
+                self.assertFalse(os.path.exists(filename))
+                source.checkpoint.update(channels[0], 2000)
+                consumer.acks[1]()
+                consumer.acks[0]()
+                self.assertEqual(Checkpoint(filename, {}).get_last(channels[0]), 2000)
+
+    def test_checkpoint_crash(self):
+        #A save never covers records that were not dispatched to the consumers
+        class Killed(BaseException):
+            pass
+        class Crash(Consumer):
+            def __init__(self):
+                Consumer.__init__(self, timetype="nano")
+                self.timestamps = []
+            def on_channel_record(self, source, name, timestamp, pulse_id, value, **kwargs):
+                self.timestamps.append(timestamp)
+            def on_checkpoint(self, source, ack):
+                ack()
+                raise Killed()
+        for batch in False, True:
+            with tempfile.TemporaryDirectory() as folder:
+                filename = os.path.join(folder, "query.checkpoint")
+                with Source() as source:
+                    consumer = Crash()
+                    source.add_listener(consumer)
+                    source.checkpoint = Checkpoint(filename, {}, False, interval=0.0, request_save=source.save_checkpoint)
+                    with self.assertRaises(Killed):
+                        if batch:
+                            source.on_channel_records(channels[0], [1000, 2000], [1, 2], [1.0, 2.0])
+                        else:
+                            source.on_channel_record(channels[0], 1000, 1, 1.0)
+                last = Checkpoint(filename, {}).get_last(channels[0])
+                self.assertIn(last, consumer.timestamps)
+
+    def test_signature(self):
+        #Relative ranges match when the query is repeated, and resume over the window resolved by the first run
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "query.checkpoint")
+            ranges = []
+            with DaqbufServer() as server:
+                for resume in False, True:
+                    with Daqbuf(url=server.get_url(), backend="test") as source:
+                        source.query = {"channels": channels, "start": -3600.0, "end": 0.0}
+                        source.range = QueryRange(source.query, source)
+                        source.checkpoint = Checkpoint(filename, source.get_checkpoint_signature(), resume)
+                        source.set_checkpoint_range()
+                        self.assertEqual(source.checkpoint.resumed, resume)
+                        source.checkpoint.save()
+                        ranges.append((source.range.get_start_sec(), source.range.get_end_sec()))
+                    time.sleep(0.01)
+            self.assertEqual(ranges[0], ranges[1])
+
+if __name__ == '__main__':
+    unittest.main()
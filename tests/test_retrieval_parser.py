@@ -0,0 +1,63 @@
+import io
+import json
+import struct
+import unittest
+import numpy
+from datahub import *
+
+def message(payload):
+    return struct.pack(">i", len(payload)) + payload + struct.pack(">i", len(payload))
+
+def header(name, typ, byte_order="BIG_ENDIAN"):
+    return message(b"\x00" + json.dumps({"name": name, "type": typ, "byteOrder": byte_order, "shape": []}).encode())
+
+def event(timestamp, pulse_id, blob):
+    return message(b"\x01" + struct.pack(">qq", timestamp, pulse_id) + blob)
+
+class ChunkedStream(io.RawIOBase):
+    #Returns at most size bytes per read
+    def __init__(self, data, size):
+        self.data, self.pos, self.size = data, 0, size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.size, len(self.data) - self.pos)
+        b[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+class RetrievalParserTest(unittest.TestCase):
+
+    def test_parser(self):
+        size = 20000
+        timestamps = 1700000000000000000 + numpy.arange(size, dtype=numpy.int64) * 10000000
+        values = numpy.random.random(size)
+        big = b"x" * (5 * 1024 * 1024)
+        stream = header("SCALAR", "float64") + b"".join(event(int(timestamps[i]), 1000 + i, struct.pack(">d", values[i])) for i in range(size)) + \
+                 header("STRING", "string") + event(1, 2, b"abc") + event(3, 4, big) + \
+                 header("INT", "int32", "LITTLE_ENDIAN") + b"".join(event(i, i, struct.pack("<i", -i)) for i in range(10)) + \
+                 header("EMPTY", None)
+        for chunk in 1000, 1 << 30:
+            with Retrieval(url="http://localhost:1") as source:
+                table = Table()
+                source.add_listener(table)
+                source.query, source.running = {}, True
+                source.read(io.BufferedReader(ChunkedStream(stream, chunk)))
+            self.assertEqual([rec["SCALAR"] for rec in table.data["SCALAR"]], list(values))
+            self.assertEqual([rec[Table.PULSE_ID] for rec in table.data["SCALAR"]], list(range(1000, 1000 + size)))
+            self.assertEqual([rec[Table.TIMESTAMP] for rec in table.data["SCALAR"]], list(timestamps))
+            self.assertEqual([len(rec["STRING"]) for rec in table.data["STRING"]], [3, len(big)])
+            self.assertEqual([rec["INT"] for rec in table.data["INT"]], [-i for i in range(10)])
+            self.assertEqual(source.completed_channels, {"SCALAR", "STRING", "INT", "EMPTY"})
+
+    def test_truncated(self):
+        stream = header("SCALAR", "float64") + b"".join(event(i, i, struct.pack(">d", i)) for i in range(10))
+        with Retrieval(url="http://localhost:1") as source:
+            source.query, source.running = {}, True
+            with self.assertRaises(ProtocolError):
+                source.read(io.BufferedReader(io.BytesIO(stream[:-10])))
+
+if __name__ == '__main__':
+    unittest.main()
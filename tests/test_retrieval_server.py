@@ -0,0 +1,48 @@
+import unittest
+from datahub import *
+from tests.retrieval_server import RetrievalServer
+from tests.daqbuf_server import RATE
+
+channels = [f"CHANNEL{i}" for i in range(10)]
+start = "2024-01-01 00:00:00"
+end = "2024-01-01 00:00:10"
+
+class RetrievalServerTest(unittest.TestCase):
+
+    def check(self, table, channels):
+        for channel in channels:
+            ids = [record[Table.PULSE_ID] for record in table.data[channel]]
+            self.assertEqual(len(ids), 10 * RATE)
+            self.assertEqual(ids, sorted(set(ids)))
+
+    def test_single_request(self):
+        with RetrievalServer() as server:
+            with Retrieval(url=server.get_url(), backend="sf-databuffer") as source:
+                table = Table()
+                source.add_listener(table)
+                source.req(channels, start, end)
+                self.check(table, channels)
+            self.assertEqual(len(server.requests), 1)
+
+    def test_groups(self):
+        with RetrievalServer() as server:
+            with Retrieval(url=server.get_url(), backend="sf-databuffer", group_size=3, max_workers=2) as source:
+                table = Table()
+                source.add_listener(table)
+                source.req(channels, start, end)
+                self.check(table, channels)
+            self.assertEqual(sorted(len(request[0]) for request in server.requests), [1, 3, 3, 3])
+            #Request status is checked for each sub-request
+            self.assertEqual(sorted(server.status_requests), ["1", "2", "3", "4"])
+
+    def test_retry(self):
+        with RetrievalServer() as server:
+            server.failures = 2
+            with Retrieval(url=server.get_url(), backend="sf-databuffer", group_size=5, retry_delay=0.01) as source:
+                table = Table()
+                source.add_listener(table)
+                source.req(channels, start, end)
+                self.check(table, channels)
+
+if __name__ == '__main__':
+    unittest.main()